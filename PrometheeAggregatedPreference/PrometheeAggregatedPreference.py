@@ -9,7 +9,7 @@ boundary profiles and alternatives vs central (characteristic) profiles.
 Each criterion can have its own preference function (one of six predefined functions).
 
 Usage:
-    PrometheeAggregatedPreference.py -i DIR -o DIR
+    PrometheeAggregatedPreference.py -i DIR -o DIR [--max-memory=MB] [--workers=N] [--format=FORMAT] [--previous=DIR] [--stream] [--cache=DIR] [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -23,21 +23,68 @@ Options:
                    generalised_criteria.xml (optional)
     -o DIR     Specify output directory. Files generated as output:
                    aggregated_preferences.xml
+                   aggregated_preferences.npy (with '--format=npy')
+                   aggregated_preferences.ids (with '--format=npy')
+                   aggregated_preferences.sums.npy (with '--format=npy')
+                   aggregated_preferences.fingerprints.json (with
+                       '--format=npy')
                    messages.xml
+    --max-memory=MB  Memory budget for the aggregated preferences computed at
+               once - when all of them don't fit in it, they are computed
+               and written tile by tile [default: 1024].
+    --workers=N  Number of processes computing the aggregated preferences
+               in parallel, one tile each (0 means one per CPU) [default: 1].
+    --format=FORMAT  Format of the aggregated preferences: 'xml' (XMCDA),
+               'npy' (binary matrix of the preferences, with the ids of its
+               rows/columns in a separate file - for
+               'PrometheeOutrankingFlows' only) or 'both' (e.g. 'tests/out4'
+               is the output for 'tests/in4' with '--format=both')
+               [default: xml].
+    --previous=DIR  Directory with the results of an earlier run (written
+               with '--format=npy' or 'both'), which are updated instead of
+               being computed from scratch - only the preferences of the
+               alternatives (or profiles) added or changed since then are
+               computed. It may be the output directory itself. Requires
+               '--format=npy' or 'both' (e.g. 'tests/out5' is the output for
+               'tests/in5' with '--format=both --previous=tests/out4').
+    --stream   Read the performances of alternatives chunk by chunk (as many
+               of them as fit in '--max-memory' with their preferences) and
+               write their preferences as soon as they're computed, so the
+               memory used doesn't grow with the number of alternatives. For
+               the comparisons with profiles and '--format=xml' only (the
+               pairs are written in the order of 'performance_table.xml'),
+               e.g. 'tests/out6' is the output for 'tests/in6' with
+               '--stream --max-memory=0.001' (chunks of 4 alternatives).
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import hashlib
+import json
 import os
+import shutil
 import sys
+import tempfile
 import traceback
-from functools import partial
+from itertools import chain
+import numpy as np
 from docopt import docopt
 from preferenceFunction import *
-from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict
+from common import compute_tiles, create_messages_file, get_dirs, \
+    get_error_message, get_input_data, get_memory_budget, \
+    get_performance_matrix, get_result_cache, get_sums_file_name, \
+    get_workers, iter_performance_table, load_matrix, matrix_to_pairs, \
+    remove_matrix_index, \
+    save_matrix_index, ComparisonsWriter, InputDataError, MatrixWriter, \
+    Vividict
 
 __version__ = '0.2.0'
 
@@ -64,8 +111,24 @@ params = [
     'thresholds',
     'weights',
     'generalised_criteria',
+    'performance_table_file',
 ]
 
+# Size (in number of pairs) of the blocks of preferences computed at once when
+# alternatives are compared with each other.
+PAIRWISE_BLOCK_SIZE = 2 ** 20
+
+# Minimal number of these blocks - the squares on the diagonal are computed
+# both ways, so they should be a small part of all the pairs.
+MIN_PAIRWISE_BLOCKS = 16
+
+# Estimated memory (in bytes) needed for one pair of compared elements, i.e.
+# its aggregated preference and the temporary arrays of a preference kernel.
+BYTES_PER_PAIR = 64
+
+MATRIX_FILE = 'aggregated_preferences.npy'
+FINGERPRINTS_FILE = 'aggregated_preferences.fingerprints.json'
+
 def get_normalized_weights(weights):
     normalized_weights = {}
     sum_of_weights = sum(weights.values())
@@ -73,113 +136,544 @@ def get_normalized_weights(weights):
         normalized_weights[i] = weights[i]/sum_of_weights
     return normalized_weights
 
-def get_aggregated_preference_indices(comparables_a, comparables_perf_a, comparables_b,
-                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
-                    weights):
+def get_partial_preference_kernels(criteria, generalised_criteria, thresholds,
+                                   pref_directions):
+    """Compiled preference functions (see 'get_partial_preference_kernel')
+    for every criterion.
+    """
+    return dict((c, get_partial_preference_kernel(pref_directions[c],
+                                                  generalised_criteria[c],
+                                                  thresholds[c]))
+                for c in criteria)
+
+def get_aggregated_preference_matrices(perf_a, perf_b, criteria,
+                                       generalised_criteria, thresholds,
+                                       pref_directions, weights):
+    """Aggregated preference indices for every pair (a, b), where 'a' is taken
+    from the rows of 'perf_a' and 'b' from the rows of 'perf_b' (see
+    'get_performance_matrix'), along with the ones for every pair (b, a) - as
+    a transposed array, since both are computed from the same differences.
+    """
+    aggregated_preferences = np.zeros((perf_a.shape[0], perf_b.shape[0]))
+    reversed_preferences = np.zeros((perf_a.shape[0], perf_b.shape[0]))
+    kernels = get_partial_preference_kernels(criteria, generalised_criteria,
+                                             thresholds, pref_directions)
+    for i, c in enumerate(criteria):
+        partial, reversed_partial = kernels[c](perf_a[:, i], perf_b[:, i],
+                                               both_ways=True)
+        aggregated_preferences += partial*weights[c]
+        reversed_preferences += reversed_partial*weights[c]
+    return aggregated_preferences, reversed_preferences.T
+
+def get_symmetric_aggregated_preference_matrix(perf, criteria,
+                                               generalised_criteria,
+                                               thresholds, pref_directions,
+                                               weights):
+    """Same as the first array returned by
+    'get_aggregated_preference_matrices(perf, perf, ...)', but the pairs
+    (a, b) and (b, a) are computed together, only for 'a' not after 'b'
+    (i.e. the upper triangle, one block of rows after another), which halves
+    the work. The diagonal (i.e. the preference of 'a' over itself) is 0.
+    """
+    n = perf.shape[0]
+    aggregated_preferences = np.zeros((n, n))
+    block = max(1, min(PAIRWISE_BLOCK_SIZE // max(1, n),
+                       -(-n // MIN_PAIRWISE_BLOCKS)))
+    kernels = get_partial_preference_kernels(criteria, generalised_criteria,
+                                             thresholds, pref_directions)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        for i, c in enumerate(criteria):
+            partial, reversed_partial = kernels[c](perf[start:end, i],
+                                                   perf[start:, i],
+                                                   both_ways=True)
+            # rows of the block vs. columns from 'start' on (this includes
+            # both directions inside the square on the diagonal) ...
+            aggregated_preferences[start:end, start:] += partial*weights[c]
+            # ... and the rows after the block vs. its columns
+            aggregated_preferences[end:, start:end] += \
+                reversed_partial[:, end - start:].T*weights[c]
+    np.fill_diagonal(aggregated_preferences, 0)
+    return aggregated_preferences
 
-    generalised_criteria_function = {
-        1: UsualCriterion,
-        2: UShapeCriterion,
-        3: VShapeCriterion,
-        4: LevelCriterion,
-        5: VShapeWithIndifferenceCriterion,
-        6: GaussianCriterion,
-    }
-
-    def preference_on_one_criterion(ga,gb,pref_direction,functionNo, threshold):
-        preference_function = generalised_criteria_function[functionNo];
-        _get_linear = partial(get_linear, pref_direction, ga, gb)
-        preference_treshold = _get_linear(threshold.get('preference', 0))
-        indifference_treshold = _get_linear(threshold.get('indifference', 0))
-        sigma_treshold = _get_linear(threshold.get('sigma', 0))
-        difference_between_evaulations = get_difference_between_evaluations(pref_direction, ga, gb)
-        calculated_preference = preference_function(
-                                    difference_between_evaulations,
-                                    preference_treshold,
-                                    indifference_treshold,
-                                    sigma_treshold);
-
-        return calculated_preference
-
-    def get_aggregated_preference(ga,gb, criteria, generalised_criteria, pref_directions, thresholds, weights):
-        result = 0;
-        for c in criteria:
-            result+=preference_on_one_criterion(
-                ga[c],
-                gb[c],
-                pref_directions[c],
-                generalised_criteria[c],
-                thresholds[c]
-            )*weights[c]
-        return result;
+def get_aggregated_preference_tiles(perf_a, perf_b, criteria,
+                                    generalised_criteria, thresholds,
+                                    pref_directions, weights, max_pairs,
+                                    workers=1):
+    """Yields the aggregated preference indices of the rows of 'perf_a' over
+    the rows of 'perf_b' tile by tile (see 'compute_tiles'), as tuples
+    (rows, columns, tile), so at most 'max_pairs' pairs have to be kept in
+    memory at a time. The tiles may be computed by a number of 'workers'
+    processes in parallel. When both arrays are the same one (i.e.
+    alternatives vs. alternatives), the diagonal is 0.
+    """
+    kernels = get_partial_preference_kernels(criteria, generalised_criteria,
+                                             thresholds, pref_directions)
 
+    def _compute_tile(rows, columns, tile):
+        tile.fill(0)
+        for i, c in enumerate(criteria):
+            tile += kernels[c](perf_a[rows, i], perf_b[columns, i])*weights[c]
+        if perf_a is perf_b:
+            diagonal = np.arange(max(rows.start, columns.start),
+                                 min(rows.stop, columns.stop))
+            tile[diagonal - rows.start, diagonal - columns.start] = 0
+
+    return compute_tiles(_compute_tile, perf_a.shape[0], perf_b.shape[0],
+                         max_pairs, workers)
+
+def get_aggregated_preference_blocks(comparables_a, comparables_perf_a, comparables_b,
+                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
+                    weights, max_memory=None, workers=1):
+    """Yields the aggregated preferences of all the compared pairs as blocks,
+    i.e. tuples (rows, columns, block), where 'rows' and 'columns' are the ids
+    related to the rows and columns of the 'block' - in the order in which
+    they are written to the output file.
+    When all the pairs don't fit in 'max_memory' (in bytes), or when there's
+    more than one of 'workers', they are computed tile by tile (see
+    'get_aggregated_preference_tiles') - each tile is released as soon as it
+    has been consumed.
+    """
     two_way_comparison = True if comparables_a != comparables_b else False
+    # categories profiles may come as a dict
+    comparables_b = list(comparables_b)
 
+    perf_a = get_performance_matrix(comparables_a, comparables_perf_a, criteria)
+    pairs_count = len(comparables_a) * len(comparables_b)
+    if two_way_comparison:
+        pairs_count *= 2
+    if max_memory is None:
+        max_pairs = pairs_count
+    else:
+        max_pairs = max_memory // BYTES_PER_PAIR
+
+    def _get_blocks(tiles, rows, columns):
+        for tile_rows, tile_columns, tile in tiles:
+            yield rows[tile_rows], columns[tile_columns], tile
+
+    if pairs_count > max_pairs or workers > 1:
+        args = (criteria, generalised_criteria, thresholds, pref_directions,
+                weights, max_pairs, workers)
+        if two_way_comparison:
+            perf_b = get_performance_matrix(comparables_b, comparables_perf_b,
+                                            criteria)
+            blocks = chain(
+                _get_blocks(get_aggregated_preference_tiles(perf_a, perf_b,
+                                                            *args),
+                            comparables_a, comparables_b),
+                _get_blocks(get_aggregated_preference_tiles(perf_b, perf_a,
+                                                            *args),
+                            comparables_b, comparables_a))
+        else:
+            blocks = _get_blocks(get_aggregated_preference_tiles(perf_a,
+                                                                 perf_a,
+                                                                 *args),
+                                 comparables_a, comparables_a)
+    elif two_way_comparison:
+        perf_b = get_performance_matrix(comparables_b, comparables_perf_b,
+                                        criteria)
+        matrix, reversed_matrix = get_aggregated_preference_matrices(
+                                    perf_a, perf_b, criteria,
+                                    generalised_criteria, thresholds,
+                                    pref_directions, weights)
+        blocks = [(comparables_a, comparables_b, matrix),
+                  (comparables_b, comparables_a, reversed_matrix)]
+    else:
+        matrix = get_symmetric_aggregated_preference_matrix(
+                    perf_a, criteria, generalised_criteria, thresholds,
+                    pref_directions, weights)
+        blocks = [(comparables_a, comparables_a, matrix)]
+    for block in blocks:
+        yield block
+
+def get_aggregated_preference_pairs(*args, **kwargs):
+    """Same as 'get_aggregated_preference_blocks', but yields
+    (a, b, aggregated preference) for every compared pair.
+    """
+    for rows, columns, block in get_aggregated_preference_blocks(*args,
+                                                                 **kwargs):
+        for pair in matrix_to_pairs(block, rows, columns):
+            yield pair
+
+def get_aggregated_preference_indices(comparables_a, comparables_perf_a, comparables_b,
+                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
+                    weights):
     aggregated_preferences = Vividict()
-    for a in comparables_a:
-        for b in comparables_b:
-            temp_preference = get_aggregated_preference(
-                                comparables_perf_a[a],
-                                comparables_perf_b[b],
-                                criteria,
-                                generalised_criteria,
-                                pref_directions,
-                                thresholds,
-                                weights)
-            aggregated_preferences[a][b] = temp_preference
-            if two_way_comparison:
-                temp_preference = get_aggregated_preference(
-                                    comparables_perf_b[b],
-                                    comparables_perf_a[a],
-                                    criteria,
-                                    generalised_criteria,
-                                    pref_directions,
-                                    thresholds,
-                                    weights)
-                aggregated_preferences[b][a] = temp_preference
+    for a, b, preference in get_aggregated_preference_pairs(
+            comparables_a, comparables_perf_a, comparables_b,
+            comparables_perf_b, criteria, generalised_criteria, thresholds,
+            pref_directions, weights):
+        aggregated_preferences[a][b] = preference
     return aggregated_preferences;
 
-def finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir):
+def get_comparables(data):
+    """Returns a tuple (comparables_a, comparables_perf_a, comparables_b,
+    comparables_perf_b), i.e. the compared elements and their performances.
+    """
+    comparables_a = data.alternatives
+    comparables_perf_a = data.performances
+    if data.comparison_with in ('boundary_profiles', 'central_profiles'):
+        comparables_b = data.categories_profiles
+        comparables_perf_b = data.profiles_performance_table
+    else:
+        comparables_b = data.alternatives
+        comparables_perf_b = data.performances
+    return comparables_a, comparables_perf_a, comparables_b, comparables_perf_b
+
+def get_aggregated_preferences(data, max_memory=None, workers=1):
+    """Returns a tuple (comparables_a, comparables_b, blocks), where 'blocks'
+    are the aggregated preferences of 'comparables_a' over 'comparables_b'
+    (and the other way round, when they are profiles) - see
+    'get_aggregated_preference_blocks'.
+    """
+    (comparables_a, comparables_perf_a, comparables_b,
+     comparables_perf_b) = get_comparables(data)
+    normalized_weights = get_normalized_weights(data.weights)
+
+    blocks = get_aggregated_preference_blocks(comparables_a,
+                                              comparables_perf_a,
+                                              comparables_b,
+                                              comparables_perf_b,
+                                              data.criteria,
+                                              data.generalised_criteria,
+                                              data.thresholds,
+                                              data.pref_directions,
+                                              normalized_weights,
+                                              max_memory=max_memory,
+                                              workers=workers)
+    return comparables_a, comparables_b, blocks
+
+def write_streamed_aggregated_preferences(data, output_dir, max_memory=None):
+    """Computes and writes the aggregated preferences of the alternatives and
+    profiles (see '--stream'), i.e. reads the performances of alternatives
+    chunk by chunk (see 'iter_performance_table') and computes the
+    preferences of every chunk over the profiles (and the other way round)
+    at once, from the performances of profiles compiled only once. The
+    preferences of alternatives over profiles are written straight away;
+    the ones of profiles, which come after them in the output, are put
+    aside meanwhile - in a temporary file for every profile. Returns the
+    number of alternatives.
+    """
+    profiles = list(data.categories_profiles)
+    profiles_perf = get_performance_matrix(profiles,
+                                           data.profiles_performance_table,
+                                           data.criteria)
+    normalized_weights = get_normalized_weights(data.weights)
+    args = (data.criteria, data.generalised_criteria, data.thresholds,
+            data.pref_directions, normalized_weights)
+    if max_memory is None:
+        chunk_size = len(data.alternatives)
+    else:
+        chunk_size = max(1, max_memory // BYTES_PER_PAIR // (2 * len(profiles)))
+    count = 0
+    spools = [tempfile.TemporaryFile(dir=output_dir) for p in profiles]
+    try:
+        with ComparisonsWriter(
+                os.path.join(output_dir, 'aggregated_preferences.xml'),
+                mcda_concept='alternativesProfilesComparisons') as writer:
+            for ids, perf in iter_performance_table(
+                    data.performance_table_file, data.alternatives,
+                    data.criteria, chunk_size):
+                matrix, reversed_matrix = get_aggregated_preference_matrices(
+                    perf, profiles_perf, *args)
+                writer.write_block(ids, profiles, matrix)
+                for spool, p, row in zip(spools, profiles, reversed_matrix):
+                    spool.writelines(writer.format_pair(p, a, value)
+                                     for a, value in zip(ids, row.tolist()))
+                count += len(ids)
+            for spool in spools:
+                writer.write_formatted(spool, count)
+    finally:
+        for spool in spools:
+            spool.close()
+    return count
+
+def get_fingerprints(data):
+    """Fingerprints of the compared elements, i.e. hashes of their
+    performances and of everything else which their preferences depend on
+    (criteria, weights, thresholds etc.) - the preferences of an element have
+    to be computed again only when its fingerprint changes.
+    """
+    (comparables_a, comparables_perf_a, comparables_b,
+     comparables_perf_b) = get_comparables(data)
+    model = json.dumps([data.comparison_with, data.criteria, data.weights,
+                        data.generalised_criteria, data.thresholds,
+                        data.pref_directions], sort_keys=True)
+    fingerprints = {}
+    for comparables, performances in ((comparables_a, comparables_perf_a),
+                                      (comparables_b, comparables_perf_b)):
+        comparables = list(comparables)
+        perf = get_performance_matrix(comparables, performances,
+                                      data.criteria)
+        for c, row in zip(comparables, perf):
+            h = hashlib.sha1(model.encode('utf-8'))
+            h.update(row.tobytes())
+            fingerprints[c] = h.hexdigest()
+    return fingerprints
+
+def write_fingerprints(data, output_dir):
+    with open(os.path.join(output_dir, FINGERPRINTS_FILE), 'w') as f:
+        json.dump(get_fingerprints(data), f)
+
+def remove_fingerprints(output_dir):
+    # they don't match a matrix which is being (over)written
+    fingerprints_file = os.path.join(output_dir, FINGERPRINTS_FILE)
+    if os.path.isfile(fingerprints_file):
+        os.remove(fingerprints_file)
+
+def get_matrix_blocks(comparables_a, comparables_b, matrix, index,
+                      max_memory=None):
+    """Yields the aggregated preferences stored in a 'matrix' (along with the
+    'index' of its rows/columns) as blocks of rows, i.e. in the same form as
+    'get_aggregated_preference_blocks' does.
+    """
+    comparables_b = list(comparables_b)
+    if comparables_a == comparables_b:
+        parts = [(comparables_a, comparables_b)]
+    else:
+        parts = [(comparables_a, comparables_b), (comparables_b, comparables_a)]
+    for rows, columns in parts:
+        if max_memory is None:
+            block = len(rows)
+        else:
+            block = max(1, max_memory // BYTES_PER_PAIR // len(columns))
+        columns_index = [index[c] for c in columns]
+        for start in range(0, len(rows), block):
+            part = rows[start:start + block]
+            rows_index = [index[r] for r in part]
+            yield part, columns, matrix[np.ix_(rows_index, columns_index)]
+
+def update_aggregated_preferences(data, previous_dir, output_dir,
+                                  max_memory=None):
+    """Updates the aggregated preferences written (with '--format=npy') to
+    'previous_dir' by an earlier run and saves them in 'output_dir' - only the
+    preferences of the elements added or changed since then (i.e. the ones
+    whose fingerprints differ, see 'get_fingerprints') are computed, which
+    takes O(k * n * m) instead of O(n^2 * m) time for k such elements. The
+    sums of the rows and columns of the matrix (i.e. the flows, see
+    'PrometheeOutrankingFlows') are updated in the same way.
+    The matrix is patched in place, unless some elements have been added or
+    removed (then the preferences which haven't changed are copied).
+    Returns the number of the elements whose preferences have been computed,
+    or None when there's nothing to update (i.e. everything has to be
+    computed from scratch).
+    """
+    previous_file = os.path.join(previous_dir, MATRIX_FILE)
+    output_file = os.path.join(output_dir, MATRIX_FILE)
+    try:
+        with open(os.path.join(previous_dir, FINGERPRINTS_FILE)) as f:
+            previous_fingerprints = json.load(f)
+        previous_matrix, previous_ids = load_matrix(previous_file)
+        previous_sums = np.load(get_sums_file_name(previous_file))
+    except (IOError, ValueError):
+        return None
+
+    (comparables_a, comparables_perf_a, comparables_b,
+     comparables_perf_b) = get_comparables(data)
+    comparables_b = list(comparables_b)
+    if comparables_a == comparables_b:
+        comparables = list(comparables_a)
+        # (changed elements, all the elements they're compared with)
+        groups = [(comparables_a, comparables_perf_a,
+                   comparables_a, comparables_perf_a)]
+    else:
+        comparables = list(comparables_a) + comparables_b
+        groups = [(comparables_a, comparables_perf_a,
+                   comparables_b, comparables_perf_b),
+                  (comparables_b, comparables_perf_b,
+                   comparables_a, comparables_perf_a)]
+    fingerprints = get_fingerprints(data)
+    kept = [c for c in comparables
+            if previous_fingerprints.get(c) == fingerprints[c]]
+    if not kept:
+        return None
+    index = dict((c, i) for i, c in enumerate(comparables))
+    previous_index = dict((c, i) for i, c in enumerate(previous_ids))
+    kept_set = set(kept)
+    kept_new = [index[c] for c in kept]
+    kept_old = [previous_index[c] for c in kept]
+    changed = [index[c] for c in comparables if c not in kept_set]
+    dropped = [previous_index[c] for c in previous_ids if c not in kept_set]
+
+    # sums without the preferences which are dropped (the ones of the
+    # removed and changed elements) - before they're overwritten
+    sums = np.full((2, len(comparables)), np.nan)
+    sums[0, kept_new] = (previous_sums[0, kept_old] -
+                         previous_matrix[:, dropped][kept_old].sum(axis=1))
+    sums[1, kept_new] = (previous_sums[1, kept_old] -
+                         previous_matrix[dropped][:, kept_old].sum(axis=0))
+
+    # an update can't be read before it's complete
+    remove_matrix_index(output_file)
+    remove_fingerprints(output_dir)
+    if previous_ids == comparables:
+        if os.path.abspath(previous_file) != os.path.abspath(output_file):
+            shutil.copyfile(previous_file, output_file)
+        matrix = np.load(output_file, mmap_mode='r+')
+        temp_file = None
+    else:
+        # the previous matrix may be the output file as well
+        temp_file = output_file + '.tmp'
+        matrix = np.lib.format.open_memmap(temp_file, mode='w+', dtype=float,
+                                           shape=(len(comparables),) * 2)
+        matrix.fill(np.nan)
+        block = max(1, PAIRWISE_BLOCK_SIZE // len(comparables))
+        for start in range(0, len(kept), block):
+            rows_new = kept_new[start:start + block]
+            rows_old = kept_old[start:start + block]
+            matrix[np.ix_(rows_new, kept_new)] = \
+                previous_matrix[np.ix_(rows_old, kept_old)]
+
+    normalized_weights = get_normalized_weights(data.weights)
+    for xs, xs_perf, ys, ys_perf in groups:
+        xs = [c for c in xs if c not in kept_set]
+        if not xs:
+            continue
+        ys = list(ys)
+        perf_x = get_performance_matrix(xs, xs_perf, data.criteria)
+        perf_y = get_performance_matrix(ys, ys_perf, data.criteria)
+        columns = [index[c] for c in ys]
+        if max_memory is None:
+            block = len(xs)
+        else:
+            block = max(1, max_memory // BYTES_PER_PAIR // (2 * len(ys)))
+        for start in range(0, len(xs), block):
+            part = xs[start:start + block]
+            rows = [index[c] for c in part]
+            preferences, reversed_preferences = \
+                get_aggregated_preference_matrices(
+                    perf_x[start:start + block], perf_y, data.criteria,
+                    data.generalised_criteria, data.thresholds,
+                    data.pref_directions, normalized_weights)
+            if len(groups) == 1:
+                # preferences of the alternatives over themselves (the
+                # columns are all the comparables then)
+                diagonal = np.arange(len(part))
+                preferences[diagonal, rows] = 0
+                reversed_preferences[rows, diagonal] = 0
+            matrix[np.ix_(rows, columns)] = preferences
+            matrix[np.ix_(columns, rows)] = reversed_preferences
+
+    sums[0, kept_new] += matrix[:, changed][kept_new].sum(axis=1)
+    sums[1, kept_new] += matrix[changed][:, kept_new].sum(axis=0)
+    sums[0, changed] = matrix[changed].sum(axis=1)
+    sums[1, changed] = matrix[:, changed].sum(axis=0)
+    matrix.flush()
+    del matrix
+    if temp_file is not None:
+        os.rename(temp_file, output_file)
+    save_matrix_index(output_file, comparables, sums)
+    write_fingerprints(data, output_dir)
+    return len(changed)
+
+def finalize(data, comparables_a, comparables_b, aggregated_preferences,
+             output_dir, output_format='xml',
+             log_messages=('Everything OK.',)):
+    """'aggregated_preferences' is an iterable of (rows, columns, block)
+    tuples (see 'get_aggregated_preference_blocks'), which are written one by
+    one - as XMCDA ('aggregated_preferences.xml'), as a binary matrix
+    ('aggregated_preferences.npy' and '.ids', see 'MatrixWriter', along with
+    the fingerprints of the compared elements, see 'get_fingerprints') or
+    both, depending on 'output_format'.
+    """
     if data.comparison_with in ('boundary_profiles', 'central_profiles'):
         mcda_concept = 'alternativesProfilesComparisons'
+        comparables = list(comparables_a) + list(comparables_b)
     else:
         mcda_concept = None
-    comparables = (comparables_a, comparables_b)
-    xmcda = comparisons_to_xmcda(aggregated_preferences, comparables,
-                                 mcda_concept=mcda_concept)
-    write_xmcda(xmcda, os.path.join(output_dir, 'aggregated_preferences.xml'))
-    create_messages_file(None, ('Everything OK.',), output_dir);
+        comparables = comparables_a
+    writers = []
+    if output_format in ('xml', 'both'):
+        writers.append(ComparisonsWriter(
+            os.path.join(output_dir, 'aggregated_preferences.xml'),
+            mcda_concept=mcda_concept))
+    if output_format in ('npy', 'both'):
+        remove_fingerprints(output_dir)
+        writers.append(MatrixWriter(os.path.join(output_dir, MATRIX_FILE),
+                                    comparables))
+    # every block is written by all the writers, so it's computed only once
+    for rows, columns, block in aggregated_preferences:
+        for writer in writers:
+            writer.write_block(rows, columns, block)
+    for writer in writers:
+        writer.close()
+    if output_format in ('npy', 'both'):
+        write_fingerprints(data, output_dir)
+    create_messages_file(None, log_messages, output_dir);
 
 def main():
     try:
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
+        max_memory = get_memory_budget(args)
+        workers = get_workers(args)
+        output_format = args.get('--format') or 'xml'
+        if output_format not in ('xml', 'npy', 'both'):
+            raise InputDataError("Invalid value of the '--format' option: "
+                                 "'{}'.".format(output_format))
+        previous_dir = args.get('--previous')
+        if previous_dir is not None and output_format == 'xml':
+            raise InputDataError("The '--previous' option requires "
+                                 "'--format=npy' or '--format=both'.")
         data = get_input_data(input_dir, filenames, params)
+        if args.get('--stream'):
+            if data.comparison_with not in ('boundary_profiles',
+                                            'central_profiles'):
+                raise InputDataError("The '--stream' option requires the "
+                                     "comparisons with profiles.")
+            if output_format != 'xml' or previous_dir is not None:
+                raise InputDataError("The '--stream' option requires "
+                                     "'--format=xml' (without "
+                                     "'--previous').")
+            write_streamed_aggregated_preferences(data, output_dir,
+                                                  max_memory)
+            create_messages_file(None, ('Everything OK.',), output_dir)
+            if result_cache is not None:
+                result_cache.store()
+            return 0
 
-        comparables_a = data.alternatives
-        comparables_perf_a = data.performances
-        normalized_weights = get_normalized_weights(data.weights)
-
-        if data.comparison_with in ('boundary_profiles', 'central_profiles'):
-            comparables_b = data.categories_profiles
-            comparables_perf_b = data.profiles_performance_table
+        updated = None
+        if previous_dir is not None:
+            updated = update_aggregated_preferences(data, previous_dir,
+                                                    output_dir, max_memory)
+        if updated is None:
+            log_messages = ('Everything OK.',)
+            if previous_dir is not None:
+                log_messages += ("No results to update in '{}', all the "
+                                 "aggregated preferences have been computed."
+                                 .format(previous_dir),)
+            (comparables_a, comparables_b, aggregated_preferences) = \
+                get_aggregated_preferences(data, max_memory=max_memory,
+                                           workers=workers)
+            finalize(data, comparables_a, comparables_b,
+                     aggregated_preferences, output_dir, output_format,
+                     log_messages)
         else:
-            comparables_b = data.alternatives
-            comparables_perf_b = data.performances
-
-        aggregated_preferences = get_aggregated_preference_indices(
-                                        comparables_a,
-                                        comparables_perf_a,
-                                        comparables_b,
-                                        comparables_perf_b,
-                                        data.criteria,
-                                        data.generalised_criteria,
-                                        data.thresholds,
-                                        data.pref_directions,
-                                        normalized_weights)
-        finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir)
+            log_messages = ('Everything OK.',
+                            "Aggregated preferences updated, the ones of {} "
+                            "element(s) have been computed.".format(updated))
+            if output_format == 'both':
+                # XMCDA can't be patched, so it's written from the matrix
+                comparables_a, _, comparables_b, _ = get_comparables(data)
+                matrix, ids = load_matrix(os.path.join(output_dir,
+                                                       MATRIX_FILE))
+                index = dict((c, i) for i, c in enumerate(ids))
+                blocks = get_matrix_blocks(comparables_a, comparables_b,
+                                           np.asarray(matrix), index,
+                                           max_memory)
+                finalize(data, comparables_a, comparables_b, blocks,
+                         output_dir, 'xml', log_messages)
+            else:
+                create_messages_file(None, log_messages, output_dir)
+        if result_cache is not None:
+            # without 'Everything OK.', which is always the first one
+            result_cache.store(log_messages[1:])
 
         return 0
 
@@ -10,7 +10,7 @@ defined (one for each criterion where 'reinforced_preference' threshold is
 present).
 
 Usage:
-    PrometheeAggregatedPreferenceReinforcedPreference.py -i DIR -o DIR
+    PrometheeAggregatedPreferenceReinforcedPreference.py -i DIR -o DIR [--max-memory=MB] [--workers=N] [--cache=DIR] [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -26,6 +26,17 @@ Options:
     -o DIR     Specify output directory. Files generated as output:
                    aggregated_preferences.xml
                    messages.xml
+    --max-memory=MB  Memory budget for the aggregated preferences computed at
+               once - when all of them don't fit in it, they are computed
+               and written tile by tile [default: 1024].
+    --workers=N  Number of processes computing the aggregated preferences
+               in parallel, one tile each (0 means one per CPU) [default: 1].
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
@@ -35,11 +46,13 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import os
 import sys
 import traceback
-from functools import partial
+import numpy as np
 from docopt import docopt
 from preferenceFunction import *
-from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict
+from common import compute_symmetric_tiles, compute_tiles, \
+    create_messages_file, get_dirs, get_error_message, get_input_data, \
+    get_memory_budget, get_performance_matrix, get_result_cache, \
+    get_workers, matrix_to_pairs, tiles_to_pairs, write_comparisons_xmcda
 
 __version__ = '0.2.0'
 
@@ -70,6 +83,18 @@ params = [
     'generalised_criteria_without_gaussian',
 ]
 
+# Size (in number of pairs) of the blocks of preferences computed at once when
+# alternatives are compared with each other.
+PAIRWISE_BLOCK_SIZE = 2 ** 20
+
+# Minimal number of these blocks - the squares on the diagonal are computed
+# both ways, so they should be a small part of all the pairs.
+MIN_PAIRWISE_BLOCKS = 16
+
+# Estimated memory (in bytes) needed for one pair of compared elements, i.e.
+# its weighted sums of preferences and the temporary arrays of a kernel.
+BYTES_PER_PAIR = 96
+
 def get_normalized_weights(weights):
     normalized_weights = {}
     sum_of_weights = sum(weights.values())
@@ -77,110 +102,170 @@ def get_normalized_weights(weights):
         normalized_weights[i] = weights[i]/sum_of_weights
     return normalized_weights
 
-def get_aggregated_preference_indices(comparables_a, comparables_perf_a, comparables_b,
-                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
-                    weights, reinforcement_factors):
-
-    generalised_criteria_function = {
-        1: UsualCriterion,
-        2: UShapeCriterion,
-        3: VShapeCriterion,
-        4: LevelCriterion,
-        5: VShapeWithIndifferenceCriterion,
-    }
-
-    def preference_on_one_criterion(ga,gb,pref_direction,functionNo, threshold):
-        preference_function = generalised_criteria_function[functionNo];
-
-        _get_linear = partial(get_linear, pref_direction, ga, gb)
-        preference_threshold = _get_linear(threshold.get('preference', 0))
-        indifference_threshold = _get_linear(threshold.get('indifference', 0))
-        reinforced_threshold = _get_linear(threshold.get('reinforced_preference', 0))
-
-        difference_between_evaulations = get_difference_between_evaluations(pref_direction, ga, gb)
-
-        crossed = False
-        if reinforced_threshold is not None \
-             and difference_between_evaulations > reinforced_threshold:
-            crossed = True
-        calculated_preference = preference_function(
-                                    difference_between_evaulations,
-                                    preference_threshold,
-                                    indifference_threshold)
-        return (calculated_preference, crossed)
-
-    def get_partial_preferences(comp_a, comp_b, comp_perf_a, comp_perf_b, criteria, gen_criteria, pref_dir, thresholds, reinforcement_factors, two_way_comp):
-        partial_preferences = Vividict()
-        rp_crossed = {}
-        for a in comp_a:
-            for b in comp_b:
-                for c in criteria:
-                    pp, crossed = preference_on_one_criterion(
-                                        comp_perf_a[a][c],
-                                        comp_perf_b[b][c],
-                                        pref_dir[c],
-                                        gen_criteria[c],
-                                        thresholds[c])
-                    if crossed:
-                        rf = reinforcement_factors.get(c, 1)
-                        rp_crossed.update({(a, b, c): rf})
-                    partial_preferences[a][b][c] = pp
-
-                    if two_way_comp:
-                        pp, crossed = preference_on_one_criterion(
-                                            comp_perf_b[b][c],
-                                            comp_perf_a[a][c],
-                                            pref_dir[c],
-                                            gen_criteria[c],
-                                            thresholds[c])
-                        if crossed:
-                            rf = reinforcement_factors.get(c, 1)
-                            rp_crossed.update({(b, a, c): rf})
-                        partial_preferences[b][a][c] = pp
-        return (partial_preferences, rp_crossed)
-
-    def get_aggregated_preference(a, b, rp_crossed, partial_preferences, criteria, weights):
-        sum_of_weights = sum([weights[criterion] *
-                              rp_crossed.get((a, b, criterion), 1)
-                              for criterion in criteria])
-        s = sum([weights[criterion] *
-                 rp_crossed.get((a, b, criterion), 1) *
-                 partial_preferences[a][b][criterion]
-                 for criterion in criteria])
-        preference = s / sum_of_weights
-        return preference
+def get_reinforced_preference_kernels(criteria, generalised_criteria,
+                                      thresholds, pref_directions):
+    """Compiled preference functions (see 'get_reinforced_preference_kernel')
+    for every criterion.
+    """
+    return dict((c, get_reinforced_preference_kernel(pref_directions[c],
+                                                     generalised_criteria[c],
+                                                     thresholds[c]))
+                for c in criteria)
 
-    two_way_comparison = True if comparables_a != comparables_b else False
+def get_aggregated_preference_matrices(perf_a, perf_b, criteria,
+                                       generalised_criteria, thresholds,
+                                       pref_directions, weights,
+                                       reinforcement_factors,
+                                       both_ways=False):
+    """Aggregated preference indices for every pair (a, b), where 'a' is taken
+    from the rows of 'perf_a' and 'b' from the rows of 'perf_b' (see
+    'get_performance_matrix') - and, with 'both_ways', the ones for every
+    pair (b, a) too (as a transposed array, since both are computed from the
+    same differences).
+    On every criterion where the reinforced preference threshold is crossed
+    (see 'get_reinforced_preference_kernel'), both the weighted preference
+    and the weight itself are multiplied by its reinforcement factor, so the
+    index is a ratio of two weighted sums - both are accumulated as arrays.
+    """
+    kernels = get_reinforced_preference_kernels(criteria, generalised_criteria,
+                                                thresholds, pref_directions)
+    shape = (perf_a.shape[0], perf_b.shape[0])
+    directions = 2 if both_ways else 1
+    numerators = [np.zeros(shape) for _ in range(directions)]
+    denominators = [np.zeros(shape) for _ in range(directions)]
+    for i, c in enumerate(criteria):
+        results = kernels[c](perf_a[:, i], perf_b[:, i], both_ways=both_ways)
+        if not both_ways:
+            results = (results,)
+        rf = reinforcement_factors.get(c, 1)
+        for (partial, crossed), numerator, denominator in zip(
+                results, numerators, denominators):
+            # the weights of the criterion (reinforced or not) for every pair
+            w = np.where(crossed, weights[c] * rf, weights[c])
+            numerator += w * partial
+            denominator += w
+    matrices = [numerator / denominator
+                for numerator, denominator in zip(numerators, denominators)]
+    if not both_ways:
+        return matrices[0]
+    return matrices[0], matrices[1].T
 
-    partial_preferences, rp_crossed = get_partial_preferences(comparables_a,
-                                                  comparables_b,
-                                                  comparables_perf_a,
-                                                  comparables_perf_b,
-                                                  criteria,
-                                                  generalised_criteria,
-                                                  pref_directions,
-                                                  thresholds,
-                                                  reinforcement_factors,
-                                                  two_way_comparison)
-    aggregated_preferences = Vividict()
-    for a in comparables_a:
-        for b in comparables_b:
-            ap = get_aggregated_preference(a, b, rp_crossed, partial_preferences, criteria, weights)
-            aggregated_preferences[a][b] = ap
-            if two_way_comparison:
-                ap = get_aggregated_preference(b, a, rp_crossed, partial_preferences, criteria, weights)
-                aggregated_preferences[b][a] = ap
+def get_symmetric_aggregated_preference_matrix(perf, criteria,
+                                               generalised_criteria,
+                                               thresholds, pref_directions,
+                                               weights,
+                                               reinforcement_factors):
+    """Same as 'get_aggregated_preference_matrices(perf, perf, ...)', but the
+    pairs (a, b) and (b, a) are computed together, only for 'a' not after 'b'
+    (i.e. the upper triangle, one block of rows after another), which halves
+    the work. The diagonal (i.e. the preference of 'a' over itself) is 0.
+    """
+    n = perf.shape[0]
+    aggregated_preferences = np.empty((n, n))
+    block = max(1, min(PAIRWISE_BLOCK_SIZE // max(1, n),
+                       -(-n // MIN_PAIRWISE_BLOCKS)))
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        matrix, reversed_matrix = get_aggregated_preference_matrices(
+            perf[start:end], perf[start:], criteria, generalised_criteria,
+            thresholds, pref_directions, weights, reinforcement_factors,
+            both_ways=True)
+        # rows of the block vs. columns from 'start' on ...
+        aggregated_preferences[start:end, start:] = matrix
+        # ... and the rows after the block vs. its columns
+        aggregated_preferences[end:, start:end] = reversed_matrix[end - start:]
+    # an alternative isn't preferred to itself on any criterion
+    np.fill_diagonal(aggregated_preferences, 0)
     return aggregated_preferences
 
+def get_aggregated_preference_pairs(comparables_a, comparables_perf_a, comparables_b,
+                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
+                    weights, reinforcement_factors, max_memory=None, workers=1):
+    """Yields (a, b, aggregated preference) for every compared pair, in the
+    order in which they are written to the output file.
+    When all the pairs don't fit in 'max_memory' (in bytes), or when there's
+    more than one of 'workers', they are computed for one tile of comparables
+    after another (see 'compute_tiles') - each tile is released as soon as
+    its pairs have been consumed. Alternatives compared with each other are
+    computed only for the upper triangle, both ways (see
+    'get_symmetric_aggregated_preference_matrix' and
+    'compute_symmetric_tiles').
+    """
+    args = (criteria, generalised_criteria, thresholds, pref_directions,
+            weights, reinforcement_factors)
+    two_way_comparison = True if comparables_a != comparables_b else False
+    # categories profiles may come as a dict
+    comparables_b = list(comparables_b)
+    perf_a = get_performance_matrix(comparables_a, comparables_perf_a, criteria)
+    if two_way_comparison:
+        perf_b = get_performance_matrix(comparables_b, comparables_perf_b,
+                                        criteria)
+    else:
+        perf_b = perf_a
+    pairs_count = len(comparables_a) * len(comparables_b)
+    if two_way_comparison:
+        pairs_count *= 2
+    if max_memory is None:
+        max_pairs = pairs_count
+    else:
+        max_pairs = max_memory // BYTES_PER_PAIR
+    if pairs_count <= max_pairs and workers <= 1:
+        if two_way_comparison:
+            matrix, reversed_matrix = get_aggregated_preference_matrices(
+                perf_a, perf_b, *args, both_ways=True)
+            blocks = [(comparables_a, comparables_b, matrix),
+                      (comparables_b, comparables_a, reversed_matrix)]
+        else:
+            matrix = get_symmetric_aggregated_preference_matrix(perf_a, *args)
+            blocks = [(comparables_a, comparables_a, matrix)]
+        for rows, columns, block in blocks:
+            for pair in matrix_to_pairs(block, rows, columns):
+                yield pair
+        return
+    if not two_way_comparison:
+
+        def _compute_symmetric_tile(tile_rows, tile_columns, out,
+                                    reversed_out):
+            out[:], reversed_out[:] = get_aggregated_preference_matrices(
+                perf_a[tile_rows], perf_a[tile_columns], *args,
+                both_ways=True)
+            # an alternative isn't preferred to itself on any criterion
+            diagonal = np.arange(max(tile_rows.start, tile_columns.start),
+                                 min(tile_rows.stop, tile_columns.stop))
+            out[diagonal - tile_rows.start,
+                diagonal - tile_columns.start] = 0
+
+        # both directions of a tile are kept in memory at once
+        tiles = compute_symmetric_tiles(_compute_symmetric_tile,
+                                        len(comparables_a), max_pairs // 2,
+                                        workers)
+        for pair in tiles_to_pairs(tiles, comparables_a, comparables_a):
+            yield pair
+        return
+    for rows, rows_perf, columns, columns_perf in [
+            (comparables_a, perf_a, comparables_b, perf_b),
+            (comparables_b, perf_b, comparables_a, perf_a)]:
+
+        def _compute_tile(tile_rows, tile_columns, out):
+            out[:] = get_aggregated_preference_matrices(
+                rows_perf[tile_rows], columns_perf[tile_columns], *args)
+
+        tiles = compute_tiles(_compute_tile, len(rows), len(columns),
+                              max_pairs, workers)
+        for pair in tiles_to_pairs(tiles, rows, columns):
+            yield pair
+
 def finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir):
+    """'aggregated_preferences' is an iterable of (a, b, value) tuples (see
+    'get_aggregated_preference_pairs'), which are written one by one.
+    """
     if data.comparison_with in ('boundary_profiles', 'central_profiles'):
         mcda_concept = 'alternativesProfilesComparisons'
     else:
         mcda_concept = None
-    comparables = (comparables_a, comparables_b)
-    xmcda = comparisons_to_xmcda(aggregated_preferences, comparables,
-                                 mcda_concept=mcda_concept)
-    write_xmcda(xmcda, os.path.join(output_dir, 'aggregated_preferences.xml'))
+    write_comparisons_xmcda(aggregated_preferences,
+                            os.path.join(output_dir, 'aggregated_preferences.xml'),
+                            mcda_concept=mcda_concept)
     create_messages_file(None, ('Everything OK.',), output_dir);
 
 def main():
@@ -188,7 +273,13 @@ def main():
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
+        max_memory = get_memory_budget(args)
+        workers = get_workers(args)
         data = get_input_data(input_dir, filenames, params)
 
         comparables_a = data.alternatives
@@ -202,7 +293,7 @@ def main():
             comparables_b = data.alternatives
             comparables_perf_b = data.performances
 
-        aggregated_preferences = get_aggregated_preference_indices(
+        aggregated_preferences = get_aggregated_preference_pairs(
                                         comparables_a,
                                         comparables_perf_a,
                                         comparables_b,
@@ -212,9 +303,13 @@ def main():
                                         data.thresholds,
                                         data.pref_directions,
                                         normalized_weights,
-                                        data.reinforcement_factors)
+                                        data.reinforcement_factors,
+                                        max_memory=max_memory,
+                                        workers=workers)
 
         finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir)
+        if result_cache is not None:
+            result_cache.store()
 
         return 0
 
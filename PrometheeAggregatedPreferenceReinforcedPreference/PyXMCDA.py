@@ -43,7 +43,38 @@ XMCDA_2_1 = "http://www.decision-deck.org/xmcda/_downloads/XMCDA-2.1.0.xsd"
 XMCDA_2_2 = "http://www.decision-deck.org/xmcda/_downloads/XMCDA-2.2.1.xsd"
 
 from lxml import etree
-import sys, traceback
+import os, sys, traceback
+
+# Directory searched for local copies of the schemas above (e.g.
+# 'XMCDA-2.2.1.xsd'); the schemas are downloaded only when they are not there,
+# and kept there then (see saveLocalSchema).
+# By default it's the 'schemas' directory shared by all the modules.
+XMCDA_SCHEMAS_DIR = os.environ.get("XMCDA_SCHEMAS_DIR",
+                                   os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schemas"))
+
+def getLocalSchemaFile (xsdURL):
+	"Returns the path of the local copy of the schema located at xsdURL."
+	return os.path.join(XMCDA_SCHEMAS_DIR, xsdURL.split("/")[-1])
+
+# One of:
+#   'strict' - every file is validated right after it is parsed (default),
+#   'lazy'   - files are only parsed, the validation is left to the caller
+#              (see validateXMCDA), e.g. for when the extracted data is wrong,
+#   'none'   - no validation at all.
+XMCDA_VALIDATION = os.environ.get("XMCDA_VALIDATION", "strict")
+
+# What to do when a schema can be neither found in XMCDA_SCHEMAS_DIR nor
+# downloaded (e.g. offline): by default the files are rejected, just like the
+# invalid ones; with 'none' they are accepted without being validated, which
+# is reported by getValidationMessages.
+XMCDA_VALIDATION_FALLBACK = os.environ.get("XMCDA_VALIDATION_FALLBACK", "")
+
+# URLs of the schemas which couldn't be loaded, so the files haven't been
+# validated against them (with the 'none' fallback)
+_notValidated = []
+
+# compiled schemas (etree.XMLSchema), indexed by their URLs
+_schemas = {}
 
 __version__="20111208-001"
 
@@ -54,48 +85,160 @@ __version__="20111208-001"
 ##########################################################################
 
 
-def parseValidate (xmlfile) :
+def parseValidate (xmlfile, validation=None) :
 	"""
 	Parses and validates supplied the XMCDA file.
 	Returns the parsed (lxml) ElementTree, or None if the file
 	is not a valid XMCDA file.
+	The validation mode defaults to XMCDA_VALIDATION; with 'lazy' or 'none'
+	the file is only parsed.
 	"""
+	if validation is None :
+		validation = XMCDA_VALIDATION
 	try :
 		xmltree = etree.parse(open(xmlfile, 'r'))
-		if validateXMCDA(xmltree) :
+		if validation != "strict" or validateXMCDA(xmltree) :
 			return xmltree.getroot()
 	except Exception as e:
 		traceback.print_exc(sys.stderr)
 	return None
 
 
+def iterparseValidate (xmlfile, tag, validation=None) :
+	"""
+	Streaming counterpart of parseValidate, for big files: yields the
+	elements named tag one by one, as soon as they are parsed, and frees
+	them afterwards (together with their preceding siblings), so the whole
+	tree is never kept in memory - the yielded elements must not be stored.
+	The ancestors of an element are available while it is processed.
+	With the 'strict' validation the file is validated while it is parsed,
+	against the schema matching its namespace; an invalid file raises
+	etree.XMLSyntaxError, possibly after some elements have been yielded.
+	"""
+	if validation is None :
+		validation = XMCDA_VALIDATION
+	schema = None
+	if validation == "strict" :
+		for event, root in etree.iterparse(xmlfile, events=("start",)) :
+			break
+		schema = getFallbackSchema(getSchemaURLs(root.tag)[0])
+	for event, element in etree.iterparse(xmlfile, tag=tag, schema=schema) :
+		yield element
+		element.clear()
+		while element.getprevious() is not None :
+			del element.getparent()[0]
+
+
 def validateXMCDA (xmltree):
 	"Checks if xmltree is a valid XMCDA file."
 	ret = False
+	unavailable = False
 
-	try:    ret = validate(xmltree, XMCDA_2_0)
-	except Exception as e: traceback.print_exc(sys.stderr)
-	if ret:
-		return True
+	# the schema matching the namespace of the document is tried first, so
+	# usually there's only one validation per file
+	root = xmltree.getroot() if hasattr(xmltree, "getroot") else xmltree
 
-	try:    ret = validate(xmltree, XMCDA_2_1)
-	except Exception as e: traceback.print_exc(sys.stderr)
-	if ret:
-		return True
+	for xsdURL in getSchemaURLs(root.tag) :
+		try:
+			schema = getFallbackSchema(xsdURL)
+			if schema is None :
+				unavailable = True
+				continue
+			ret = schema.validate(xmltree)
+		except Exception as e: traceback.print_exc(sys.stderr)
+		if ret:
+			return True
+
+	# with the 'none' fallback, a file which couldn't be checked against
+	# some of the schemas is accepted
+	return ret or unavailable
+
+
+def getSchemaURLs (rootTag):
+	"""
+	Returns the URLs of the XMCDA schemas, the one matching the namespace
+	of rootTag (e.g. '{http://www.decision-deck.org/2012/XMCDA-2.2.1}XMCDA')
+	being the first.
+	"""
+	return sorted((XMCDA_2_0, XMCDA_2_1, XMCDA_2_2),
+	              key=lambda url: url.split("/")[-1][:-len(".xsd")] not in rootTag)
 
-	try:    ret = validate(xmltree, XMCDA_2_2)
-	except Exception as e: traceback.print_exc(sys.stderr)
 
-	return ret
+def getSchema (xsdURL):
+	"""
+	Returns the compiled schema located at xsdURL. Each schema is loaded
+	(from XMCDA_SCHEMAS_DIR when possible) and compiled only once per process;
+	a schema which couldn't be loaded isn't retried either.
+	"""
+	if xsdURL not in _schemas :
+		localFile = getLocalSchemaFile(xsdURL)
+		try :
+			if os.path.isfile(localFile) :
+				xmlschema_doc = etree.parse(localFile)
+			else :
+				# TODO (sbigaret) explain that!
+				xmlschema_doc = etree.parse(xsdURL,
+				                            etree.XMLParser(no_network=False))
+				saveLocalSchema(xmlschema_doc, localFile)
+			_schemas[xsdURL] = etree.XMLSchema(xmlschema_doc)
+		except Exception as e :
+			_schemas[xsdURL] = e
+			raise
+	schema = _schemas[xsdURL]
+	if isinstance(schema, Exception) :
+		raise IOError("Schema '%s' is not available (%s)." % (xsdURL, schema))
+	return schema
+
+
+def saveLocalSchema (xmlschema_doc, localFile):
+	"""
+	Keeps a downloaded schema in XMCDA_SCHEMAS_DIR, so it's downloaded only
+	once. Failing to do so (e.g. when the directory is read-only) isn't an
+	error - the schema is just downloaded again by the next process.
+	"""
+	tmpFile = "%s.%d.tmp" % (localFile, os.getpid())
+	try :
+		if not os.path.isdir(XMCDA_SCHEMAS_DIR) :
+			os.makedirs(XMCDA_SCHEMAS_DIR)
+		xmlschema_doc.write(tmpFile)
+		os.rename(tmpFile, localFile)
+	except (IOError, OSError) :
+		if os.path.isfile(tmpFile) :
+			os.remove(tmpFile)
+
+
+def getFallbackSchema (xsdURL):
+	"""
+	Returns the compiled schema located at xsdURL (see getSchema), or None
+	when it can't be loaded and the 'none' fallback has been chosen (see
+	XMCDA_VALIDATION_FALLBACK) - such schemas are reported by
+	getValidationMessages.
+	"""
+	try :
+		return getSchema(xsdURL)
+	except Exception :
+		if XMCDA_VALIDATION_FALLBACK != "none" :
+			raise
+		if xsdURL not in _notValidated :
+			_notValidated.append(xsdURL)
+		return None
+
+
+def getValidationMessages ():
+	"""
+	Returns the messages about the XMCDA files which haven't been validated,
+	because their schemas couldn't be loaded (see XMCDA_VALIDATION_FALLBACK).
+	"""
+	if not _notValidated :
+		return []
+	return ["The XMCDA files haven't been validated against these schemas, "
+	        "since they aren't available (XMCDA_VALIDATION_FALLBACK=none): "
+	        "%s." % ", ".join("'%s'" % xsdURL for xsdURL in _notValidated)]
 
 
 def validate (xmltree, xsdURL):
 	"Checks if xmltree is valid wrt the supplied xml schema"
-	# TODO (sbigaret) explain that!
-	xmlschema_doc = etree.parse(xsdURL,
-	                            etree.XMLParser(no_network=False))
-	xmlschema = etree.XMLSchema(xmlschema_doc)
-	return xmlschema.validate(xmltree)
+	return getSchema(xsdURL).validate(xmltree)
 
 
 ##########################################################################
@@ -257,10 +400,11 @@ def getAlternativeValue (xmltree, alternativesId, mcdaConcept=None) :
 		return {}
 		
 	values = {}
+	altIndex = getIndex(alternativesId)
 	
 	for alternativeValue in alternativesValues.findall ("./alternativeValue") :
 		alt = alternativeValue.find ("alternativeID").text
-		if alternativeId.count(alt) > 0 :
+		if alt in altIndex :
 			values[alt] = getValue (alternativeValue)
 
 	return values
@@ -284,10 +428,11 @@ def getCriterionValue (xmltree, criteriaId, mcdaConcept=None) :
 		return {}
 		
 	values = {}
+	critIndex = getIndex(criteriaId)
 	
 	for criterionValue in criteriaValues.findall("./criterionValue"):
 		crit = criterionValue.find ("criterionID").text
-		if criteriaId.count(crit) > 0 :
+		if crit in critIndex :
 			values[crit] = getValue (criterionValue)
 
 	return values
@@ -342,6 +487,19 @@ def getAlternativesID (xmltree, condition="ACTIVE") :
 ##########
 
 
+def getIndex (ids) :
+
+	# Returns the given list of ids as a set, so checking whether an id belongs
+	# to it takes constant time (a single id may be given as well)
+	
+	if isinstance(ids, basestring) :
+		return set([ids])
+	return set(ids)
+
+
+##########
+
+
 def getCriteriaID (xmltree, condition="ACTIVE") :
 
 	# Retourne la liste des criteres, selon la condition suivante : ALL, ACTIVE, INACTIVE
@@ -478,11 +636,11 @@ def getAlternativesReferences (xmltree, altId) :
 	
 	xmlId =  xmltree.find("alternativeID")
 	if xmlId != None :
-		if altId.count(xmlId.text) > 0 :
+		if xmlId.text in altId :
 			listId.append(xmlId.text)
 	else :
 		for xmlId in xmltree.findall("alternativesSet/element/alternativeID") :
-			if altId.count(xmlId.text) > 0 :
+			if xmlId.text in altId :
 				listId.append(xmlId.text)
 			else :
 				listId = []
@@ -502,11 +660,11 @@ def getCriteriaReferences (xmltree, criId) :
 	
 	xmlId =  xmltree.find("criterionID")
 	if xmlId != None :
-		if criId.count(xmlId.text) > 0 :
+		if xmlId.text in criId :
 			listId.append(xmlId.text)
 	else :
 		for xmlId in xmltree.findall("criteriaSet/element/criterionID") :
-			if criId.count(xmlId.text) > 0 :
+			if xmlId.text in criId :
 				listId.append(xmlId.text)
 			else :
 				listId = []
@@ -525,11 +683,11 @@ def getCategoriesReferences (xmltree, catId) :
 	
 	xmlId =  xmltree.find("categoryID")
 	if xmlId != None :
-		if catId.count(xmlId.text) > 0 :
+		if xmlId.text in catId :
 			listId.append(xmlId.text)
 	else :
 		for xmlId in xmltree.findall("categoriesSet/element/categoryID") :
-			if catId.count(xmlId.text) > 0 :
+			if xmlId.text in catId :
 				listId.append(xmlId.text)
 			else :
 				listId = []
@@ -615,19 +773,18 @@ def getAlternativesComparisons (xmltree, altId, mcdaConcept=None) :
 	else :
 	
 		datas = {}
+		altIndex = getIndex(altId)
 		
 		for pair in comparisons.findall ("pairs/pair") :
 			init = pair.find("initial/alternativeID").text
 			term = pair.find("terminal/alternativeID").text
-			val = getNumericValue(pair)
 			
 			# Only the alternatives concerned
-			if altId.count(init) > 0 :
-				if altId.count(term) > 0 :
-					# We check if init is still an entry in the table
-					if not(datas.has_key(init)) :
-						datas[init] = {}
-					datas[init][term] = val
+			if init in altIndex and term in altIndex :
+				# We check if init is still an entry in the table
+				if not(datas.has_key(init)) :
+					datas[init] = {}
+				datas[init][term] = getNumericValue(pair)
 
 		return datas
 
@@ -653,12 +810,13 @@ def getCriteriaComparisons (xmltree, criId, mcdaConcept=None) :
 	else :
 	
 		datas = []
+		criIndex = getIndex(criId)
 		
 		for pair in comparisons.findall ("pairs/pair") :
 		
 			comp = {}
-			comp["initial"] = getCriteriaReferences(pair.find("initial"), criId)
-			comp["terminal"] = getCriteriaReferences(pair.find("terminal"), criId)
+			comp["initial"] = getCriteriaReferences(pair.find("initial"), criIndex)
+			comp["terminal"] = getCriteriaReferences(pair.find("terminal"), criIndex)
 			
 			if comp["initial"] != [] and comp["terminal"] != [] :
 				comp["val"] = getNumericValue(pair)
@@ -687,12 +845,13 @@ def getCategoriesComparisons (xmltree, catId, mcdaConcept=None) :
 	else :
 	
 		datas = []
+		catIndex = getIndex(catId)
 		
 		for pair in comparisons.findall ("pairs/pair") :
 		
 			comp = {}
-			comp["initial"] = getCategoriesReferences(pair.find("initial"), catId)
-			comp["terminal"] = getCategoriesReferences(pair.find("terminal"), catId)
+			comp["initial"] = getCategoriesReferences(pair.find("initial"), catIndex)
+			comp["terminal"] = getCategoriesReferences(pair.find("terminal"), catIndex)
 			
 			if comp["initial"] != [] and comp["terminal"] != [] :
 				comp["val"] = getNumericValue(pair)
@@ -1,3 +1,9 @@
+from __future__ import division
+
+import numpy as np
+
+from common import get_linear_array
+
 def UsualCriterion(difference_between_evaulations, p, q):
     if difference_between_evaulations <= 0:
         return 0;
@@ -37,4 +43,82 @@ def get_difference_between_evaluations(pref_direction, ga, gb):
         difference_between_evaulations = ga - gb
     if (pref_direction=="min"):
         difference_between_evaulations = gb - ga
-    return difference_between_evaulations
\ No newline at end of file
+    return difference_between_evaulations
+
+# Vectorized counterparts of the functions above - 'differences' and the
+# thresholds are numpy arrays (or scalars) broadcastable against each other.
+# Divisions by a zero threshold are harmless here, because their results are
+# always masked out by the preceding comparisons.
+
+def UsualCriterionArray(differences, p, q):
+    return np.where(differences <= 0, 0.0, 1.0)
+
+def UShapeCriterionArray(differences, p, q):
+    return np.where(differences <= q, 0.0, 1.0)
+
+def VShapeCriterionArray(differences, p, q):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        linear_part = differences/p
+    return np.where(differences <= 0, 0.0,
+                    np.where(differences > p, 1.0, linear_part))
+
+def LevelCriterionArray(differences, p, q):
+    return np.where(differences <= q, 0.0,
+                    np.where(differences > p, 1.0, 0.5))
+
+def VShapeWithIndifferenceCriterionArray(differences, p, q):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        linear_part = (differences-q)/(p-q)
+    return np.where(differences <= q, 0.0,
+                    np.where(differences > p, 1.0, linear_part))
+
+def get_differences_between_evaluations(pref_direction, ga, gb):
+    if (pref_direction=="max"):
+        return ga - gb
+    if (pref_direction=="min"):
+        return gb - ga
+    return np.zeros(np.broadcast(ga, gb).shape)
+
+def get_reinforced_preference_kernel(pref_direction, function_no, threshold):
+    """Compiles the preference function of one criterion, i.e. resolves once
+    everything that is constant for it: the generalised criterion, the
+    direction of preference and the thresholds (constant or linear). Returns
+    a function 'kernel(perf_a, perf_b, both_ways=False)', which computes for
+    every pair (a, b) at once a tuple (preferences, crossed) - where
+    'crossed' is a boolean mask of the pairs whose difference exceeds the
+    reinforced preference threshold. With 'both_ways', it returns also such
+    a tuple for every pair (b, a) - with the same shape, i.e. transposed.
+    """
+
+    generalised_criteria_function = {
+        1: UsualCriterionArray,
+        2: UShapeCriterionArray,
+        3: VShapeCriterionArray,
+        4: LevelCriterionArray,
+        5: VShapeWithIndifferenceCriterionArray,
+    }
+
+    preference_function = generalised_criteria_function[function_no]
+    thresholds = tuple(threshold.get(t, 0) for t in
+                       ('preference', 'indifference', 'reinforced_preference'))
+    # linear thresholds are calculated for every pair from the weaker
+    # evaluation (see 'get_linear_array' from 'common')
+    linear = any(type(t) is dict for t in thresholds)
+
+    def kernel(perf_a, perf_b, both_ways=False):
+        ga = perf_a[:, np.newaxis]
+        gb = perf_b[np.newaxis, :]
+        differences = get_differences_between_evaluations(pref_direction,
+                                                          ga, gb)
+        if not linear:
+            p, q, r = thresholds
+        else:
+            p, q, r = [get_linear_array(pref_direction, perf_a, perf_b, t)
+                       for t in thresholds]
+        result = (preference_function(differences, p, q), differences > r)
+        if not both_ways:
+            return result
+        return result, (preference_function(-differences, p, q),
+                        -differences > r)
+
+    return kernel
@@ -11,7 +11,7 @@ boundary profiles and alternatives vs central (characteristic) profiles.
 Each criterion can have its own preference function (one of six predefined functions).
 
 Usage:
-    PrometheeAggregatedPreferenceWithInteractions.py -i DIR -o DIR
+    PrometheeAggregatedPreferenceWithInteractions.py -i DIR -o DIR [--max-memory=MB] [--workers=N] [--cache=DIR] [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -27,6 +27,17 @@ Options:
     -o DIR     Specify output directory. Files generated as output:
                    aggregated_preferences.xml
                    messages.xml
+    --max-memory=MB  Memory budget for the aggregated preferences computed at
+               once - when all of them don't fit in it, they are computed
+               and written tile by tile [default: 1024].
+    --workers=N  Number of processes computing the aggregated preferences
+               in parallel, one tile each (0 means one per CPU) [default: 1].
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
@@ -37,11 +48,13 @@ import os
 import sys
 import traceback
 from itertools import chain
-from functools import partial
+import numpy as np
 from docopt import docopt
 from preferenceFunction import *
-from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict
+from common import compute_symmetric_tiles, compute_tiles, \
+    create_messages_file, get_dirs, get_error_message, get_input_data, \
+    get_memory_budget, get_performance_matrix, get_result_cache, \
+    get_workers, matrix_to_pairs, tiles_to_pairs, write_comparisons_xmcda
 
 __version__ = '0.2.0'
 
@@ -73,6 +86,27 @@ params = [
     'z_function',
 ]
 
+# Estimated memory (in bytes) needed for one pair of compared elements per
+# criterion, i.e. its partial preference and the temporary arrays of a kernel.
+# When the preferences of the opposite pairs are computed as well, it's twice
+# as much.
+BYTES_PER_PAIR_AND_CRITERION = 16
+
+# Size (in number of pairs) of the blocks of preferences computed at once when
+# alternatives are compared with each other.
+PAIRWISE_BLOCK_SIZE = 2 ** 20
+
+# Minimal number of these blocks - the squares on the diagonal are computed
+# both ways, so they should be a small part of all the pairs.
+MIN_PAIRWISE_BLOCKS = 16
+
+# Size (in number of cells) of the arrays of interaction terms computed at
+# once, i.e. the number of interactions of one type evaluated together is
+# this divided by the number of compared pairs.
+INTERACTIONS_BLOCK_SIZE = 2 ** 22
+
+INTERACTION_TYPES = ('strengthening', 'weakening', 'antagonistic')
+
 def get_normalized_weights(weights):
     normalized_weights = {}
     sum_of_weights = sum(weights.values())
@@ -80,151 +114,268 @@ def get_normalized_weights(weights):
         normalized_weights[i] = weights[i]/sum_of_weights
     return normalized_weights
 
-def get_aggregated_preference_indices(comparables_a, comparables_perf_a, comparables_b,
-                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
-                    weights, interactions, z_function):
-
-    generalised_criteria_function = {
-        1: UsualCriterion,
-        2: UShapeCriterion,
-        3: VShapeCriterion,
-        4: LevelCriterion,
-        5: VShapeWithIndifferenceCriterion,
-        6: GaussianCriterion,
-    }
-
-    def _check_net_balance(interactions, weights):
-        int_weak = interactions.get('weakening', [])
-        int_antag = interactions.get('antagonistic', [])
-        int_chained = chain(int_weak, int_antag)
-        criteria_affected = set([i[0] for i in int_chained])
-        for criterion in criteria_affected:
-            weak_sum = sum([abs(i[2]) for i in int_weak if i[0] == criterion])
-            antag_sum = sum([i[2] for i in int_antag if i[0] == criterion])
-            net_balance = weights[criterion] - weak_sum + antag_sum
-            if net_balance <= 0:
-                raise RuntimeError("Positive net balance condition is not "
-                                   "fulfilled for criterion '{}'."
-                                   .format(criterion))
-
-    def get_z_function(z_function):
-        if z_function == 'multiplication':
-            Z = lambda x, y: x * y
-        elif z_function == 'minimum':
-            Z = lambda x, y: min(x, y)
-        else:
-            raise RuntimeError("Invalid Z function: '{}'.".format(z_function))
-        return Z
-
-    def preference_on_one_criterion(ga,gb,pref_direction,functionNo, threshold):
-        preference_function = generalised_criteria_function[functionNo];
-
-        _get_linear = partial(get_linear, pref_direction, ga, gb)
-        preference_treshold = _get_linear(threshold.get('preference', 0))
-        indifference_treshold = _get_linear(threshold.get('indifference', 0))
-        sigma_treshold = _get_linear(threshold.get('sigma', 0))
-
-        difference_between_evaulations = get_difference_between_evaluations(pref_direction, ga, gb)
-        calculated_preference = preference_function(
-                                    difference_between_evaulations,
-                                    preference_treshold,
-                                    indifference_treshold,
-                                    sigma_treshold);
-        return calculated_preference
-
-    def get_partial_preferences(comp_a, comp_b, comp_perf_a, comp_perf_b, criteria, gen_criteria, pref_dir, thresholds, two_way_comp):
-        partial_preferences = Vividict()
-        for a in comp_a:
-            for b in comp_b:
-                for c in criteria:
-                    pp = preference_on_one_criterion(
-                            comp_perf_a[a][c],
-                            comp_perf_b[b][c],
-                            pref_dir[c],
-                            gen_criteria[c],
-                            thresholds[c])
-                    partial_preferences[a][b][c] = pp
-                    if two_way_comp:
-                        pp = preference_on_one_criterion(
-                                comp_perf_b[b][c],
-                                comp_perf_a[a][c],
-                                pref_dir[c],
-                                gen_criteria[c],
-                                thresholds[c])
-                        partial_preferences[b][a][c] = pp
-        return partial_preferences
-
-    def get_aggregated_preference(a,b, part_preference, criteria, weights, Z_function, interactions):
-        if a==b:
-            aggregated_preference = 1.0
+def check_net_balance(interactions, weights):
+    int_weak = interactions.get('weakening', [])
+    int_antag = interactions.get('antagonistic', [])
+    int_chained = chain(int_weak, int_antag)
+    criteria_affected = set([i[0] for i in int_chained])
+    for criterion in criteria_affected:
+        weak_sum = sum([abs(i[2]) for i in int_weak if i[0] == criterion])
+        antag_sum = sum([i[2] for i in int_antag if i[0] == criterion])
+        net_balance = weights[criterion] - weak_sum + antag_sum
+        if net_balance <= 0:
+            raise RuntimeError("Positive net balance condition is not "
+                               "fulfilled for criterion '{}'."
+                               .format(criterion))
+
+def get_z_function(z_function):
+    """Z function applied element-wise to two arrays of partial
+    preferences.
+    """
+    if z_function == 'multiplication':
+        Z = np.multiply
+    elif z_function == 'minimum':
+        Z = np.minimum
+    else:
+        raise RuntimeError("Invalid Z function: '{}'.".format(z_function))
+    return Z
+
+def compile_interactions(criteria, interactions):
+    """Returns the interactions of every type (see '_get_criteria_interactions'
+    from 'common') as a dict of tuples (ci, cj, k) of arrays: the indices of
+    the interacting criteria in 'criteria' and the values of interactions.
+    Types without any interactions are left out.
+    """
+    index = dict((c, i) for i, c in enumerate(criteria))
+    compiled = {}
+    for interaction_type in INTERACTION_TYPES:
+        type_interactions = interactions.get(interaction_type, [])
+        if not type_interactions:
+            continue
+        compiled[interaction_type] = (
+            np.array([index[i[0]] for i in type_interactions]),
+            np.array([index[i[1]] for i in type_interactions]),
+            np.array([i[2] for i in type_interactions], dtype=float))
+    return compiled
+
+def add_interactions_sum(interactions_sum, Z, partial_i, partial_j,
+                         compiled_interactions):
+    """Adds 'Z(ci, cj) * k' for every interaction (ci, cj, k) from
+    'compiled_interactions' (see 'compile_interactions') to the array
+    'interactions_sum', for every pair at once - 'ci' is taken from the
+    (m x rows x columns) array of partial preferences 'partial_i' and 'cj'
+    from 'partial_j'. The Z function is evaluated for blocks of at most
+    'INTERACTIONS_BLOCK_SIZE' cells; the terms are added one after another,
+    in the order of the interactions.
+    """
+    ci, cj, k = compiled_interactions
+    pairs = partial_i.shape[1] * partial_i.shape[2]
+    block = max(1, INTERACTIONS_BLOCK_SIZE // max(1, pairs))
+    for start in range(0, len(k), block):
+        end = start + block
+        terms = Z(partial_i[ci[start:end]], partial_j[cj[start:end]])
+        terms *= k[start:end, np.newaxis, np.newaxis]
+        for term in terms:
+            interactions_sum += term
+
+def get_partial_preference_arrays(perf_a, perf_b, criteria,
+                                  generalised_criteria, thresholds,
+                                  pref_directions, both_ways=False):
+    """Partial preferences on every criterion for every pair (a, b), as an
+    (m x len(perf_a) x len(perf_b)) array - and, with 'both_ways', the ones
+    for every pair (b, a) too (as the second array, with the same shape,
+    i.e. transposed).
+    """
+    shape = (len(criteria), perf_a.shape[0], perf_b.shape[0])
+    partial = np.empty(shape)
+    reversed_partial = np.empty(shape) if both_ways else None
+    for i, c in enumerate(criteria):
+        kernel = get_partial_preference_kernel(pref_directions[c],
+                                               generalised_criteria[c],
+                                               thresholds[c])
+        if both_ways:
+            partial[i], reversed_partial[i] = kernel(perf_a[:, i],
+                                                     perf_b[:, i],
+                                                     both_ways=True)
         else:
-            sum_cki = sum([part_preference[a][b][c] * weights[c] for c in criteria])
-            sum_kij = float(0)
-            for interaction_name in ('strengthening', 'weakening'):
-                for interaction in interactions.get(interaction_name, []):
-                    ci = part_preference[a][b][interaction[0]]
-                    cj = part_preference[a][b][interaction[1]]
-                    sum_kij += Z_function(ci, cj) * interaction[2]
-            sum_kih = 0.0
-            for interaction in interactions.get('antagonistic', []):
-                ci = part_preference[a][b][interaction[0]]
-                cj = part_preference[b][a][interaction[1]]
-                sum_kih += Z_function(ci, cj) * interaction[2]
-            sum_ki = sum(weights.values())
-            K = sum_ki + sum_kij - sum_kih
-            aggregated_preference = (sum_cki + sum_kij - sum_kih) / K
-        return aggregated_preference
-
-    # some initial checks
-    _check_net_balance(interactions, weights)
-
+            partial[i] = kernel(perf_a[:, i], perf_b[:, i])
+    return partial, reversed_partial
+
+def aggregate_partial_preferences(partial, reversed_partial, criteria, weights,
+                                  Z, compiled_interactions):
+    """Aggregated preference indices for every pair, from the arrays of its
+    partial preferences (see 'get_partial_preference_arrays') - the
+    antagonistic interactions read the preferences of the opposite pairs
+    from 'reversed_partial'.
+    """
+    sum_cki = np.zeros(partial.shape[1:])
+    for i, c in enumerate(criteria):
+        sum_cki += partial[i] * weights[c]
+    sum_kij = np.zeros(partial.shape[1:])
+    for interaction_type in ('strengthening', 'weakening'):
+        if interaction_type in compiled_interactions:
+            add_interactions_sum(sum_kij, Z, partial, partial,
+                                 compiled_interactions[interaction_type])
+    sum_kih = np.zeros(partial.shape[1:])
+    if 'antagonistic' in compiled_interactions:
+        add_interactions_sum(sum_kih, Z, partial, reversed_partial,
+                             compiled_interactions['antagonistic'])
+    sum_ki = sum(weights.values())
+    K = sum_ki + sum_kij - sum_kih
+    return (sum_cki + sum_kij - sum_kih) / K
+
+def get_aggregated_preference_matrices(perf_a, perf_b, criteria,
+                                       generalised_criteria, thresholds,
+                                       pref_directions, weights, interactions,
+                                       z_function, both_ways=False):
+    """Aggregated preference indices for every pair (a, b), where 'a' is taken
+    from the rows of 'perf_a' and 'b' from the rows of 'perf_b' (see
+    'get_performance_matrix') - and, with 'both_ways', the ones for every
+    pair (b, a) too (as a transposed array, since both are computed from the
+    same partial preferences, just with their roles swapped).
+    The interactions are compiled once (see 'compile_interactions'), so every
+    interaction term is computed for all the pairs at once.
+    When both arrays are the same one, the partial preferences of the
+    opposite pairs (e.g. for the antagonistic interactions) are just the
+    transposed ones, so they aren't computed again.
+    """
+    check_net_balance(interactions, weights)
     Z = get_z_function(z_function)
-
+    compiled_interactions = compile_interactions(criteria, interactions)
+    symmetric = perf_a is perf_b
+    partial, reversed_partial = get_partial_preference_arrays(
+        perf_a, perf_b, criteria, generalised_criteria, thresholds,
+        pref_directions,
+        both_ways=not symmetric and (both_ways or
+                                     'antagonistic' in compiled_interactions))
+    if symmetric:
+        reversed_partial = partial.transpose(0, 2, 1)
+    args = (criteria, weights, Z, compiled_interactions)
+    matrix = aggregate_partial_preferences(partial, reversed_partial, *args)
+    if not both_ways:
+        return matrix
+    reversed_matrix = aggregate_partial_preferences(reversed_partial, partial,
+                                                    *args)
+    return matrix, reversed_matrix.T
+
+def get_symmetric_aggregated_preference_matrix(perf, criteria,
+                                               generalised_criteria,
+                                               thresholds, pref_directions,
+                                               weights, interactions,
+                                               z_function):
+    """Same as 'get_aggregated_preference_matrices(perf, perf, ...)', but the
+    pairs (a, b) and (b, a) are computed together, only for 'a' not after 'b'
+    (i.e. the upper triangle, one block of rows after another), which halves
+    the work. The diagonal (i.e. the preference of 'a' over itself) is 1.
+    """
+    n = perf.shape[0]
+    aggregated_preferences = np.empty((n, n))
+    block = max(1, min(PAIRWISE_BLOCK_SIZE // max(1, n),
+                       -(-n // MIN_PAIRWISE_BLOCKS)))
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        matrix, reversed_matrix = get_aggregated_preference_matrices(
+            perf[start:end], perf[start:], criteria, generalised_criteria,
+            thresholds, pref_directions, weights, interactions, z_function,
+            both_ways=True)
+        # rows of the block vs. columns from 'start' on ...
+        aggregated_preferences[start:end, start:] = matrix
+        # ... and the rows after the block vs. its columns
+        aggregated_preferences[end:, start:end] = reversed_matrix[end - start:]
+    # the preference of an alternative over itself is 1
+    np.fill_diagonal(aggregated_preferences, 1.0)
+    return aggregated_preferences
+
+def get_aggregated_preference_pairs(comparables_a, comparables_perf_a, comparables_b,
+                    comparables_perf_b, criteria, generalised_criteria, thresholds, pref_directions,
+                    weights, interactions, z_function, max_memory=None, workers=1):
+    """Yields (a, b, aggregated preference) for every compared pair, in the
+    order in which they are written to the output file.
+    When all the pairs don't fit in 'max_memory' (in bytes), or when there's
+    more than one of 'workers', they are computed for one tile of comparables
+    after another (see 'compute_tiles') - each tile is released as soon as
+    its pairs have been consumed. Alternatives compared with each other are
+    computed only for the upper triangle, both ways (see
+    'get_symmetric_aggregated_preference_matrix' and
+    'compute_symmetric_tiles').
+    """
+    args = (criteria, generalised_criteria, thresholds, pref_directions,
+            weights, interactions, z_function)
     two_way_comparison = True if comparables_a != comparables_b else False
-
-    partial_preferences = get_partial_preferences(comparables_a,
-                                                  comparables_b,
-                                                  comparables_perf_a,
-                                                  comparables_perf_b,
-                                                  criteria,
-                                                  generalised_criteria,
-                                                  pref_directions,
-                                                  thresholds,
-                                                  two_way_comparison)
-
-    aggregated_preferences = Vividict()
-    for a in comparables_a:
-        for b in comparables_b:
-            temp_preference = get_aggregated_preference(
-                                a,
-                                b,
-                                partial_preferences,
-                                criteria,
-                                weights,
-                                Z,
-                                interactions)
-            aggregated_preferences[a][b] = temp_preference
-            if two_way_comparison:
-                temp_preference = get_aggregated_preference(
-                                    b,
-                                    a,
-                                    partial_preferences,
-                                    criteria,
-                                    weights,
-                                    Z,
-                                    interactions)
-                aggregated_preferences[b][a] = temp_preference
-    return aggregated_preferences;
+    perf_a = get_performance_matrix(comparables_a, comparables_perf_a, criteria)
+    if two_way_comparison:
+        perf_b = get_performance_matrix(comparables_b, comparables_perf_b,
+                                        criteria)
+    else:
+        perf_b = perf_a
+    pairs_count = len(comparables_a) * len(comparables_b)
+    if two_way_comparison:
+        pairs_count *= 2
+    bytes_per_pair = BYTES_PER_PAIR_AND_CRITERION * max(1, len(criteria))
+    if max_memory is None:
+        max_pairs = pairs_count
+    else:
+        max_pairs = max_memory // bytes_per_pair
+    if pairs_count <= max_pairs and workers <= 1:
+        if two_way_comparison:
+            matrix, reversed_matrix = get_aggregated_preference_matrices(
+                perf_a, perf_b, *args, both_ways=True)
+            blocks = [(comparables_a, comparables_b, matrix),
+                      (comparables_b, comparables_a, reversed_matrix)]
+        else:
+            matrix = get_symmetric_aggregated_preference_matrix(perf_a, *args)
+            blocks = [(comparables_a, comparables_a, matrix)]
+        for rows, columns, block in blocks:
+            for pair in matrix_to_pairs(block, rows, columns):
+                yield pair
+        return
+    if not two_way_comparison:
+
+        def _compute_symmetric_tile(tile_rows, tile_columns, out,
+                                    reversed_out):
+            out[:], reversed_out[:] = get_aggregated_preference_matrices(
+                perf_a[tile_rows], perf_a[tile_columns], *args,
+                both_ways=True)
+            # the preference of an alternative over itself is 1
+            diagonal = np.arange(max(tile_rows.start, tile_columns.start),
+                                 min(tile_rows.stop, tile_columns.stop))
+            out[diagonal - tile_rows.start,
+                diagonal - tile_columns.start] = 1.0
+
+        # both directions of a tile are kept in memory at once
+        tiles = compute_symmetric_tiles(_compute_symmetric_tile,
+                                        len(comparables_a), max_pairs // 2,
+                                        workers)
+        for pair in tiles_to_pairs(tiles, comparables_a, comparables_a):
+            yield pair
+        return
+    if interactions.get('antagonistic'):
+        # the antagonistic interactions need the opposite pairs as well
+        max_pairs //= 2
+    for rows, rows_perf, columns, columns_perf in [
+            (comparables_a, perf_a, comparables_b, perf_b),
+            (comparables_b, perf_b, comparables_a, perf_a)]:
+
+        def _compute_tile(tile_rows, tile_columns, out):
+            out[:] = get_aggregated_preference_matrices(
+                rows_perf[tile_rows], columns_perf[tile_columns], *args)
+
+        tiles = compute_tiles(_compute_tile, len(rows), len(columns),
+                              max_pairs, workers)
+        for pair in tiles_to_pairs(tiles, rows, columns):
+            yield pair
 
 def finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir):
+    """'aggregated_preferences' is an iterable of (a, b, value) tuples (see
+    'get_aggregated_preference_pairs'), which are written one by one.
+    """
     if data.comparison_with in ('boundary_profiles', 'central_profiles'):
         mcda_concept = 'alternativesProfilesComparisons'
     else:
         mcda_concept = None
-    comparables = (comparables_a, comparables_b)
-    xmcda = comparisons_to_xmcda(aggregated_preferences, comparables,
-                                 mcda_concept=mcda_concept)
-    write_xmcda(xmcda, os.path.join(output_dir, 'aggregated_preferences.xml'))
+    write_comparisons_xmcda(aggregated_preferences,
+                            os.path.join(output_dir, 'aggregated_preferences.xml'),
+                            mcda_concept=mcda_concept)
     create_messages_file(None, ('Everything OK.',), output_dir);
 
 def main():
@@ -232,7 +383,13 @@ def main():
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
+        max_memory = get_memory_budget(args)
+        workers = get_workers(args)
         data = get_input_data(input_dir, filenames, params)
         comparables_a = data.alternatives
         comparables_perf_a = data.performances
@@ -246,7 +403,7 @@ def main():
             comparables_b = data.alternatives
             comparables_perf_b = data.performances
 
-        aggregated_preferences = get_aggregated_preference_indices(
+        aggregated_preferences = get_aggregated_preference_pairs(
                                         comparables_a,
                                         comparables_perf_a,
                                         comparables_b,
@@ -257,9 +414,13 @@ def main():
                                         data.pref_directions,
                                         normalized_weights,
                                         data.interactions,
-                                        data.z_function)
+                                        data.z_function,
+                                        max_memory=max_memory,
+                                        workers=workers)
 
         finalize(data, comparables_a, comparables_b, aggregated_preferences, output_dir)
+        if result_cache is not None:
+            result_cache.store()
 
         return 0
 
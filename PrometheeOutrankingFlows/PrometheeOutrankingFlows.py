@@ -4,7 +4,8 @@
 PrometheeOutrankingFlows - computes positive and negative outranking flows using aggregated preference indices
 
 Usage:
-    PrometheeOutrankingFlows.py -i DIR -o DIR
+    PrometheeOutrankingFlows.py -i DIR -o DIR [--top=K] [--cache=DIR]
+                                [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -12,10 +13,52 @@ Options:
                    classes_profiles.xml (optional)
                    aggregated_preferences.xml
                    method_parameters.xml
+               Instead of 'aggregated_preferences.xml', there can be its binary
+               version written by 'PrometheeAggregatedPreference' (with
+               '--format=npy'), i.e. 'aggregated_preferences.npy' together
+               with 'aggregated_preferences.ids' - it's memory-mapped instead
+               of being parsed, so it's used whenever it's present (and
+               the flows of alternatives are taken from the sums of its
+               rows and columns, 'aggregated_preferences.sums.npy').
+               When both of them are missing, the flows are
+               computed directly from the performances, so these files are
+               required instead (just like for 'PrometheeAggregatedPreference',
+               e.g. 'tests/in2'):
+                   criteria.xml
+                   performance_table.xml
+                   profiles_performance_table.xml (optional)
+                   weights.xml
+                   generalised_criteria.xml (optional)
+               Instead of 'weights.xml', there can be 'weights_batch.xml'
+               with any number of weights (i.e. 'criteriaValues', told
+               apart by their 'id' attributes) - the flows for all of them
+               are computed at once then, from the flows on every criterion
+               (computed only once) - e.g. 'tests/in3'.
     -o DIR     Specify output directory. Files generated as output:
-                   positive_outranking_flows.xml
-                   negitive_outranking_flows.xml
+                   positive_flows.xml
+                   negative_flows.xml
+                   net_flows.xml
+                   ranking.xml
+                   batch_flows.xml (instead of the four above, for
+                       'weights_batch.xml')
                    messages.xml
+               The ranking is the complete PROMETHEE II ranking of the
+               alternatives (the profiles aren't ranked), i.e. by their net
+               flows - starting with the best one, the alternatives with
+               equal net flows share the best of their ranks.
+    --top=K    Write only the best K alternatives, i.e. their ranks and
+               their flows (in all the files). They're selected without
+               sorting all the alternatives, so it's much faster than the
+               complete ranking for many of them (e.g. 'tests/out4' is the
+               output for 'tests/in4' with '--top=5').
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again. When the flows are computed from the
+               performances, the flows on every criterion are cached as
+               well, so they're reused e.g. by the runs with other weights.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
@@ -26,9 +69,15 @@ import os
 import sys
 import traceback
 from functools import partial
+import numpy as np
 from docopt import docopt
+from lxml import etree
 from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict, outranking_flows_to_xmcda
+    get_error_message, get_input_data, get_linear, get_matrix_sums, \
+    get_performance_matrix, get_result_cache, omega, write_xmcda, Vividict, \
+    outranking_flows_to_xmcda, FOOTER, HEADER, INPUT_DATA_ERROR_MSG, \
+    InputDataError, TIE_TOLERANCE
+from unicriterionFlows import get_unicriterion_flows
 
 __version__ = '0.2.0'
 
@@ -38,6 +87,12 @@ filenames = [
     ('classes_profiles.xml', True),
     ('aggregated_preferences.xml', True),
     ('method_parameters.xml', False),
+    ('criteria.xml', True),
+    ('performance_table.xml', True),
+    ('profiles_performance_table.xml', True),
+    ('weights.xml', True),
+    ('generalised_criteria.xml', True),
+    ('weights_batch.xml', True),
 ]
 
 params = [
@@ -47,50 +102,353 @@ params = [
     'comparison_with',
 ]
 
-def get_positive_outranking_flow(a, compare_with,  aggregated_preferences):
-    flow = 0
-    for i in compare_with:
-        flow += aggregated_preferences[a][i]
-    flow /= len(compare_with)
-    return flow
-
-def get_negative_outranking_flow(a, compare_with, aggregated_preferences):
-    flow = 0
-    for i in compare_with:
-        flow += aggregated_preferences[i][a]
-    flow /= len(compare_with)
-    return flow
-
-def get_alternatives_flow(alternatives, aggregated_preferences):
+# used when there are no aggregated preferences in the input directory
+params_from_performances = [
+    'alternatives',
+    'categories_profiles',
+    'comparison_with',
+    'criteria',
+    'performances',
+    'pref_directions',
+    'profiles_performance_table',
+    'thresholds',
+    'weights',
+    'generalised_criteria',
+]
+
+# used when there's a batch of weights in the input directory
+params_batch = [p if p != 'weights' else 'weights_batch'
+                for p in params_from_performances]
+
+# Number of the aggregated preferences (pairs with a profile) summed up at
+# once when the flows are computed for profiles.
+PROFILES_BLOCK_SIZE = 2 ** 20
+
+# name of the file of the aggregated preferences reported when some of them
+# are missing (unless it's the binary one)
+PREFERENCES_FILE = 'aggregated_preferences.xml'
+
+def get_top(args):
+    """Returns the number of the best alternatives given with the '--top'
+    option, or None if there's no such option.
+    """
+    value = args.get('--top')
+    if value is None:
+        return None
+    try:
+        top = int(value)
+    except ValueError:
+        top = 0
+    if top <= 0:
+        raise InputDataError("Invalid value of the '--top' option: '{}'."
+                             .format(value))
+    return top
+
+def _missing_preferences_error(file_name, comparable=None):
+    if comparable is None:
+        details = "Aggregated preferences are missing for some pairs of " \
+            "alternatives."
+    else:
+        details = "Aggregated preferences are missing for some pairs with " \
+            "'{}'.".format(comparable)
+    return InputDataError("{} '{}'. {}".format(INPUT_DATA_ERROR_MSG,
+                                               file_name, details))
+
+def get_alternatives_flow(alternatives, aggregated_preferences, sums=None,
+                          file_name=PREFERENCES_FILE):
+    """'sums' are the sums of the rows and columns of the matrix of
+    aggregated preferences (see 'get_matrix_sums') - when they're given, and
+    the matrix is made of 'alternatives' only, the flows are taken from them
+    (without summing the whole matrix up). When some of the preferences are
+    missing, the error names 'file_name'.
+    """
+    matrix, index = aggregated_preferences
+    rows = [index[i] for i in alternatives]
+    n = len(alternatives) - 1
+    if sums is not None and len(rows) == len(index) == len(sums[0]):
+        positive, negative = sums[0][rows], sums[1][rows]
+        # there are no sums of incomplete rows/columns
+        if not (np.isnan(positive).any() or np.isnan(negative).any()):
+            positive_flow = dict(zip(alternatives, (positive / n).tolist()))
+            negative_flow = dict(zip(alternatives, (negative / n).tolist()))
+            return positive_flow, negative_flow
+    preferences = matrix[np.ix_(rows, rows)]
+    # every alternative is compared with all the other ones only
+    np.fill_diagonal(preferences, 0)
+    if np.isnan(preferences).any():
+        raise _missing_preferences_error(file_name)
+    positive_flow = dict(zip(alternatives, (preferences.sum(axis=1) / n).tolist()))
+    negative_flow = dict(zip(alternatives, (preferences.sum(axis=0) / n).tolist()))
+    return positive_flow, negative_flow
+
+def _get_blocks_flows(comparables, profiles, aggregated_preferences,
+                      exclude_self=False, file_name=PREFERENCES_FILE):
+    """Yields the flows of 'comparables' against 'profiles', i.e. tuples
+    (block of comparables, positive flows, negative flows), block after block
+    of 'PROFILES_BLOCK_SIZE' preferences. With 'exclude_self', 'comparables'
+    are the 'profiles' themselves, and everyone is compared with all the
+    other ones only.
+    """
+    matrix, index = aggregated_preferences
+    columns = [index[p] for p in profiles]
+    n = len(profiles) - 1 if exclude_self else len(profiles)
+    block = max(1, PROFILES_BLOCK_SIZE // max(1, len(profiles)))
+    for start in range(0, len(comparables), block):
+        part = comparables[start:start + block]
+        rows = [index[c] for c in part]
+        preferences = matrix[np.ix_(rows, columns)]
+        # the preferences of the profiles over every comparable, as the
+        # rows of the transposed block (so they're summed up in the same
+        # order)
+        reversed_preferences = matrix[np.ix_(columns, rows)].T
+        if exclude_self:
+            keep = np.ones(preferences.shape, dtype=bool)
+            keep[np.arange(len(part)), np.arange(start, start + len(part))] = \
+                False
+            preferences = preferences[keep].reshape(len(part), n)
+            reversed_preferences = reversed_preferences[keep].reshape(
+                len(part), n)
+        else:
+            reversed_preferences = reversed_preferences.copy()
+        positive = preferences.sum(axis=1)
+        negative = reversed_preferences.sum(axis=1)
+        missing = np.isnan(positive) | np.isnan(negative)
+        if missing.any():
+            raise _missing_preferences_error(file_name,
+                                             part[int(np.argmax(missing))])
+        yield part, positive / n, negative / n
+
+def get_profiles_flow(alternatives, profiles, aggregated_preferences,
+                      file_name=PREFERENCES_FILE):
+    """Flows of the alternatives (compared with the profiles) and of the
+    profiles (compared with each other), from the sums of the rows and
+    columns of the blocks of the matrix of aggregated preferences (see
+    '_get_blocks_flows') - so, for a memory-mapped matrix, the memory used
+    doesn't grow with the number of alternatives, and it grows only
+    linearly with the number of profiles.
+    """
+    profiles = list(profiles)
     positive_flow = {}
     negative_flow = {}
-    for i in alternatives:
-        compare_with = list(alternatives)
-        compare_with.remove(i)
-        positive_flow[i] = get_positive_outranking_flow(i, compare_with, aggregated_preferences)
-        negative_flow[i] = get_negative_outranking_flow(i, compare_with, aggregated_preferences)
+    for comparables, exclude_self in ((alternatives, False),
+                                      (profiles, True)):
+        for part, positive, negative in _get_blocks_flows(
+                comparables, profiles, aggregated_preferences, exclude_self,
+                file_name):
+            positive_flow.update(zip(part, positive.tolist()))
+            negative_flow.update(zip(part, negative.tolist()))
     return positive_flow, negative_flow
 
-def get_profiles_flow(alternatives, profiles, aggregated_preferences):
+def get_unicriterion_flows_parts(alternatives, performances, profiles,
+                                 profiles_performances, criteria,
+                                 generalised_criteria, thresholds,
+                                 pref_directions, cache=None):
+    """Returns the unicriterion flows (see 'get_unicriterion_flows') which the
+    flows are computed from, as a list of tuples (comparables, positive,
+    negative, n): for the alternatives (compared with each other, or with the
+    'profiles' when they're given) and for the profiles (compared with each
+    other). The flows of 'comparables' are the products of the 'positive'
+    and 'negative' arrays with the normalized weights, divided by 'n'.
+    """
+    perf = get_performance_matrix(alternatives, performances, criteria)
+    if profiles is None:
+        positive, negative = get_unicriterion_flows(perf, criteria,
+                                                    generalised_criteria,
+                                                    thresholds, pref_directions,
+                                                    cache=cache)
+        return [(alternatives, positive, negative, len(alternatives) - 1)]
+    profiles_perf = get_performance_matrix(profiles, profiles_performances,
+                                           criteria)
+    parts = []
+    positive, negative = get_unicriterion_flows(perf, criteria,
+                                                generalised_criteria,
+                                                thresholds, pref_directions,
+                                                reference_perf=profiles_perf,
+                                                cache=cache)
+    parts.append((alternatives, positive, negative, len(profiles)))
+    positive, negative = get_unicriterion_flows(profiles_perf, criteria,
+                                                generalised_criteria,
+                                                thresholds, pref_directions,
+                                                cache=cache)
+    parts.append((profiles, positive, negative, len(profiles) - 1))
+    return parts
+
+def get_flows_from_performances(alternatives, performances, profiles,
+                                profiles_performances, criteria,
+                                generalised_criteria, thresholds,
+                                pref_directions, weights, cache=None):
+    """Computes the same flows as 'get_alternatives_flow' (or
+    'get_profiles_flow', when 'profiles' are given), but straight from the
+    performances, i.e. without the aggregated preferences for every pair.
+    With a 'cache', the flows on every criterion are reused (see
+    'get_unicriterion_flows'), so e.g. new weights cost only the products
+    with them.
+    """
+    sum_of_weights = sum(weights.values())
+    w = np.array([weights[c] for c in criteria]) / sum_of_weights
     positive_flow = {}
     negative_flow = {}
-    compare_with = list(profiles)
-    for i in alternatives:
-        positive_flow[i] = get_positive_outranking_flow(i, compare_with, aggregated_preferences)
-        negative_flow[i] = get_negative_outranking_flow(i, compare_with, aggregated_preferences)
-    for i in profiles:
-        compare_with = list(profiles)
-        compare_with.remove(i)
-        positive_flow[i] = get_positive_outranking_flow(i, compare_with, aggregated_preferences)
-        negative_flow[i] = get_negative_outranking_flow(i, compare_with, aggregated_preferences)
+    for comparables, positive, negative, n in get_unicriterion_flows_parts(
+            alternatives, performances, profiles, profiles_performances,
+            criteria, generalised_criteria, thresholds, pref_directions,
+            cache):
+        positive_flow.update(zip(comparables, (positive.dot(w) / n).tolist()))
+        negative_flow.update(zip(comparables, (negative.dot(w) / n).tolist()))
     return positive_flow, negative_flow
 
-def finalize(positive_outranking_flow, negative_outranking_flow, output_dir, comparison_with):
+def get_batch_flows(data, cache=None):
+    """Computes the flows (straight from the performances) for every weights
+    of 'data.weights_batch' at once - the unicriterion flows are computed
+    only once and multiplied by the (m x K) matrix of all the K normalized
+    weights. Returns a tuple (comparables, positive, negative), where the
+    flows are (n x K) arrays, with a column for every weights.
+    """
+    if data.comparison_with in ('boundary_profiles', 'central_profiles'):
+        profiles = list(data.categories_profiles)
+    else:
+        profiles = None
+    w = np.array([[weights[c] for c in data.criteria]
+                  for weights_id, weights in data.weights_batch]).T
+    w = w / w.sum(axis=0)
+    comparables = []
+    positive_flows = []
+    negative_flows = []
+    for part, positive, negative, n in get_unicriterion_flows_parts(
+            data.alternatives, data.performances, profiles,
+            data.profiles_performance_table, data.criteria,
+            data.generalised_criteria, data.thresholds, data.pref_directions,
+            cache):
+        comparables.extend(part)
+        positive_flows.append(positive.dot(w) / n)
+        negative_flows.append(negative.dot(w) / n)
+    return (comparables, np.concatenate(positive_flows),
+            np.concatenate(negative_flows))
+
+def get_flows(data, sums=None, cache=None, file_name=PREFERENCES_FILE):
+    """Returns a tuple (positive flows, negative flows) - computed from the
+    aggregated preferences read from 'file_name' (or from the 'sums' of their
+    matrix, see 'get_alternatives_flow'), or straight from the performances
+    when there are no aggregated preferences in 'data' (see
+    'get_flows_from_performances' for the 'cache').
+    """
+    # unlike 'hasattr', this doesn't hide the errors of loading them
+    if getattr(data, 'aggregated_preferences', None) is None:
+        if data.comparison_with in ('boundary_profiles', 'central_profiles'):
+            profiles = list(data.categories_profiles)
+        else:
+            profiles = None
+        return get_flows_from_performances(data.alternatives,
+                                           data.performances,
+                                           profiles,
+                                           data.profiles_performance_table,
+                                           data.criteria,
+                                           data.generalised_criteria,
+                                           data.thresholds,
+                                           data.pref_directions,
+                                           data.weights,
+                                           cache)
+    elif data.comparison_with in ('boundary_profiles', 'central_profiles'):
+        return get_profiles_flow(data.alternatives,
+                                 data.categories_profiles,
+                                 data.aggregated_preferences, file_name)
+    else:
+        return get_alternatives_flow(data.alternatives,
+                                     data.aggregated_preferences, sums,
+                                     file_name)
+
+def get_net_flows(positive_outranking_flow, negative_outranking_flow):
+    return dict((c, positive_outranking_flow[c] - negative_outranking_flow[c])
+                for c in positive_outranking_flow)
+
+def get_ranking(alternatives, net_flow, top=None):
+    """Returns the PROMETHEE II ranking of 'alternatives' (by their net
+    flows), as a list of tuples (alternative, rank) starting with the best
+    one - the alternatives with equal net flows (up to 'TIE_TOLERANCE')
+    share the best of their ranks (and they're ordered by their ids). With
+    'top', only the best 'top' alternatives are returned: they're selected
+    by a partial sort first (in linear time), so only they are sorted.
+    """
+    net = np.array([net_flow[a] for a in alternatives], dtype=float)
+    candidates = np.arange(len(alternatives))
+    if top is not None and top < len(alternatives):
+        # net flow of the top-th best alternative - the ones which are at
+        # least as good, or tied with it (even through other ties), are
+        # sorted, since ties are settled by the ids
+        threshold = -np.partition(-net, top - 1)[top - 1]
+        lowest = None
+        while lowest != threshold:
+            lowest = threshold
+            candidates = np.flatnonzero(net >= lowest - TIE_TOLERANCE)
+            threshold = net[candidates].min()
+    order = candidates[np.argsort(-net[candidates], kind='mergesort')]
+    sorted_net = net[order]
+    positions = np.arange(len(order))
+    ties = np.zeros(len(order), dtype=bool)
+    ties[1:] = sorted_net[:-1] - sorted_net[1:] <= TIE_TOLERANCE
+    positions[ties] = 0
+    ranks = np.maximum.accumulate(positions) + 1
+    ids = np.array([alternatives[i] for i in order.tolist()])
+    ranking = []
+    for j in np.lexsort((ids, ranks))[:top].tolist():
+        ranking.append((alternatives[order[j]], int(ranks[j])))
+    return ranking
+
+def ranking_to_xmcda(ranking):
+    xmcda = etree.Element('alternativesValues', mcdaConcept='ranking')
+    for a, rank in ranking:
+        alt_value = etree.SubElement(xmcda, 'alternativeValue')
+        alt_id = etree.SubElement(alt_value, 'alternativeID')
+        alt_id.text = a
+        value = etree.SubElement(alt_value, 'value')
+        integer = etree.SubElement(value, 'integer')
+        integer.text = str(rank)
+    return xmcda
+
+def finalize(positive_outranking_flow, negative_outranking_flow, output_dir,
+             comparison_with, alternatives, top=None):
+    """Writes the flows of all the comparables and the ranking of
+    'alternatives' (see 'get_ranking') - or, with 'top', the ranking and the
+    flows of the best 'top' alternatives only.
+    """
+    net_flow = get_net_flows(positive_outranking_flow,
+                             negative_outranking_flow)
+    ranking = get_ranking(alternatives, net_flow, top)
+    flows = [positive_outranking_flow, negative_outranking_flow, net_flow]
+    if top is not None:
+        flows = [dict((a, f[a]) for a, rank in ranking) for f in flows]
     mcda_concept = comparison_with + '_outranking_flows'
-    xmcda = outranking_flows_to_xmcda(positive_outranking_flow, mcda_concept)
-    write_xmcda(xmcda, os.path.join(output_dir, 'positive_flows.xml'))
-    xmcda = outranking_flows_to_xmcda(negative_outranking_flow, mcda_concept)
-    write_xmcda(xmcda, os.path.join(output_dir, 'negative_flows.xml'))
+    for f, name in zip(flows, ('positive_flows.xml', 'negative_flows.xml',
+                               'net_flows.xml')):
+        write_xmcda(outranking_flows_to_xmcda(f, mcda_concept),
+                    os.path.join(output_dir, name))
+    write_xmcda(ranking_to_xmcda(ranking),
+                os.path.join(output_dir, 'ranking.xml'))
+    create_messages_file(None, ('Everything OK.',), output_dir);
+
+def finalize_batch(weights_batch, comparables, positive, negative, output_dir,
+                   comparison_with):
+    """Writes the flows for a batch of weights (see 'get_batch_flows') to one
+    file, 'batch_flows.xml' - the positive, negative and net flows for every
+    weights, as 'alternativesValues' with the ids: '<weights id>_positive',
+    '<weights id>_negative' and '<weights id>_net'.
+    """
+    mcda_concept = comparison_with + '_outranking_flows'
+    file_name = os.path.join(output_dir, 'batch_flows.xml')
+    try:
+        with open(file_name, 'w') as f:
+            f.write(HEADER)
+            for k, (weights_id, weights) in enumerate(weights_batch):
+                for kind, flows in (('positive', positive[:, k]),
+                                    ('negative', negative[:, k]),
+                                    ('net', positive[:, k] - negative[:, k])):
+                    xmcda = outranking_flows_to_xmcda(
+                        dict(zip(comparables, flows.tolist())), mcda_concept)
+                    xmcda.set('id', '{}_{}'.format(weights_id, kind))
+                    f.write(etree.tostring(xmcda, pretty_print=True,
+                                           encoding='UTF-8'))
+            f.write(FOOTER)
+    except IOError as e:
+        raise IOError("{}: '{}'".format(e.strerror, e.filename))
     create_messages_file(None, ('Everything OK.',), output_dir);
 
 def main():
@@ -98,22 +456,47 @@ def main():
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        top = get_top(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
-        data = get_input_data(input_dir, filenames, params)
+        matrix_file = os.path.join(input_dir, 'aggregated_preferences.npy')
+        sums = None
+        preferences_file = PREFERENCES_FILE
+        if os.path.isfile(matrix_file):
+            sums = get_matrix_sums(matrix_file)
+            preferences_file = os.path.basename(matrix_file)
+        batch = os.path.isfile(os.path.join(input_dir, 'weights_batch.xml'))
+        if batch and top is not None:
+            raise InputDataError("The best alternatives can't be selected "
+                                 "for a batch of weights.")
+        if any(os.path.isfile(os.path.join(input_dir, f)) for f in
+               ('aggregated_preferences.xml', 'aggregated_preferences.npy')):
+            if batch:
+                raise InputDataError("The flows for a batch of weights can "
+                                     "be computed from the performances "
+                                     "only.")
+            data = get_input_data(input_dir, filenames, params)
+        elif batch:
+            data = get_input_data(input_dir, filenames, params_batch)
+        else:
+            data = get_input_data(input_dir, filenames, params_from_performances)
 
-        positive_outranking_flow = {}
-        negative_outranking_flow = {}
-        if data.comparison_with in ('boundary_profiles', 'central_profiles'):
-            (positive_outranking_flow,negative_outranking_flow) = get_profiles_flow(
-                                                                    data.alternatives,
-                                                                    data.categories_profiles,
-                                                                    data.aggregated_preferences)
+        if batch:
+            comparables, positive, negative = get_batch_flows(data,
+                                                              result_cache)
+            finalize_batch(data.weights_batch, comparables, positive,
+                           negative, output_dir, data.comparison_with)
         else:
-            (positive_outranking_flow,negative_outranking_flow) = get_alternatives_flow(
-                                                                    data.alternatives,
-                                                                    data.aggregated_preferences)
+            (positive_outranking_flow, negative_outranking_flow) = \
+                get_flows(data, sums, result_cache, preferences_file)
+            finalize(positive_outranking_flow, negative_outranking_flow,
+                     output_dir, data.comparison_with, data.alternatives, top)
+        if result_cache is not None:
+            result_cache.store()
 
-        finalize(positive_outranking_flow, negative_outranking_flow, output_dir, data.comparison_with)
         return 0
 
     except Exception, err:
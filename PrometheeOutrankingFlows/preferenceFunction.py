@@ -0,0 +1,155 @@
+from __future__ import division
+
+from math import exp
+
+import numpy as np
+
+from common import get_linear_array
+
+def UsualCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= 0:
+        return 0;
+    else:
+        return 1;
+
+def UShapeCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= q:
+        return 0;
+    else:
+        return 1;
+
+def VShapeCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= 0:
+        return 0;
+    if difference_between_evaulations > p:
+        return 1;
+    return difference_between_evaulations/p;
+
+def LevelCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= q:
+        return 0;
+    if difference_between_evaulations > p:
+        return 1;
+    return 1/2;
+
+def VShapeWithIndifferenceCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= q:
+        return 0;
+    if difference_between_evaulations > p:
+        return 1;
+    return (difference_between_evaulations-q)/(p-q);
+
+def GaussianCriterion(difference_between_evaulations, p, q, s):
+    if difference_between_evaulations <= 0:
+        return 0;
+    return 1-exp(-(difference_between_evaulations*difference_between_evaulations/2*s*s))
+
+def get_difference_between_evaluations(pref_direction, ga, gb):
+    difference_between_evaulations = 0
+    if (pref_direction=="max"):
+        difference_between_evaulations = ga - gb
+    if (pref_direction=="min"):
+        difference_between_evaulations = gb - ga
+    return difference_between_evaulations
+
+# Vectorized counterparts of the functions above - 'differences' and the
+# thresholds are numpy arrays (or scalars) broadcastable against each other.
+# Divisions by a zero threshold are harmless here, because their results are
+# always masked out by the preceding comparisons.
+
+def UsualCriterionArray(differences, p, q, s):
+    return np.where(differences <= 0, 0.0, 1.0)
+
+def UShapeCriterionArray(differences, p, q, s):
+    return np.where(differences <= q, 0.0, 1.0)
+
+def VShapeCriterionArray(differences, p, q, s):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        linear_part = differences/p
+    return np.where(differences <= 0, 0.0,
+                    np.where(differences > p, 1.0, linear_part))
+
+def LevelCriterionArray(differences, p, q, s):
+    return np.where(differences <= q, 0.0,
+                    np.where(differences > p, 1.0, 0.5))
+
+def VShapeWithIndifferenceCriterionArray(differences, p, q, s):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        linear_part = (differences-q)/(p-q)
+    return np.where(differences <= q, 0.0,
+                    np.where(differences > p, 1.0, linear_part))
+
+def GaussianCriterionArray(differences, p, q, s):
+    return np.where(differences <= 0, 0.0,
+                    1-np.exp(-(differences*differences/2*s*s)))
+
+def get_differences_between_evaluations(pref_direction, ga, gb):
+    if (pref_direction=="max"):
+        return ga - gb
+    if (pref_direction=="min"):
+        return gb - ga
+    return np.zeros(np.broadcast(ga, gb).shape)
+
+def get_partial_preference_kernel(pref_direction, function_no, threshold):
+    """Compiles the preference function of one criterion, i.e. resolves once
+    everything that is constant for it: the generalised criterion, the
+    direction of preference and the thresholds (constant or linear). Returns
+    a function 'kernel(perf_a, perf_b, both_ways=False)', which computes
+    preferences on this criterion for every pair (a, b) at once - see
+    'get_partial_preference_matrix' and 'get_partial_preference_matrices'.
+    """
+
+    generalised_criteria_function = {
+        1: UsualCriterionArray,
+        2: UShapeCriterionArray,
+        3: VShapeCriterionArray,
+        4: LevelCriterionArray,
+        5: VShapeWithIndifferenceCriterionArray,
+        6: GaussianCriterionArray,
+    }
+
+    preference_function = generalised_criteria_function[function_no]
+    thresholds = tuple(threshold.get(t, 0)
+                       for t in ('preference', 'indifference', 'sigma'))
+    # linear thresholds are calculated for every pair from the weaker
+    # evaluation (see 'get_linear_array' from 'common')
+    linear = any(type(t) is dict for t in thresholds)
+
+    def kernel(perf_a, perf_b, both_ways=False):
+        ga = perf_a[:, np.newaxis]
+        gb = perf_b[np.newaxis, :]
+        differences = get_differences_between_evaluations(pref_direction,
+                                                          ga, gb)
+        if not linear:
+            values = thresholds
+        else:
+            values = [get_linear_array(pref_direction, perf_a, perf_b, t)
+                      for t in thresholds]
+        preferences = preference_function(differences, *values)
+        if not both_ways:
+            return preferences
+        return preferences, preference_function(-differences, *values)
+
+    return kernel
+
+def get_partial_preference_matrix(perf_a, perf_b, pref_direction, function_no,
+                                  threshold):
+    """Computes preferences on one criterion for every pair (a, b) at once.
+    'perf_a' and 'perf_b' are the columns of the performance matrices related
+    to this criterion; the result is a (len(perf_a) x len(perf_b)) array.
+    """
+    kernel = get_partial_preference_kernel(pref_direction, function_no,
+                                           threshold)
+    return kernel(perf_a, perf_b)
+
+def get_partial_preference_matrices(perf_a, perf_b, pref_direction,
+                                    function_no, threshold):
+    """Same as 'get_partial_preference_matrix', but returns also the
+    preferences of every 'b' over every 'a' (as the second array, with the
+    same shape, i.e. transposed). Both come from the same differences and
+    thresholds (linear thresholds are symmetric), since P(b, a) is just the
+    preference function evaluated for the negated difference.
+    """
+    kernel = get_partial_preference_kernel(pref_direction, function_no,
+                                           threshold)
+    return kernel(perf_a, perf_b, both_ways=True)
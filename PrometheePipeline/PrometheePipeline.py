@@ -0,0 +1,464 @@
+#!../promethee python
+
+"""
+PrometheePipeline - runs a chain of PROMETHEE modules in one process
+
+The modules are run in the order given with '--stages', e.g. (for the
+inputs from 'tests/in1'):
+    PrometheeSurrogateWeights,PrometheeAggregatedPreference,PrometheeOutrankingFlows
+The results of every module are passed to the next ones straight in memory,
+i.e. without writing and parsing XMCDA files in between, so only the outputs
+of the last module are written (unless '--intermediates' is given).
+Supported chains are the parts of: weights (PrometheeSRF or
+PrometheeSurrogateWeights) -> PrometheeAggregatedPreference ->
+PrometheeOutrankingFlows, e.g. weights -> flows.
+
+With '--serve', it runs as a long-lived worker for many (small) jobs of any
+of the modules: jobs are read from the standard input, one JSON object per
+line, e.g.:
+    {"id": 1, "module": "PrometheeOutrankingFlows", "input_dir": "in1",
+     "output_dir": "out1", "options": ["--workers=2"]}
+('id' and 'options' are optional, 'module' can be PrometheePipeline as
+well). The result of every job is written to the standard output, also as
+one JSON object per line (in the order in which the jobs are finished):
+    {"id": 1, "status": 0, "time": 0.012}
+where 'status' is 0 when everything's OK (the details, as usual, are in the
+'messages.xml' of the job). All the modules are imported and the XMCDA
+schemas compiled only once, so the jobs don't pay for it. When the process
+running a job dies (e.g. killed for lack of memory), the job gets 'status'
+1 (with an 'error') and the process is replaced, so the other jobs go on.
+
+Usage:
+    PrometheePipeline.py -i DIR -o DIR --stages=LIST [--intermediates] [--max-memory=MB] [--workers=N]
+    PrometheePipeline.py --serve [--jobs=N]
+
+Options:
+    -i DIR     Specify input directory. It should contain the input files of
+               all the modules, except the ones produced by the previous
+               modules in the chain (e.g. 'weights.xml' after PrometheeSRF).
+               Parameters of all the modules go to the same
+               'method_parameters.xml'.
+    -o DIR     Specify output directory. Files generated as output:
+                   output files of the last module
+                   output files of the other modules (with '--intermediates')
+                   messages.xml
+    --stages=LIST  Comma-separated names of the modules to run, in order.
+    --intermediates  Write the outputs of all the modules, not only of the
+               last one.
+    --max-memory=MB  Memory budget for the aggregated preferences computed at
+               once (see PrometheeAggregatedPreference) [default: 1024].
+    --workers=N  Number of processes computing the aggregated preferences
+               in parallel (0 means one per CPU) [default: 1].
+    --serve    Run jobs read from the standard input (see above).
+    --jobs=N   Number of jobs run at once, each in its own process (0 means
+               one per CPU) [default: 1].
+    --version  Show version.
+    -h --help  Show this screen.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import imp
+import json
+import multiprocessing
+from collections import deque
+from Queue import Empty
+import os
+import sys
+import threading
+import time
+import traceback
+import numpy as np
+import PyXMCDA as px
+from docopt import docopt
+from common import create_messages_file, get_dirs, get_error_message, \
+    get_memory_budget, get_workers, InputDataError
+
+__version__ = '0.2.0'
+
+MODULES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# every module comes with its own versions of these ones
+SHARED_MODULES = ('common', 'PyXMCDA', 'preferenceFunction', 'unicriterionFlows')
+
+# position of every module in the chain - modules have to be given in this
+# order (each one at most once), but any of them can be skipped
+ORDER = {
+    'PrometheeSRF': 0,
+    'PrometheeSurrogateWeights': 0,
+    'PrometheeAggregatedPreference': 1,
+    'PrometheeOutrankingFlows': 2,
+}
+
+# How often (in seconds) the processes running the jobs with '--serve' are
+# checked for being alive, when none of them has finished a job.
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def _pop_shared_modules():
+    return dict((m, sys.modules.pop(m)) for m in SHARED_MODULES
+                if m in sys.modules)
+
+
+class Stage(object):
+    """The main script of a module (e.g. 'PrometheeSRF'), imported from its
+    own directory together with its own versions of 'common', 'PyXMCDA' etc.
+    They are put back into 'sys.modules' while the stage is in use (as a
+    context manager), because worker processes look them up there.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        module_dir = os.path.join(MODULES_DIR, name)
+        saved_modules = _pop_shared_modules()
+        sys.path.insert(0, module_dir)
+        try:
+            self.module = imp.load_source(name, os.path.join(module_dir,
+                                                             name + '.py'))
+            self.shared_modules = _pop_shared_modules()
+        finally:
+            sys.path.remove(module_dir)
+            sys.modules.update(saved_modules)
+
+    def __enter__(self):
+        self.saved_modules = _pop_shared_modules()
+        sys.modules.update(self.shared_modules)
+        return self.module
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _pop_shared_modules()
+        sys.modules.update(self.saved_modules)
+
+
+# stages imported so far, by the names of their modules
+_stages = {}
+
+
+def get_modules():
+    """Names of all the modules which can be run (in the same directory as
+    this one).
+    """
+    return sorted(d for d in os.listdir(MODULES_DIR)
+                  if os.path.isfile(os.path.join(MODULES_DIR, d, d + '.py'))
+                  and d != 'PrometheePipeline')
+
+
+def get_stage(name):
+    """Returns the 'Stage' of the module 'name', which is imported only the
+    first time it's needed.
+    """
+    if name not in _stages:
+        if name not in get_modules():
+            raise InputDataError("Unknown module: '{}'.".format(name))
+        _stages[name] = Stage(name)
+    return _stages[name]
+
+
+def get_stages(args):
+    names = [s.strip() for s in args.get('--stages').split(',')]
+    positions = [ORDER.get(name) for name in names]
+    if None in positions or positions != sorted(set(positions)):
+        raise InputDataError("Invalid value of the '--stages' option: '{}'."
+                             .format(args.get('--stages')))
+    return [get_stage(name) for name in names]
+
+
+def _get_input_data(module, input_dir, params, results):
+    """'get_input_data' of the 'module', except for the params which have
+    been computed by the previous modules (i.e. are in 'results') - their
+    files aren't even looked for.
+    """
+    filenames = [(f, is_optional) for f, is_optional in module.filenames
+                 if os.path.splitext(f)[0] not in results]
+    data = module.get_input_data(input_dir, filenames,
+                                 [p for p in params if p not in results])
+    for p in params:
+        if p == 'weights' and p in results:
+            # just like 'get_input_data' - only the weights of the criteria
+            data.weights = dict((c, w) for c, w in results[p].items()
+                                if c in data.criteria)
+        elif p in results:
+            setattr(data, p, results[p])
+    return data
+
+
+def run_srf(module, input_dir, output_dir, results, write_output, last,
+            **kwargs):
+    data = _get_input_data(module, input_dir, module.params, results)
+    weights = module.get_weights(data.criteria_ranking,
+                                 data.criteria_weight_ratio,
+                                 data.decimal_places)
+    if write_output:
+        module.finalize(weights, output_dir)
+    results['weights'] = weights
+
+
+def run_surrogate_weights(module, input_dir, output_dir, results,
+                          write_output, last, **kwargs):
+    data = _get_input_data(module, input_dir, module.params, results)
+    weights = module.get_weights(data.criteria_ranking, data.method)
+    if write_output:
+        module.finalize(weights, output_dir)
+    results['weights'] = weights
+
+
+def run_aggregated_preference(module, input_dir, output_dir, results,
+                              write_output, last, max_memory=None,
+                              workers=1):
+    if not write_output:
+        # the flows will be computed straight from the performances, which
+        # is much faster than going through the preferences for every pair
+        return
+    data = _get_input_data(module, input_dir, module.params, results)
+    comparables_a, comparables_b, blocks = module.get_aggregated_preferences(
+        data, max_memory=max_memory, workers=workers)
+    if not last:
+        # the preferences are kept just like 'PrometheeOutrankingFlows'
+        # reads them, i.e. as a tuple (matrix, index)
+        comparables = list(comparables_a)
+        if comparables_a != comparables_b:
+            comparables += list(comparables_b)
+        index = dict((c, i) for i, c in enumerate(comparables))
+        matrix = np.empty((len(index), len(index)))
+        matrix.fill(np.nan)
+        results['aggregated_preferences'] = (matrix, index)
+
+        def _collect(blocks):
+            for rows, columns, block in blocks:
+                matrix[np.ix_([index[r] for r in rows],
+                              [index[c] for c in columns])] = block
+                yield rows, columns, block
+
+        blocks = _collect(blocks)
+    module.finalize(data, comparables_a, comparables_b, blocks, output_dir)
+
+
+def run_outranking_flows(module, input_dir, output_dir, results, write_output,
+                         last, **kwargs):
+    if 'aggregated_preferences' in results:
+        params = module.params
+    else:
+        params = module.params_from_performances
+    data = _get_input_data(module, input_dir, params, results)
+    positive_flow, negative_flow = module.get_flows(data)
+    module.finalize(positive_flow, negative_flow, output_dir,
+                    data.comparison_with, data.alternatives)
+
+
+runners = {
+    'PrometheeSRF': run_srf,
+    'PrometheeSurrogateWeights': run_surrogate_weights,
+    'PrometheeAggregatedPreference': run_aggregated_preference,
+    'PrometheeOutrankingFlows': run_outranking_flows,
+}
+
+
+def get_jobs(args):
+    """Returns the number of jobs run at once, given with the '--jobs'
+    option (0 means one per CPU).
+    """
+    value = args.get('--jobs')
+    try:
+        jobs = int(value)
+    except (TypeError, ValueError):
+        jobs = -1
+    if jobs < 0:
+        raise InputDataError("Invalid value of the '--jobs' option: '{}'."
+                             .format(value))
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    return jobs
+
+
+def preload():
+    """Imports all the modules and compiles the XMCDA schema up front, so
+    it's done once for all the jobs (and worker processes). All the copies
+    of 'PyXMCDA' share the compiled schemas.
+    """
+    schemas = {}
+    px._schemas = schemas
+    for name in get_modules():
+        try:
+            stage = get_stage(name)
+        except Exception:
+            # e.g. a missing dependency - reported by the jobs of the module
+            continue
+        stage.shared_modules['PyXMCDA']._schemas = schemas
+    if px.XMCDA_VALIDATION != 'none':
+        try:
+            px.getSchema(px.XMCDA_2_2)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+
+
+def run_job(line):
+    """Runs the job described by 'line' (see '--serve') by calling 'main'
+    of its module, and returns its result (as a dict).
+    """
+    start = time.time()
+    result = {'id': None}
+    saved_argv = sys.argv
+    try:
+        job = json.loads(line)
+        if type(job) is not dict:
+            raise InputDataError("Invalid job: '{}'.".format(line.strip()))
+        result['id'] = job.get('id')
+        try:
+            name = job['module']
+            sys.argv = [name + '.py', '-i', job['input_dir'],
+                        '-o', job['output_dir']] + list(job.get('options', []))
+        except (KeyError, TypeError):
+            raise InputDataError("Invalid job: '{}'.".format(line.strip()))
+        if name == 'PrometheePipeline':
+            result['status'] = main()
+        else:
+            with get_stage(name) as module:
+                result['status'] = module.main()
+    except (Exception, SystemExit), err:
+        # SystemExit is raised by docopt for invalid options
+        result['status'] = 1
+        result['error'] = get_error_message(err)
+    finally:
+        sys.argv = saved_argv
+    result['time'] = round(time.time() - start, 6)
+    return result
+
+
+def _write_result(output, result):
+    output.write(json.dumps(result, sort_keys=True) + '\n')
+    output.flush()
+
+
+def _serve_jobs(worker, jobs, events):
+    for number, line in iter(jobs.get, None):
+        events.put(('result', worker, (number, run_job(line))))
+
+
+def _get_lost_job_result(line, start, exitcode):
+    """Result of the job described by 'line' (see 'run_job'), whose process
+    has died (with 'exitcode') while it was running it.
+    """
+    try:
+        job_id = json.loads(line).get('id')
+    except (ValueError, AttributeError):
+        job_id = None
+    return {'id': job_id, 'status': 1,
+            'error': "The process running the job has died (exit code: {})."
+                     .format(exitcode),
+            'time': round(time.time() - start, 6)}
+
+
+def serve(jobs_count):
+    """Runs the jobs read from the standard input (see '--serve') until it's
+    closed, up to 'jobs_count' of them at once, each one in its own process
+    (forked after 'preload', so they're all warmed up). Every process gets
+    one job at a time, so when it dies, its job is known - it's reported as
+    failed and the process is replaced.
+    """
+    output = sys.stdout
+    # the modules print their logs to the standard output
+    sys.stdout = sys.stderr
+    preload()
+    # readline, unlike iterating over the file, doesn't wait for more lines
+    lines = (l for l in iter(sys.stdin.readline, '') if l.strip())
+    if jobs_count == 1:
+        for line in lines:
+            _write_result(output, run_job(line))
+        return
+    # the lines read, the results of the jobs and the end of the input all
+    # come through 'events', as tuples (kind, worker, value)
+    events = multiprocessing.Queue()
+    workers = {}  # worker -> (process, queue of its jobs)
+    running = {}  # worker -> (number, line, start) of its job
+
+    def _start_worker(worker):
+        jobs = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_serve_jobs,
+                                    args=(worker, jobs, events))
+        p.start()
+        workers[worker] = (p, jobs)
+
+    for worker in range(jobs_count):
+        _start_worker(worker)
+
+    def _read_jobs():
+        for line in lines:
+            events.put(('job', None, line))
+        events.put(('end', None, None))
+
+    reader = threading.Thread(target=_read_jobs)
+    reader.daemon = True
+    reader.start()
+    pending = deque()
+    number = 0
+    end = False
+    while not (end and not pending and not running):
+        for worker in sorted(workers):
+            if pending and worker not in running:
+                line = pending.popleft()
+                number += 1
+                running[worker] = (number, line, time.time())
+                workers[worker][1].put((number, line))
+        try:
+            kind, worker, value = events.get(timeout=WORKER_CHECK_INTERVAL)
+        except Empty:
+            kind = None
+        if kind == 'job':
+            pending.append(value)
+        elif kind == 'end':
+            end = True
+        elif kind == 'result':
+            job_number, result = value
+            # unless the job has been reported already, as the one of a
+            # process which has died right after finishing it
+            if running.get(worker, (None,))[0] == job_number:
+                del running[worker]
+                _write_result(output, result)
+        # the processes exit only when they're told to (below)
+        for worker, (p, jobs) in workers.items():
+            if not p.is_alive():
+                p.join()
+                if worker in running:
+                    job_number, line, start = running.pop(worker)
+                    _write_result(output, _get_lost_job_result(line, start,
+                                                               p.exitcode))
+                _start_worker(worker)
+    for p, jobs in workers.values():
+        jobs.put(None)
+    for p, jobs in workers.values():
+        p.join()
+
+
+def main():
+    try:
+        args = docopt(__doc__, version=__version__)
+        output_dir = None
+        if args['--serve']:
+            serve(get_jobs(args))
+            return 0
+        input_dir, output_dir = get_dirs(args)
+
+        max_memory = get_memory_budget(args)
+        workers = get_workers(args)
+        stages = get_stages(args)
+
+        # results of the modules run so far, by the names of their outputs
+        # (e.g. 'weights')
+        results = {}
+        for stage in stages:
+            last = stage is stages[-1]
+            with stage as module:
+                runners[stage.name](module, input_dir, output_dir, results,
+                                    last or args['--intermediates'], last,
+                                    max_memory=max_memory, workers=workers)
+        return 0
+
+    except Exception, err:
+        err_msg = get_error_message(err)
+        log_msg = traceback.format_exc()
+        print(log_msg.strip())
+        create_messages_file((err_msg, ), (log_msg, ), output_dir)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
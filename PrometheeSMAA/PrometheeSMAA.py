@@ -0,0 +1,278 @@
+#!../promethee python
+
+"""
+PrometheeSMAA - computes rank acceptability indices and pairwise winning
+indices of alternatives (SMAA-2) for the weights which aren't known exactly
+
+Usage:
+    PrometheeSMAA.py -i DIR -o DIR [--samples=N] [--seed=N] [--max-time=SEC]
+                     [--cache=DIR] [--cache-size=MB]
+
+Options:
+    -i DIR     Specify input directory. It should contain the following files:
+                   alternatives.xml
+                   criteria.xml
+                   performance_table.xml
+                   method_parameters.xml
+                   generalised_criteria.xml (optional)
+                   criteria_ranking.xml (optional)
+               The weights are sampled uniformly from all the normalized
+               weights which respect the ranking of criteria from
+               'criteria_ranking.xml' (the same as for
+               'PrometheeSurrogateWeights', i.e. the most important criterion
+               has rank 1, criteria with the same rank are not ordered), or
+               from all the normalized weights when there's no ranking.
+    -o DIR     Specify output directory. Files generated as output:
+                   rank_acceptability.xml
+                   pairwise_winning_indices.xml
+                   messages.xml
+    --samples=N  Number of the sampled weights [default: 10000].
+    --seed=N   Seed of the random number generator - the results for the same
+               seed (and the same inputs) are always the same. Without it, a
+               random one is used (and reported in 'messages.xml'). E.g.
+               'tests/out1' is the output for 'tests/in1' with '--seed=1'.
+    --max-time=SEC  Time limit (in seconds) - when it's reached, the sampling
+               stops earlier and the indices are computed from the weights
+               sampled so far.
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again (only when the results are reproducible,
+               i.e. with '--seed' and without '--max-time'). The flows on
+               every criterion are cached as well, so they're reused e.g. by
+               the runs with other rankings of criteria.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
+    --version  Show version.
+    -h --help  Show this screen.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import traceback
+from itertools import groupby
+
+import numpy as np
+from docopt import docopt
+from lxml import etree
+from common import create_messages_file, get_dirs, get_error_message, \
+    get_input_data, get_performance_matrix, get_result_cache, \
+    matrix_to_pairs, write_comparisons_xmcda, write_xmcda, InputDataError, \
+    TIE_TOLERANCE
+from unicriterionFlows import get_unicriterion_flows
+
+__version__ = '0.2.0'
+
+filenames = [
+    # every tuple below == (filename, is_optional)
+    ('alternatives.xml', False),
+    ('criteria.xml', False),
+    ('performance_table.xml', False),
+    ('method_parameters.xml', False),
+    ('generalised_criteria.xml', True),
+    ('criteria_ranking.xml', True),
+]
+
+params = [
+    'alternatives',
+    'criteria',
+    'performances',
+    'pref_directions',
+    'thresholds',
+    'generalised_criteria',
+]
+
+# used when there's a ranking of criteria in the input directory
+params_with_ranking = params + ['criteria_ranking']
+
+# Number of (alternative, alternative, sample) triples compared at once when
+# the pairwise winning indices are computed - it limits the number of samples
+# in a batch (but never below one sample).
+BATCH_SIZE = 2 ** 24
+
+# Maximal number of samples in a batch (so the time limit is checked often
+# enough, even for a few alternatives).
+MAX_BATCH_SAMPLES = 2 ** 12
+
+def get_rank_groups(criteria, criteria_ranking):
+    """Returns the indices of 'criteria' grouped by their ranks, starting
+    with the most important ones (i.e. rank 1).
+    """
+    missing = [c for c in criteria if c not in criteria_ranking]
+    if missing:
+        raise InputDataError("There's no rank of the criteria: {}."
+                             .format(', '.join(missing)))
+    order = sorted(range(len(criteria)),
+                   key=lambda i: criteria_ranking[criteria[i]])
+    return [list(group) for rank, group in
+            groupby(order, key=lambda i: criteria_ranking[criteria[i]])]
+
+def sample_weights(n_criteria, rank_groups, size, rng):
+    """Samples 'size' normalized weights (as the columns of an (m x size)
+    array) uniformly from the simplex, or - when 'rank_groups' are given
+    (see 'get_rank_groups') - from its part where the weights respect the
+    ranking of criteria. The latter are the former sorted in every column
+    and assigned to the criteria rank after rank (in a random order within
+    every group of criteria with the same rank), which keeps them uniform.
+    """
+    # normalized exponential variables are uniform on the simplex
+    weights = rng.exponential(size=(n_criteria, size))
+    weights /= weights.sum(axis=0)
+    if rank_groups is None:
+        return weights
+    weights = -np.sort(-weights, axis=0)
+    ranked = np.empty_like(weights)
+    start = 0
+    for group in rank_groups:
+        end = start + len(group)
+        rows = weights[start:end]
+        if len(group) > 1:
+            permutation = np.argsort(rng.random_sample(rows.shape), axis=0)
+            rows = np.take_along_axis(rows, permutation, axis=0)
+        ranked[group] = rows
+        start = end
+    return ranked
+
+def get_ranks(net_flows):
+    """Returns the (0-based) ranks of the alternatives for every column of
+    the (n x size) array of their net flows - the alternatives with equal
+    flows share the best of their ranks (i.e. a rank is the number of the
+    alternatives with greater flows).
+    """
+    n, size = net_flows.shape
+    order = np.argsort(-net_flows, axis=0, kind='mergesort')
+    sorted_flows = np.take_along_axis(net_flows, order, axis=0)
+    positions = np.repeat(np.arange(n)[:, np.newaxis], size, axis=1)
+    ties = np.zeros((n, size), dtype=bool)
+    ties[1:] = sorted_flows[:-1] - sorted_flows[1:] <= TIE_TOLERANCE
+    positions[ties] = 0
+    sorted_ranks = np.maximum.accumulate(positions, axis=0)
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=0)
+    return ranks
+
+def simulate(flows, rank_groups, samples, rng, max_time=None):
+    """Computes the SMAA indices from the net flows of the alternatives on
+    every criterion ('flows', an (n x m) array, so the net flows for any
+    weights are just 'flows.dot(weights)'). The weights are sampled and
+    evaluated in batches, until there are 'samples' of them or 'max_time'
+    (in seconds) passes. Returns a tuple (rank acceptability, pairwise
+    winning indices, number of samples), where the indices are (n x n)
+    arrays: the share of the samples in which the alternative of a row has
+    the rank of a column, and in which it has a better rank than the one of
+    a column.
+    """
+    deadline = None if max_time is None else time.time() + max_time
+    n, m = flows.shape
+    batch = max(1, min(MAX_BATCH_SAMPLES, BATCH_SIZE // (n * n)))
+    acceptability = np.zeros((n, n))
+    winning = np.zeros((n, n))
+    cells = np.arange(n)[:, np.newaxis] * n
+    done = 0
+    while done < samples:
+        size = min(batch, samples - done)
+        weights = sample_weights(m, rank_groups, size, rng)
+        ranks = get_ranks(flows.dot(weights))
+        acceptability += np.bincount((cells + ranks).ravel(),
+                                     minlength=n * n).reshape(n, n)
+        winning += (ranks[:, np.newaxis, :] < ranks[np.newaxis, :, :]) \
+            .sum(axis=2)
+        done += size
+        if deadline is not None and time.time() >= deadline:
+            break
+    return acceptability / done, winning / done, done
+
+def rank_acceptability_to_xmcda(alternatives, acceptability):
+    xmcda = etree.Element('alternativesValues',
+                          mcdaConcept='rank_acceptability')
+    for a, row in zip(alternatives, acceptability.tolist()):
+        alt_value = etree.SubElement(xmcda, 'alternativeValue')
+        alt_id = etree.SubElement(alt_value, 'alternativeID')
+        alt_id.text = a
+        values = etree.SubElement(alt_value, 'values')
+        for rank, share in enumerate(row, 1):
+            value = etree.SubElement(values, 'value', id=str(rank))
+            real = etree.SubElement(value, 'real')
+            real.text = str(share)
+    return xmcda
+
+def get_seed(args):
+    if args['--seed'] is not None:
+        return int(args['--seed'])
+    return np.random.RandomState().randint(2 ** 31)
+
+def get_sampling_limits(args):
+    samples = int(args['--samples'])
+    if samples < 1:
+        raise InputDataError("The number of samples should be positive.")
+    max_time = args['--max-time']
+    if max_time is not None:
+        max_time = float(max_time)
+    return samples, max_time
+
+def finalize(alternatives, acceptability, winning, output_dir, log_messages):
+    write_xmcda(rank_acceptability_to_xmcda(alternatives, acceptability),
+                os.path.join(output_dir, 'rank_acceptability.xml'))
+    write_comparisons_xmcda(matrix_to_pairs(winning, alternatives,
+                                            alternatives),
+                            os.path.join(output_dir,
+                                         'pairwise_winning_indices.xml'),
+                            mcda_concept='pairwise_winning_indices')
+    create_messages_file(None, ('Everything OK.',) + log_messages, output_dir)
+
+def main():
+    try:
+        args = docopt(__doc__, version=__version__)
+        output_dir = None
+        input_dir, output_dir = get_dirs(args)
+        samples, max_time = get_sampling_limits(args)
+        seed = get_seed(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        # the results are worth caching only when they're reproducible
+        reproducible = args['--seed'] is not None and max_time is None
+        if (reproducible and result_cache is not None and
+                result_cache.restore()):
+            return 0
+
+        if os.path.isfile(os.path.join(input_dir, 'criteria_ranking.xml')):
+            data = get_input_data(input_dir, filenames, params_with_ranking)
+            rank_groups = get_rank_groups(data.criteria, data.criteria_ranking)
+        else:
+            data = get_input_data(input_dir, filenames, params)
+            rank_groups = None
+
+        perf = get_performance_matrix(data.alternatives, data.performances,
+                                      data.criteria)
+        positive, negative = get_unicriterion_flows(perf, data.criteria,
+                                                    data.generalised_criteria,
+                                                    data.thresholds,
+                                                    data.pref_directions,
+                                                    cache=result_cache)
+        flows = (positive - negative) / max(1, len(data.alternatives) - 1)
+        rng = np.random.RandomState(seed)
+        acceptability, winning, done = simulate(flows, rank_groups, samples,
+                                                rng, max_time)
+
+        log_messages = ('Samples: {} (seed: {}).'.format(done, seed),)
+        if done < samples:
+            log_messages += ('The time limit has been reached.',)
+        finalize(data.alternatives, acceptability, winning, output_dir,
+                 log_messages)
+        if reproducible and result_cache is not None:
+            result_cache.store(log_messages)
+
+        return 0
+
+    except Exception, err:
+        err_msg = get_error_message(err)
+        log_msg = traceback.format_exc()
+        print(log_msg.strip())
+        create_messages_file((err_msg, ), (log_msg, ), output_dir)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
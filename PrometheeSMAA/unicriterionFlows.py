@@ -0,0 +1,178 @@
+from __future__ import division
+
+import hashlib
+import json
+from functools import partial
+
+import numpy as np
+
+from preferenceFunction import get_partial_preference_kernel, \
+    get_partial_preference_matrix
+
+# Generalised criteria which flows can be computed for by sorting the
+# evaluations instead of comparing every pair of alternatives (as long as
+# their thresholds are constant).
+SORTABLE_CRITERIA = (1, 2, 3, 4, 5)
+
+# Size (in number of pairs) of the blocks of pairwise preferences computed at
+# once when a criterion isn't sortable.
+PAIRWISE_BLOCK_SIZE = 2 ** 20
+
+def is_sortable(pref_direction, function_no, threshold):
+    if function_no not in SORTABLE_CRITERIA:
+        return False
+    if pref_direction not in ('max', 'min'):
+        return False
+    for t in ('preference', 'indifference'):
+        if type(threshold.get(t, 0)) is dict:
+            return False
+    return True
+
+def _get_sorted_thresholds(function_no, threshold):
+    """Returns thresholds (q, p) and the value of preference between them,
+    which describe every sortable criterion as:
+        P(d) = 0 for d <= q, middle value for q < d <= p, 1 for d > p
+    where the middle value is either a constant or None for the linear part
+    (d - q) / (p - q).
+    """
+    p = threshold.get('preference', 0)
+    q = threshold.get('indifference', 0)
+    if function_no == 1:
+        return 0, 0, None
+    if function_no == 2:
+        return q, q, None
+    if function_no == 3:
+        return 0, p, None
+    if function_no == 4:
+        return q, p, 0.5
+    return q, p, None
+
+def get_sorted_flows(x, reference, function_no, threshold):
+    """Sums of preferences of every 'x' over all the 'reference' values
+    (positive) and of all the 'reference' values over every 'x' (negative),
+    in O((len(x) + len(reference)) * log(len(reference))) time.
+    Both arguments are evaluations on one criterion, already oriented so that
+    bigger is better (i.e. negated for 'min' criteria). Results may differ
+    from the pairwise computation only for differences which are equal to
+    one of the thresholds up to the floating point precision.
+    """
+    q, p, middle = _get_sorted_thresholds(function_no, threshold)
+    upper = max(p, q)
+    n = len(reference)
+    sorted_reference = np.sort(reference)
+    prefix_sums = np.concatenate(([0.0], np.cumsum(sorted_reference)))
+
+    # positive: x - r > upper  <=>  r < x - upper, etc.
+    positive = np.searchsorted(sorted_reference, x - upper, 'left').astype(float)
+    # negative: r - x > upper  <=>  r > x + upper, etc.
+    negative = n - np.searchsorted(sorted_reference, x + upper, 'right')
+    negative = negative.astype(float)
+    if p > q:
+        lo = np.searchsorted(sorted_reference, x - p, 'left')
+        hi = np.searchsorted(sorted_reference, x - q, 'left')
+        counts = hi - lo
+        if middle is not None:
+            positive += middle * counts
+        else:
+            sums = prefix_sums[hi] - prefix_sums[lo]
+            positive += (counts * (x - q) - sums) / (p - q)
+        lo = np.searchsorted(sorted_reference, x + q, 'right')
+        hi = np.searchsorted(sorted_reference, x + p, 'right')
+        counts = hi - lo
+        if middle is not None:
+            negative += middle * counts
+        else:
+            sums = prefix_sums[hi] - prefix_sums[lo]
+            negative += (sums - counts * (x + q)) / (p - q)
+    return positive, negative
+
+def get_pairwise_flows(perf, reference_perf, pref_direction, function_no,
+                       threshold, exclude_self=False):
+    """Same as 'get_sorted_flows', but for any criterion - the preferences
+    are computed for every pair, block of rows after block of rows, so the
+    memory used doesn't grow quadratically.
+    """
+    block = max(1, PAIRWISE_BLOCK_SIZE // max(1, len(reference_perf)))
+    kernel = get_partial_preference_kernel(pref_direction, function_no,
+                                           threshold)
+    positive = np.empty(len(perf))
+    negative = np.empty(len(perf))
+    for start in range(0, len(perf), block):
+        end = min(start + block, len(perf))
+        # the second array holds the preferences of the reference over the
+        # rows of the block (transposed)
+        preferences, reversed_preferences = kernel(perf[start:end],
+                                                   reference_perf,
+                                                   both_ways=True)
+        if exclude_self:
+            rows = np.arange(end - start)
+            preferences[rows, rows + start] = 0
+            reversed_preferences[rows, rows + start] = 0
+        positive[start:end] = preferences.sum(axis=1)
+        negative[start:end] = reversed_preferences.sum(axis=1)
+    return positive, negative
+
+def get_unicriterion_key(perf, reference_perf, pref_direction, function_no,
+                         threshold):
+    """Key of the flows on one criterion in a cache (see 'ResultCache' from
+    'common'), i.e. a hash of everything they depend on - the evaluations
+    ('reference_perf' is None when they're compared with each other) and
+    the generalised criterion with its thresholds. So the flows of the
+    criteria which haven't changed are reused, e.g. when only the weights
+    do.
+    """
+    h = hashlib.sha1(json.dumps([pref_direction, function_no, threshold],
+                                sort_keys=True))
+    h.update(np.ascontiguousarray(perf, dtype=float).tobytes())
+    if reference_perf is not None:
+        h.update(b'|')
+        h.update(np.ascontiguousarray(reference_perf, dtype=float).tobytes())
+    return h.hexdigest()
+
+def get_unicriterion_flows(perf, criteria, generalised_criteria, thresholds,
+                           pref_directions, reference_perf=None, cache=None):
+    """Computes (not normalized) positive and negative flows of the rows of
+    'perf' on every criterion separately, i.e. two (n x m) arrays, where m
+    is the number of criteria. The flows are computed against the rows of
+    'reference_perf', or - when it's None - against the other rows of
+    'perf' (i.e. every alternative against all the other ones).
+    Aggregated flows are then just a matter of: 'positive.dot(weights)'.
+    When a 'cache' is given (see 'ResultCache' from 'common'), the flows on
+    every criterion are taken from it, if they've been computed already.
+    """
+    positive = np.empty((perf.shape[0], len(criteria)))
+    negative = np.empty((perf.shape[0], len(criteria)))
+    for i, c in enumerate(criteria):
+        args = (perf[:, i],
+                None if reference_perf is None else reference_perf[:, i],
+                pref_directions[c], generalised_criteria[c], thresholds[c])
+        if cache is None:
+            flows = _get_criterion_flows(*args)
+        else:
+            flows = cache.get_array(get_unicriterion_key(*args),
+                                    partial(_get_criterion_flows, *args))
+        positive[:, i], negative[:, i] = flows
+    return positive, negative
+
+def _get_criterion_flows(perf, reference_perf, pref_direction, function_no,
+                         threshold):
+    # flows on one criterion, as a (2 x n) array - see
+    # 'get_unicriterion_flows'
+    exclude_self = reference_perf is None
+    if exclude_self:
+        reference_perf = perf
+    if is_sortable(pref_direction, function_no, threshold):
+        sign = 1 if pref_direction == 'max' else -1
+        pos, neg = get_sorted_flows(sign * perf, sign * reference_perf,
+                                    function_no, threshold)
+        if exclude_self:
+            # preference of every alternative over itself
+            self_preference = get_partial_preference_matrix(
+                np.zeros(1), np.zeros(1), pref_direction, function_no,
+                threshold)[0, 0]
+            pos -= self_preference
+            neg -= self_preference
+    else:
+        pos, neg = get_pairwise_flows(perf, reference_perf, pref_direction,
+                                      function_no, threshold, exclude_self)
+    return np.array([pos, neg])
@@ -4,7 +4,7 @@
 PrometheeSRF - computes weights of criteria using the revised Simos procedure
 
 Usage:
-    PrometheeSRF.py -i DIR -o DIR
+    PrometheeSRF.py -i DIR -o DIR [--cache=DIR] [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -14,6 +14,12 @@ Options:
     -o DIR     Specify output directory. Files generated as output:
                    weights.xml
                    messages.xml
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
@@ -26,7 +32,8 @@ import os
 from unicodedata import decimal
 from docopt import docopt
 from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict, weights_to_xmcda
+    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict, weights_to_xmcda, \
+    get_result_cache
 from networkx.classes.function import non_edges
 from math import floor, ceil
 
@@ -123,6 +130,13 @@ def get_normalized_weights_up_to_100(L_plus, L_minus, L_plus_greater_than_L_minu
             i += 1
     return normalized_weights_up_to_100
 
+def get_weights(criteria_ranking, criteria_weight_ratio, decimal_places):
+    non_normalized_weights = get_non_normalized_weights(criteria_ranking, criteria_weight_ratio)
+    (normalized_weights)= get_normalized_weights(non_normalized_weights)
+    rounded_weights = get_rounded_weights(normalized_weights, decimal_places)
+    (L_plus, L_minus, L_plus_greater_than_L_minus) = get_ratios_to_normalization(normalized_weights, rounded_weights, decimal_places)
+    return get_normalized_weights_up_to_100(L_plus, L_minus, L_plus_greater_than_L_minus, rounded_weights, normalized_weights, decimal_places)
+
 def finalize(data, output_dir):
     mcda_concept = 'Importance'
     xmcda = weights_to_xmcda(data, mcda_concept)
@@ -134,15 +148,17 @@ def main():
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
         data = get_input_data(input_dir, filenames, params)
 
-        non_normalized_weights = get_non_normalized_weights(data.criteria_ranking, data.criteria_weight_ratio)
-        (normalized_weights)= get_normalized_weights(non_normalized_weights)
-        rounded_weights = get_rounded_weights(normalized_weights, data.decimal_places)
-        (L_plus, L_minus, L_plus_greater_than_L_minus) = get_ratios_to_normalization(normalized_weights, rounded_weights, data.decimal_places)
-        normalized_weights_up_to_100 = get_normalized_weights_up_to_100(L_plus, L_minus, L_plus_greater_than_L_minus, rounded_weights, normalized_weights, data.decimal_places)
-        finalize(normalized_weights_up_to_100, output_dir)
+        weights = get_weights(data.criteria_ranking, data.criteria_weight_ratio, data.decimal_places)
+        finalize(weights, output_dir)
+        if result_cache is not None:
+            result_cache.store()
 
         return 0
 
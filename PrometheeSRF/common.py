@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import fcntl
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
 import re
+import shutil
+import tempfile
+from contextlib import contextmanager
 from functools import partial
+from itertools import islice
+from xml.sax.saxutils import escape
 
+import numpy as np
 import PyXMCDA as px
 from lxml import etree
 
@@ -24,6 +35,17 @@ THRESHOLDS = ['indifference', 'preference', 'veto', 'reinforced_preference',
 
 THRESHOLDS_OLD_TO_NEW = {'ind': 'indifference', 'pref': 'preference'}
 
+# Net flows which differ less than that are considered equal (i.e. their
+# alternatives share a rank).
+TIE_TOLERANCE = 1e-12
+
+# Input files which may be too big to be loaded as a whole (i.e. the ones
+# with some data for every pair of alternatives or for every alternative) -
+# '_get_trees' only stores their paths and they are parsed incrementally by
+# the functions which read them (see 'PyXMCDA.iterparseValidate').
+STREAMED_FILES = ('aggregated_preferences.xml', 'performance_table.xml',
+                  'profiles_performance_table.xml')
+
 
 class InputDataError(Exception):
     pass
@@ -40,15 +62,24 @@ class Vividict(dict):
 
 
 class InputData(object):
-    # same as: InputData = type('InputData', (object,), {})
-    pass
-
+    """Params of a module, as attributes. Every param is loaded by its
+    function from 'loaders' only when it's accessed for the first time (so
+    the ones which are never used cost nothing) and kept afterwards.
+    """
 
-def _create_data_object(params):
-    obj = InputData()
-    for p in params:
-        setattr(obj, p, None)
-    return obj
+    def __init__(self, loaders=None):
+        self._loaders = loaders if loaders is not None else {}
+
+    def __getattr__(self, name):
+        # called only for the attributes which haven't been set yet
+        loaders = self.__dict__.get('_loaders', {})
+        if name not in loaders:
+            raise AttributeError("'InputData' object has no attribute '{}'"
+                                 .format(name))
+        value = loaders[name]()
+        del loaders[name]
+        setattr(self, name, value)
+        return value
 
 
 ###############################################################################
@@ -92,6 +123,34 @@ def get_linear(pref_directions, ga, gb, threshold):
     return value
 
 
+def get_linear_array(pref_direction, perf_a, perf_b, threshold):
+    """Array counterpart of 'get_linear' - returns the values of the
+    threshold for every pair (a, b) at once, as a (len(perf_a) x
+    len(perf_b)) array, where 'perf_a' and 'perf_b' are the evaluations on
+    the given criterion (a constant threshold is returned as it is).
+    The threshold is calculated for every evaluation only once, and then the
+    one of the weaker evaluation of every pair is picked - since a linear
+    function is monotonic, it's the smaller or the bigger of the two values
+    (depending on the direction of preference and the sign of the slope),
+    which is exactly the value 'get_linear' gives for the pair.
+    """
+    if type(threshold) is not dict:  # true when threshold is constant
+        return threshold
+    if pref_direction not in ('max', 'min'):
+        raise InputDataError("Linear thresholds require the direction of "
+                             "preference ('max' or 'min').")
+    slope = threshold.get('slope', 0)
+    intercept = threshold.get('intercept', 0)
+    values_a = slope * np.asarray(perf_a) + intercept
+    values_b = slope * np.asarray(perf_b) + intercept
+    # the weaker evaluation is the smaller one for 'max' criteria
+    if (pref_direction == 'max') == (slope >= 0):
+        pick = np.minimum
+    else:
+        pick = np.maximum
+    return pick(values_a[:, np.newaxis], values_b[np.newaxis, :])
+
+
 def omega(pref_directions, criterion, x, y):
     if pref_directions[criterion] == 'max':
         return x - y
@@ -99,6 +158,143 @@ def omega(pref_directions, criterion, x, y):
         return y - x
 
 
+def get_performance_matrix(comparables, performances, criteria):
+    """Converts the performance table (i.e. nested dicts) into a 2D float
+    array, where rows follow the order of 'comparables' and columns follow the
+    order of 'criteria'.
+    """
+    matrix = np.empty((len(comparables), len(criteria)))
+    for i, a in enumerate(comparables):
+        perf = performances[a]
+        matrix[i] = [perf[c] for c in criteria]
+    return matrix
+
+
+def get_tiles(n_rows, n_columns, max_pairs):
+    """Splits a (n_rows x n_columns) matrix of comparisons into tiles of at
+    most 'max_pairs' cells and yields them as tuples (rows, columns) of
+    slices. The tiles are bands of whole rows, unless even a single row is
+    too big - then every row is split into blocks of columns. Either way they
+    come in the row-major order, so their cells can be written one tile
+    after another (see 'tiles_to_pairs').
+    """
+    max_pairs = max(1, int(max_pairs))
+    band = max(1, max_pairs // max(1, n_columns))
+    block = n_columns if band > 1 else min(n_columns, max_pairs)
+    for start in range(0, n_rows, band):
+        rows = slice(start, min(start + band, n_rows))
+        for column in range(0, n_columns, max(1, block)):
+            yield rows, slice(column, min(column + block, n_columns))
+
+
+# Minimal number of the bands of rows of a matrix of comparisons of elements
+# with themselves (see 'compute_symmetric_tiles').
+MIN_SYMMETRIC_BANDS = 16
+
+# The function (and the shared buffer) used by the workers started by
+# 'compute_tiles' - they are inherited by the forked processes, so the
+# function doesn't have to be picklable and only the bounds of the tiles are
+# sent to the workers.
+_tile_function = None
+_tile_buffer = None
+
+
+def _compute_tile(task):
+    slot, rows, columns = task
+    shape = (rows.stop - rows.start, columns.stop - columns.start)
+    out = _tile_buffer[slot][:shape[0] * shape[1]].reshape(shape)
+    _tile_function(rows, columns, out)
+
+
+def compute_tiles(tile_function, n_rows, n_columns, max_pairs, workers=1):
+    """Computes a (n_rows x n_columns) matrix of comparisons tile by tile
+    (see 'get_tiles') and yields the tiles, in order, as tuples (rows,
+    columns, tile). Every tile is computed by calling
+    'tile_function(rows, columns, out)', which has to fill the 'out' array.
+    At most 'max_pairs' pairs are kept in memory at a time.
+    With more than one worker, the tiles are computed by a pool of processes
+    which write them straight into shared memory, one wave of tiles while
+    the previous one is being consumed - so the yielded tiles are valid only
+    until the next one is requested.
+    """
+    global _tile_function, _tile_buffer
+    if workers <= 1:
+        for rows, columns in get_tiles(n_rows, n_columns, max_pairs):
+            out = np.empty((rows.stop - rows.start,
+                            columns.stop - columns.start))
+            tile_function(rows, columns, out)
+            yield rows, columns, out
+        return
+    # two waves (i.e. the one being computed and the one being consumed)
+    slot_size = max(1, int(max_pairs) // (2 * workers))
+    buffer_ = multiprocessing.RawArray('d', 2 * workers * slot_size)
+    _tile_function = tile_function
+    _tile_buffer = np.frombuffer(buffer_).reshape(2 * workers, slot_size)
+    pool = multiprocessing.Pool(workers)
+    try:
+        tiles = get_tiles(n_rows, n_columns, slot_size)
+
+        def _submit(wave_no):
+            wave = list(islice(tiles, workers))
+            first_slot = (wave_no % 2) * workers
+            tasks = [(first_slot + i, rows, columns)
+                     for i, (rows, columns) in enumerate(wave)]
+            return wave, first_slot, pool.map_async(_compute_tile, tasks)
+
+        wave_no = 0
+        current = _submit(wave_no)
+        while current[0]:
+            wave_no += 1
+            following = _submit(wave_no)
+            wave, first_slot, result = current
+            result.get()
+            for i, (rows, columns) in enumerate(wave):
+                shape = (rows.stop - rows.start, columns.stop - columns.start)
+                tile = _tile_buffer[first_slot + i][:shape[0] * shape[1]]
+                yield rows, columns, tile.reshape(shape)
+            current = following
+    finally:
+        pool.terminate()
+        pool.join()
+        _tile_function = _tile_buffer = None
+
+
+def compute_symmetric_tiles(tile_function, n, max_pairs, workers=1):
+    """Same as 'compute_tiles', but for a (n x n) matrix of comparisons of
+    elements with themselves, where the pairs (a, b) and (b, a) are computed
+    together: only the part of every tile from its diagonal on (i.e. from
+    the column of its first row) is computed, by calling
+    'tile_function(rows, columns, out, reversed_out)', which has to fill
+    'out' and 'reversed_out' - the comparisons of the columns with the rows,
+    i.e. a (columns x rows) array. The latter ones are kept in a temporary
+    file as the lower triangle of the matrix, from which the rest of every
+    tile is taken - the tiles come in the row-major order, so all of its
+    pairs have been computed by then.
+    """
+    if n == 0:
+        return
+    # the squares on the diagonal are computed both ways, so they should be
+    # a small part of all the pairs
+    max_pairs = min(max_pairs, n * -(-n // MIN_SYMMETRIC_BANDS))
+    # only the lower triangle of the file is used
+    lower = np.memmap(tempfile.TemporaryFile(), dtype=float, mode='w+',
+                      shape=(n, n))
+
+    def _compute_upper_part(rows, columns, out):
+        start = max(rows.start, columns.start)
+        if start < columns.stop:
+            upper = slice(start, columns.stop)
+            tile_function(rows, upper, out[:, start - columns.start:],
+                          lower[upper, rows])
+
+    for rows, columns, tile in compute_tiles(_compute_upper_part, n, n,
+                                             max_pairs, workers):
+        end = min(rows.start, columns.stop)
+        if end > columns.start:
+            tile[:, :end - columns.start] = lower[rows, columns.start:end]
+        yield rows, columns, tile
+
+
 ###############################################################################
 # Getting the input data and related stuff.                                   #
 # Functions prefixed with the underscore are meant for the internal use only. #
@@ -114,6 +310,42 @@ def get_dirs(args):
     return input_dir, output_dir
 
 
+def get_workers(args):
+    """Returns the number of worker processes given with the '--workers'
+    option (0 means one per CPU), or 1 if there's no such option.
+    """
+    value = args.get('--workers')
+    if value is None:
+        return 1
+    try:
+        workers = int(value)
+    except ValueError:
+        workers = -1
+    if workers < 0:
+        raise InputDataError("Invalid value of the '--workers' option: "
+                             "'{}'.".format(value))
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    return workers
+
+
+def get_memory_budget(args):
+    """Returns the memory budget (in bytes) given in megabytes with the
+    '--max-memory' option, or None if there's no such option.
+    """
+    value = args.get('--max-memory')
+    if value is None:
+        return None
+    try:
+        budget = float(value)
+    except ValueError:
+        budget = 0
+    if budget <= 0:
+        raise InputDataError("Invalid value of the '--max-memory' option: "
+                             "'{}'.".format(value))
+    return int(budget * 2 ** 20)
+
+
 def _get_trees(input_dir, filenames):
     trees = {}
     for f, is_optional in filenames:
@@ -124,8 +356,10 @@ def _get_trees(input_dir, filenames):
             else:
                 raise InputDataError("Problem with the input file: '{}'."
                                      .format(f))
-        tree = None
-        tree = px.parseValidate(file_name)
+        if f in STREAMED_FILES:
+            tree = file_name
+        else:
+            tree = px.parseValidate(file_name)
         if tree is None:
             raise InputDataError("Validation error with the file: '{}'."
                                  .format(f))
@@ -139,6 +373,110 @@ def _get_trees(input_dir, filenames):
     return trees
 
 
+def _validate_trees(trees):
+    """Validates the trees which were only parsed by '_get_trees', i.e. when
+    the 'lazy' validation is in use (see 'PyXMCDA.XMCDA_VALIDATION').
+    """
+    for tree in trees.values():
+        if isinstance(tree, basestring):
+            # streamed file (see 'STREAMED_FILES')
+            valid = px.parseValidate(tree, validation='strict') is not None
+            f = os.path.split(tree)[-1]
+        else:
+            valid = px.validateXMCDA(tree)
+            f = os.path.split(tree.base)[-1]
+        if not valid:
+            raise InputDataError("Validation error with the file: '{}'."
+                                 .format(f))
+
+
+def _iterparse(file_name, tag, parent_tag, mcda_concept=None):
+    """Yields the 'tag' elements from the first 'parent_tag' element (with
+    the given 'mcdaConcept' attribute, if specified) found in the file, which
+    is parsed incrementally (and validated on the fly, depending on
+    'PyXMCDA.XMCDA_VALIDATION'). Every element is freed as soon as the next
+    one is requested, so it shouldn't be kept by the caller.
+    """
+    parent = None
+    try:
+        for element in px.iterparseValidate(file_name, tag):
+            for ancestor in element.iterancestors(parent_tag):
+                break
+            else:
+                continue
+            if (mcda_concept is not None and
+                    ancestor.get('mcdaConcept') != mcda_concept):
+                continue
+            if parent is None:
+                parent = ancestor
+            elif ancestor is not parent:
+                # the rest of the file is still parsed (i.e. validated)
+                continue
+            yield element
+    except (etree.LxmlError, IOError):
+        # i.e. an invalid file or a schema which is not available
+        f = os.path.split(file_name)[-1]
+        raise InputDataError("Validation error with the file: '{}'."
+                             .format(f))
+
+
+def _get_performance_table(file_name):
+    """Streaming counterpart of 'PyXMCDA.getPerformanceTable'."""
+    performance_table = {}
+    for alternative_performances in _iterparse(file_name,
+                                               'alternativePerformances',
+                                               'performanceTable'):
+        alternative = alternative_performances.findtext('alternativeID')
+        performances = performance_table[alternative] = {}
+        for performance in alternative_performances.iterfind('performance'):
+            criterion = performance.findtext('criterionID')
+            performances[criterion] = px.getSimpleValue(performance)
+    return performance_table
+
+
+def iter_performance_table(file_name, comparables, criteria, chunk_size):
+    """Streaming counterpart of 'get_performance_matrix' for the performance
+    table in 'file_name' - yields tuples (ids, matrix) for the chunks of at
+    most 'chunk_size' of 'comparables' (the other elements are skipped), in
+    the order of the file, so only one chunk of performances is kept in
+    memory at a time.
+    """
+    comparables = set(comparables)
+    seen = set()
+    ids = []
+    rows = []
+    for alternative_performances in _iterparse(file_name,
+                                               'alternativePerformances',
+                                               'performanceTable'):
+        alternative = alternative_performances.findtext('alternativeID')
+        if alternative not in comparables:
+            continue
+        if alternative in seen:
+            raise InputDataError("Performances of '{}' are given more than "
+                                 "once.".format(alternative))
+        seen.add(alternative)
+        performances = {}
+        for performance in alternative_performances.iterfind('performance'):
+            criterion = performance.findtext('criterionID')
+            performances[criterion] = px.getSimpleValue(performance)
+        try:
+            rows.append([performances[c] for c in criteria])
+        except KeyError as e:
+            raise InputDataError("Missing performance of '{}' on criterion "
+                                 "'{}'.".format(alternative, e.args[0]))
+        ids.append(alternative)
+        if len(ids) == chunk_size:
+            yield ids, np.array(rows, dtype=float)
+            ids = []
+            rows = []
+    if ids:
+        yield ids, np.array(rows, dtype=float)
+    missing = comparables - seen
+    if missing:
+        raise InputDataError("Missing performances of: {}."
+                             .format(', '.join(sorted(missing))))
+
+
 def _get_thresholds(xmltree):
     """This is basically the same as px.getConstantThresholds, but with the
     added ability to get linear thresholds as well.
@@ -211,14 +549,14 @@ def _get_intersection_distillation(xmltree, altId):
     else:
         comparisons = comparisons[0]
         datas = {}
+        alt_index = set(altId)
         for pair in comparisons.findall("pairs/pair"):
             init = pair.find("initial/alternativeID").text
             term = pair.find("terminal/alternativeID").text
-            if altId.count(init) > 0:
-                if altId.count(term) > 0:
-                    if init not in datas:
-                        datas[init] = {}
-                    datas[init][term] = 1.0
+            if init in alt_index and term in alt_index:
+                if init not in datas:
+                    datas[init] = {}
+                datas[init][term] = 1.0
         return datas
 
 
@@ -278,6 +616,9 @@ def _get_alternatives_comparisons(xmltree, alternatives,
     if comparisons is None:
         return {}
     else:
+        comparables = set(alternatives)
+        if categories_profiles is not None:
+            comparables.update(categories_profiles)
         ret = Vividict()
         for pair in comparisons.findall("pairs/pair"):
             initial = pair.find("initial/alternativeID").text
@@ -301,14 +642,134 @@ def _get_alternatives_comparisons(xmltree, alternatives,
                 for value_node in value_nodes:
                     value_node_id = value_node.get("id")
                     values[value_node_id] = _get_value(value_node)
-            if initial in alternatives or initial in categories_profiles:
-                if terminal in alternatives or terminal in categories_profiles:
-                    if initial not in ret:
-                        ret[initial] = Vividict()
-                    ret[initial][terminal] = values if use_partials else value
+            if initial in comparables and terminal in comparables:
+                if initial not in ret:
+                    ret[initial] = Vividict()
+                ret[initial][terminal] = values if use_partials else value
         return ret
 
 
+def _get_alternatives_comparisons_matrix(file_name, comparables,
+                                         mcda_concept=None):
+    """Streaming version of '_get_alternatives_comparisons' for numeric
+    values - the pairs are read one by one straight into a preallocated
+    array, so the tree of the file is never built.
+    Returns a tuple (matrix, index), where 'index' maps the ids from
+    'comparables' to the rows/columns of the dense 'matrix'. Pairs which are
+    missing in the file are set to NaN, pairs which involve unknown ids are
+    skipped.
+    """
+    index = dict((c, i) for i, c in enumerate(comparables))
+    matrix = np.empty((len(index), len(index)))
+    matrix.fill(np.nan)
+    for pair in _iterparse(file_name, 'pair', 'alternativesComparisons',
+                           mcda_concept):
+        i = index.get(pair.findtext("initial/alternativeID"))
+        j = index.get(pair.findtext("terminal/alternativeID"))
+        if i is None or j is None:
+            continue
+        # plain numbers are by far the most common case
+        value = pair.findtext("value/real")
+        if value is not None:
+            value = float(value)
+        else:
+            value = px.getNumericValue(pair)
+            if type(value) not in (int, float):
+                f = os.path.split(file_name)[-1]
+                raise InputDataError("Non-numeric value found in '{}' file."
+                                     .format(f))
+        matrix[i, j] = value
+    return matrix, index
+
+
+def get_ids_file_name(file_name):
+    """Name of the file with the ids of the rows/columns of the binary
+    matrix saved as 'file_name' (one id per line, in the order of rows).
+    """
+    return os.path.splitext(file_name)[0] + '.ids'
+
+
+def get_sums_file_name(file_name):
+    """Name of the file with the sums of the rows and of the columns of the
+    binary matrix saved as 'file_name' (as a (2 x n) array in the '.npy'
+    format, NaN for the rows/columns with missing values).
+    """
+    return os.path.splitext(file_name)[0] + '.sums.npy'
+
+
+def load_matrix(file_name, mode='r'):
+    """Memory-maps the binary matrix saved as 'file_name' (see
+    'MatrixWriter') with the given 'mode' of 'np.load'. Returns a tuple
+    (matrix, ids), where 'ids' are the ids of its rows/columns. Raises
+    IOError or ValueError, when the matrix can't be read.
+    """
+    matrix = np.load(file_name, mmap_mode=mode)
+    with open(get_ids_file_name(file_name)) as ids_file:
+        ids = [line.rstrip('\n').decode('utf-8') for line in ids_file]
+    if matrix.ndim != 2 or matrix.shape != (len(ids), len(ids)):
+        raise ValueError("Invalid shape of the matrix: '{}'."
+                         .format(file_name))
+    return matrix, ids
+
+
+def get_matrix_sums(file_name):
+    """Returns a tuple (row sums, column sums) of the binary matrix saved as
+    'file_name' (see 'get_sums_file_name'), or None when they're missing.
+    """
+    try:
+        sums = np.load(get_sums_file_name(file_name))
+    except (IOError, ValueError):
+        return None
+    return sums[0], sums[1]
+
+
+def save_matrix_index(file_name, comparables, sums):
+    """Writes the files which describe the binary matrix already saved as
+    'file_name': the sums of its rows and columns ('sums', see
+    'get_sums_file_name') and the ids of its rows/columns ('comparables', see
+    'get_ids_file_name') - the ids are written last, so an incomplete matrix
+    can't be read.
+    """
+    np.save(get_sums_file_name(file_name), sums)
+    with open(get_ids_file_name(file_name), 'w') as f:
+        for c in comparables:
+            if type(c) is unicode:
+                c = c.encode('utf-8')
+            f.write(c + '\n')
+
+
+def remove_matrix_index(file_name):
+    """Removes the files written by 'save_matrix_index', i.e. marks the
+    matrix saved as 'file_name' as incomplete before it's (over)written.
+    """
+    for f in (get_ids_file_name(file_name), get_sums_file_name(file_name)):
+        if os.path.isfile(f):
+            os.remove(f)
+
+
+def _get_alternatives_comparisons_npy(file_name, comparables):
+    """Binary counterpart of '_get_alternatives_comparisons_matrix' - the
+    matrix written by 'MatrixWriter' is memory-mapped (read-only), so it's
+    neither parsed nor copied, and its pages are loaded on demand.
+    Returns a tuple (matrix, index), where 'index' maps the ids from the file
+    of ids (see 'get_ids_file_name') to the rows/columns of the 'matrix'.
+    """
+    f = os.path.split(file_name)[-1]
+    try:
+        matrix, ids = load_matrix(file_name)
+    except (IOError, ValueError):
+        raise InputDataError("Validation error with the file: '{}'."
+                             .format(f))
+    index = dict((c, i) for i, c in enumerate(ids))
+    for c in comparables:
+        if c not in index:
+            raise InputDataError("Missing '{}' in the '{}' file."
+                                 .format(c, f))
+    # a plain (read-only) view of the mapped file, so anything taken from it
+    # is an ordinary array
+    return np.asarray(matrix), index
+
+
 # XXX not sure if it's a good idea to return two different data structures
 # here, i.e.: for boundary profiles: ['b1', 'b2', 'b3', 'b4'], for central
 # profiles: {'b1': 'C2', 'b2': 'C2', 'b3': 'C3'}.
@@ -417,11 +878,37 @@ def get_input_data(input_dir, filenames, params, **kwargs):
     """Looks for files specified by 'filenames' in directory specified by
     'input_dir'. Gets the data from these files according to what is specified
     in 'params'. Every such param is handled (i.e., loaded and to some extent
-    verified) by a function associated with it in '_functions_dict'.
+    verified) by a function associated with it in '_functions_dict' - lazily,
+    i.e. when it's accessed for the first time (see 'InputData').
     """
+    # values needed by many params (e.g. the ids of criteria) are computed
+    # only once for all of them
+    memo = {}
+
+    def _memoized(key, function, *args):
+        if key not in memo:
+            memo[key] = function(*args)
+        return memo[key]
+
+    def _get_alternatives():
+        return _memoized('alternatives', px.getAlternativesID,
+                         trees['alternatives'])
+
+    def _get_criteria():
+        return _memoized('criteria', px.getCriteriaID, trees['criteria'])
+
+    def _get_comparison_with():
+        return _memoized('comparison_with', px.getParameterByName,
+                         trees['method_parameters'], 'comparison_with')
+
+    def _get_profiles(comparison_with):
+        return _memoized(('categories_profiles', comparison_with),
+                         _get_categories_profiles,
+                         trees.get('categories_profiles'), comparison_with)
+
     #use
     def get_alternatives(*args, **kwargs):
-        alternatives = px.getAlternativesID(trees['alternatives'])
+        alternatives = _get_alternatives()
         return alternatives  # list
 
     #use
@@ -429,32 +916,25 @@ def get_input_data(input_dir, filenames, params, **kwargs):
     def get_categories_profiles(*args, **kwargs):
         comparison_with = kwargs.get('comparison_with')
         if comparison_with is None:
-            comparison_with = px.getParameterByName(
-                trees['method_parameters'],
-                'comparison_with',
-            )
-        categories_profiles = _get_categories_profiles(
-            trees.get('categories_profiles'),
-            comparison_with,
-        )
+            comparison_with = _get_comparison_with()
+        categories_profiles = _get_profiles(comparison_with)
         return categories_profiles  # NoneType, dict, list
 
+    #use
+    def get_comparison_with(*args, **kwargs):
+        comparison_with = _get_comparison_with()
+        return comparison_with  # str
+
     def get_categories_rank(*args, **kwargs):
         categories = px.getCategoriesID(trees['categories'])
         categories_rank = px.getCategoriesRank(trees['categories'], categories)
         return categories_rank  # dict
 
     def get_concordance(*args, **kwargs):
-        alternatives = px.getAlternativesID(trees['alternatives'])
-        comparison_with = px.getParameterByName(
-            trees['method_parameters'],
-            'comparison_with',
-        )
+        alternatives = _get_alternatives()
+        comparison_with = _get_comparison_with()
         if comparison_with in ('boundary_profiles', 'central_profiles'):
-            categories_profiles = _get_categories_profiles(
-                trees['categories_profiles'],
-                comparison_with,
-            )
+            categories_profiles = _get_profiles(comparison_with)
             concordance = _get_alternatives_comparisons(
                 trees['concordance'],
                 alternatives,
@@ -468,18 +948,12 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         return concordance  # Vividict, dict
 
     def get_credibility(*args, **kwargs):
-        alternatives = px.getAlternativesID(trees['alternatives'])
+        alternatives = _get_alternatives()
         comparison_with = kwargs.get('comparison_with')
         if not comparison_with:
-            comparison_with = px.getParameterByName(
-                trees['method_parameters'],
-                'comparison_with',
-            )
+            comparison_with = _get_comparison_with()
         if comparison_with in ('boundary_profiles', 'central_profiles'):
-            categories_profiles = _get_categories_profiles(
-                trees['categories_profiles'],
-                comparison_with,
-            )
+            categories_profiles = _get_profiles(comparison_with)
         else:
             categories_profiles = None
         eliminate_cycles_method = px.getParameterByName(
@@ -501,7 +975,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     #use
     def get_criteria(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         return criteria  # list
 
     def get_cut_threshold(*args, **kwargs):
@@ -518,16 +992,10 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     def get_cv_crossed(*args, **kwargs):
         # 'cv_crossed' stands for 'counter-veto crossed'
-        alternatives = px.getAlternativesID(trees['alternatives'])
-        comparison_with = px.getParameterByName(
-            trees['method_parameters'],
-            'comparison_with',
-        )
+        alternatives = _get_alternatives()
+        comparison_with = _get_comparison_with()
         if comparison_with in ('boundary_profiles', 'central_profiles'):
-            categories_profiles = _get_categories_profiles(
-                trees['categories_profiles'],
-                comparison_with,
-            )
+            categories_profiles = _get_profiles(comparison_with)
         else:
             categories_profiles = None
         cv_crossed = _get_alternatives_comparisons(
@@ -540,11 +1008,8 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         return cv_crossed  # Vividict
 
     def get_discordance(*args, **kwargs):
-        alternatives = px.getAlternativesID(trees['alternatives'])
-        comparison_with = px.getParameterByName(
-            trees['method_parameters'],
-            'comparison_with',
-        )
+        alternatives = _get_alternatives()
+        comparison_with = _get_comparison_with()
         if kwargs.get('use_partials') is not None:
             use_partials = kwargs.get('use_partials')
         else:
@@ -554,10 +1019,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
             )
             use_partials = True if parameter == 'true' else False
         if comparison_with in ('boundary_profiles', 'central_profiles'):
-            categories_profiles = _get_categories_profiles(
-                trees['categories_profiles'],
-                comparison_with,
-            )
+            categories_profiles = _get_profiles(comparison_with)
         else:
             categories_profiles = None
         discordance = _get_alternatives_comparisons(
@@ -570,7 +1032,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     #use
     def get_interactions(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         interactions = _get_criteria_interactions(
             trees['interactions'],
             criteria,
@@ -583,12 +1045,16 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     #use
     def get_performances(*args, **kwargs):
-        performances = px.getPerformanceTable(trees['performance_table'], None, None)
+        performances = _get_performance_table(trees['performance_table'])
         return performances  # dict
 
+    def get_performance_table_file(*args, **kwargs):
+        # for reading it incrementally (see 'iter_performance_table')
+        return trees['performance_table']  # str
+
     #use
     def get_pref_directions(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         pref_directions = px.getCriteriaPreferenceDirections(
             trees['criteria'],
             criteria,
@@ -597,10 +1063,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     #use
     def get_profiles_performance_table(*args, **kwargs):
-        comparison_with = px.getParameterByName(
-            trees['method_parameters'],
-            'comparison_with',
-        )
+        comparison_with = _get_comparison_with()
         if comparison_with in ('boundary_profiles', 'central_profiles'):
             tree = trees.get('profiles_performance_table')
             if tree is None:
@@ -609,14 +1072,14 @@ def get_input_data(input_dir, filenames, params, **kwargs):
                     "to provide 'profiles_performance_table.xml' file?)."
                 )
                 raise InputDataError(msg)
-            profiles_performance_table = px.getPerformanceTable(tree, None, None)
+            profiles_performance_table = _get_performance_table(tree)
         else:
             profiles_performance_table = None
         return profiles_performance_table  # NoneType, dict
 
     #use
     def get_reinforcement_factors(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         factors = {}
         for c in criteria:
             rf = px.getCriterionValue(
@@ -642,7 +1105,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     #use
     def get_weights(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         if len(criteria) == 0:
             msg = (
                 "File 'criteria.xml' doesn't contain valid data for this "
@@ -652,6 +1115,27 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         weights = px.getCriterionValue(trees['weights'], criteria)
         return weights  # dict
 
+    def get_weights_batch(*args, **kwargs):
+        # a list of (id, weights), one for every 'criteriaValues' element -
+        # they're identified by their 'id' attributes, or by their positions
+        criteria = _get_criteria()
+        weights_batch = []
+        for i, criteria_values in enumerate(
+                trees['weights_batch'].xpath('criteriaValues')):
+            weights_id = (criteria_values.get('id') or
+                          'weights{}'.format(i + 1))
+            weights = {}
+            for criterion_value in criteria_values.findall('criterionValue'):
+                c = criterion_value.findtext('criterionID')
+                if c in criteria:
+                    weights[c] = px.getNumericValue(criterion_value)
+            for c in criteria:
+                if type(weights.get(c)) not in (int, float):
+                    raise InputDataError("Missing weight of '{}' in the "
+                                         "'{}' weights.".format(c, weights_id))
+            weights_batch.append((weights_id, weights))
+        return weights_batch
+
     def get_param_boolean(param_name, *args, **kwargs):
         parameter = px.getParameterByName(
             trees['method_parameters'],
@@ -683,7 +1167,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
             function_ID_set_int = {1,2,3,4,5,6}
         generalised_param = get_param_string("generalised_criterion", *args, **kwargs)
         if generalised_param in ('specified'):
-            criteria = px.getCriteriaID(trees['criteria'])
+            criteria = _get_criteria()
             factors = {}
             gc = px.getCriterionValue(
                     trees['generalised_criteria'],
@@ -698,7 +1182,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
             factors = gc
         else:
             if generalised_param in function_ID_set:
-                criteria = px.getCriteriaID(trees['criteria'])
+                criteria = _get_criteria()
                 factors={}
                 for c in criteria:
                     values = {}
@@ -716,7 +1200,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 
     # use
     def get_criteria_ranking(*args, **kwargs):
-        criteria = px.getCriteriaID(trees['criteria'])
+        criteria = _get_criteria()
         if len(criteria) == 0:
             msg = (
                 "File 'criteria.xml' doesn't contain valid data for this "
@@ -731,7 +1215,7 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         'categories_profiles': get_categories_profiles,
         'categories_rank': get_categories_rank,
         'concordance': get_concordance,
-        'comparison_with': partial(get_param_string, 'comparison_with'),
+        'comparison_with': get_comparison_with,
         'credibility': get_credibility,
         'criteria': get_criteria,
         'cut_threshold': get_cut_threshold,
@@ -742,11 +1226,13 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         'only_max_discordance': partial(get_param_boolean, 'only_max_discordance'),
         'outranking': get_outranking,
         'performances': get_performances,
+        'performance_table_file': get_performance_table_file,
         'pref_directions': get_pref_directions,
         'profiles_performance_table': get_profiles_performance_table,
         'reinforcement_factors': get_reinforcement_factors,
         'thresholds': get_thresholds,
         'weights': get_weights,
+        'weights_batch': get_weights_batch,
         'with_denominator': partial(get_param_boolean, 'with_denominator'),
         'use_partials': partial(get_param_boolean, 'use_partials'),
         'use_pre_veto': partial(get_param_boolean, 'use_pre_veto'),
@@ -758,18 +1244,14 @@ def get_input_data(input_dir, filenames, params, **kwargs):
         'decimal_places': partial(get_param_integer, 'decimal_places')
     }
 
-    args = (input_dir, filenames, params)
-    trees = _get_trees(input_dir, filenames)
-    d = _create_data_object(params)
-    for p in params:
-        try:
-            f = _functions_dict[p]
-        except AttributeError:
-            raise InputDataError("Unknown parameter '{}' specified.".format(p))
+    def load(p):
         try:
-            v = f(*args, **kwargs)
-            setattr(d, p, v)
+            v = _functions_dict[p](*args, **kwargs)
         except Exception as e:
+            # with the 'lazy' validation, an invalid file is the most likely
+            # cause of the problem, so it takes precedence
+            if px.XMCDA_VALIDATION == 'lazy':
+                _validate_trees(trees)
             if type(e) is InputDataError:
                 raise
             else:
@@ -780,11 +1262,21 @@ def get_input_data(input_dir, filenames, params, **kwargs):
                 raise InputDataError(msg)
         # this check below may be a bit unnecessary, but it won't hurt either
         if type(v) in (list, dict, Vividict) and len(v) == 0:
+            if px.XMCDA_VALIDATION == 'lazy':
+                _validate_trees(trees)
             msg = (
                 "File '{}.xml' doesn't contain valid data for this method."
                 .format(p)
             )
             raise InputDataError(msg)
+        return v
+
+    args = (input_dir, filenames, params)
+    trees = _get_trees(input_dir, filenames)
+    for p in params:
+        if p not in _functions_dict:
+            raise InputDataError("Unknown parameter '{}' specified.".format(p))
+    d = InputData(dict((p, partial(load, p)) for p in params))
     return d
 
 
@@ -792,41 +1284,46 @@ def get_input_data(input_dir, filenames, params, **kwargs):
 # Converting the output into the XMCDA format.                                #
 ###############################################################################
 
-# 'comparables' should be a tuple e.g. (('a01', 'a02', 'a03'), ('b01', 'b02')).
-# The order of nodes in xml file will be derived from its content.
-# All the sorting should be done here (i.e. before serialization), I think.
-def comparisons_to_xmcda(comparisons, comparables, use_partials=False,
-                         mcda_concept=None):
+# XXX maybe it's better to get/set those types globally?
+# (i.e. for the whole file)
+def _get_value_type(value):
+    if type(value) == float:
+        value_type = 'real'
+    elif type(value) == int:
+        value_type = 'integer'
+    elif type(value) in (str, unicode):
+        value_type = 'label'
+    elif type(value) == bool:
+        value_type = 'boolean'
+    else:
+        raise RuntimeError("Unknown type '{}'.".format(type(value)))
+    return value_type
 
-    # XXX maybe it's better to get/set those types globally?
-    # (i.e. for the whole file)
-    def _get_value_type(value):
-        if type(value) == float:
-            value_type = 'real'
-        elif type(value) == int:
-            value_type = 'integer'
-        elif type(value) in (str, unicode):
-            value_type = 'label'
-        elif type(value) == bool:
-            value_type = 'boolean'
-        else:
-            raise RuntimeError("Unknown type '{}'.".format(type(value)))
-        return value_type
 
+def _get_ordering(comparables):
     if len(comparables) != 2:
         raise RuntimeError("You have to specify exactly 2 comparables for "
                            "this serialization function (instead of {})."
                            .format(len(comparables)))
     elif comparables[0] == comparables[1]:  # alternatives vs alternatives
-        ordering = [(a, b) for a in comparables[0] for b in comparables[0]]
+        for a in comparables[0]:
+            for b in comparables[0]:
+                yield (a, b)
     else:  # alternatives vs profiles
-        ordering = []
         for a in comparables[0]:
             for b in comparables[1]:
-                ordering.append((a, b))
+                yield (a, b)
         for b in comparables[1]:
             for a in comparables[0]:
-                ordering.append((b, a))
+                yield (b, a)
+
+
+# 'comparables' should be a tuple e.g. (('a01', 'a02', 'a03'), ('b01', 'b02')).
+# The order of nodes in xml file will be derived from its content.
+# All the sorting should be done here (i.e. before serialization), I think.
+def comparisons_to_xmcda(comparisons, comparables, use_partials=False,
+                         mcda_concept=None):
+    ordering = _get_ordering(comparables)
     if not mcda_concept:
         xmcda = etree.Element('alternativesComparisons')
     else:
@@ -864,6 +1361,218 @@ def comparisons_to_xmcda(comparisons, comparables, use_partials=False,
     return xmcda
 
 
+def comparisons_to_pairs(comparisons, comparables):
+    """Yields (initial, terminal, value) for every pair from 'comparisons',
+    in the same order as in 'comparisons_to_xmcda'.
+    """
+    for a, b in _get_ordering(comparables):
+        yield (a, b, comparisons[a][b])
+
+
+def matrix_to_pairs(matrix, rows, columns):
+    """Yields (initial, terminal, value) for every cell of 'matrix', where
+    'rows' and 'columns' are the ids related to its rows and columns.
+    """
+    for i, a in enumerate(rows):
+        for b, value in zip(columns, matrix[i].tolist()):
+            yield (a, b, value)
+
+
+def tiles_to_pairs(tiles, rows, columns):
+    """Same as 'matrix_to_pairs', but for a matrix given as a sequence of
+    tuples (rows, columns, tile), where 'rows' and 'columns' are the slices
+    which the 'tile' covers (see 'get_tiles'). Every tile can be freed as
+    soon as its pairs have been consumed.
+    """
+    for tile_rows, tile_columns, tile in tiles:
+        for pair in matrix_to_pairs(tile, rows[tile_rows],
+                                    columns[tile_columns]):
+            yield pair
+
+
+def _escape_text(value):
+    if type(value) is unicode:
+        value = value.encode('utf-8')
+    return escape(str(value))
+
+
+def _escape_attribute(value):
+    if type(value) is unicode:
+        value = value.encode('utf-8')
+    return escape(str(value),
+                  {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'})
+
+
+class ComparisonsWriter(object):
+    """Writes 'alternativesComparisons' straight to the file, pair after pair,
+    so the pairs don't have to be kept in memory (neither as a tree, nor as
+    nested dicts). The output is exactly the same as the one produced by
+    'write_xmcda(comparisons_to_xmcda(...), filename)'.
+    Pairs are given as (initial, terminal, value) tuples, where 'value' is
+    a dict of values when 'use_partials' is set.
+    """
+
+    def __init__(self, filename, use_partials=False, mcda_concept=None):
+        self.use_partials = use_partials
+        self.pairs_written = 0
+        try:
+            self.f = open(filename, 'w')
+            self.f.write(HEADER)
+            if not mcda_concept:
+                self.f.write('<alternativesComparisons>\n')
+            else:
+                self.f.write('<alternativesComparisons mcdaConcept="{}">\n'
+                             .format(_escape_attribute(mcda_concept)))
+        except IOError as e:
+            raise IOError("{}: '{}'".format(e.strerror, e.filename))
+
+    def _format_value(self, value, indent, value_id=None):
+        value_type = _get_value_type(value)
+        if value_type == 'boolean':
+            text = 'true' if value is True else 'false'
+        else:
+            text = _escape_text(value)
+        if value_id is None:
+            tag = '<value>'
+        else:
+            tag = '<value id="{}">'.format(_escape_attribute(value_id))
+        return ('{0}{1}\n{0}  <{2}>{3}</{2}>\n{0}</value>\n'
+                .format(indent, tag, value_type, text))
+
+    def format_pair(self, initial, terminal, value):
+        """Returns the text of the pair, as it's written by 'write'."""
+        if self.use_partials:
+            items = sorted(value.items(), key=lambda x: x[0])
+            values = ''.join([self._format_value(v, ' ' * 8, value_id=i)
+                              for i, v in items])
+            if values:
+                values = '      <values>\n' + values + '      </values>\n'
+            else:
+                values = '      <values/>\n'
+        else:
+            values = self._format_value(value, ' ' * 6)
+        return ('    <pair>\n'
+                '      <initial>\n'
+                '        <alternativeID>{}</alternativeID>\n'
+                '      </initial>\n'
+                '      <terminal>\n'
+                '        <alternativeID>{}</alternativeID>\n'
+                '      </terminal>\n'
+                '{}'
+                '    </pair>\n'
+                .format(_escape_text(initial), _escape_text(terminal), values))
+
+    def write(self, initial, terminal, value):
+        if self.pairs_written == 0:
+            self.f.write('  <pairs>\n')
+        self.f.write(self.format_pair(initial, terminal, value))
+        self.pairs_written += 1
+
+    def write_formatted(self, f, count):
+        """Copies 'count' pairs, already formatted with 'format_pair', from
+        the file object 'f' (from its beginning) - e.g. the pairs which had
+        to be put aside, because they come later in the output.
+        """
+        if count == 0:
+            return
+        if self.pairs_written == 0:
+            self.f.write('  <pairs>\n')
+        f.seek(0)
+        shutil.copyfileobj(f, self.f)
+        self.pairs_written += count
+
+    def write_pairs(self, pairs):
+        for initial, terminal, value in pairs:
+            self.write(initial, terminal, value)
+
+    def write_block(self, rows, columns, block):
+        self.write_pairs(matrix_to_pairs(block, rows, columns))
+
+    def close(self):
+        if self.pairs_written == 0:
+            self.f.write('  <pairs/>\n')
+        else:
+            self.f.write('  </pairs>\n')
+        self.f.write('</alternativesComparisons>\n')
+        self.f.write(FOOTER)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class MatrixWriter(object):
+    """Binary counterpart of 'ComparisonsWriter' - writes numeric comparisons
+    of 'comparables' as a square matrix in the '.npy' format (rows are the
+    initial elements, columns the terminal ones, NaN where there's no pair),
+    with the ids of its rows/columns and their sums in separate files (see
+    'save_matrix_index'). Such a file can be memory-mapped by the next module
+    instead of being parsed (see '_get_alternatives_comparisons_npy').
+    Values are given block by block, as (rows, columns, block), where 'rows'
+    and 'columns' are the ids related to the rows and columns of 'block'
+    (every pair is expected to be given once at most).
+    """
+
+    def __init__(self, filename, comparables):
+        self.filename = filename
+        self.comparables = list(comparables)
+        self.index = dict((c, i) for i, c in enumerate(self.comparables))
+        size = len(self.comparables)
+        self.sums = np.zeros((2, size))
+        # numbers of values given for every row/column - the sums of the
+        # incomplete ones are NaN
+        self.counts = np.zeros((2, size), dtype=int)
+        remove_matrix_index(filename)
+        try:
+            self.matrix = np.lib.format.open_memmap(filename, mode='w+',
+                                                    dtype=float,
+                                                    shape=(size, size))
+        except IOError as e:
+            raise IOError("{}: '{}'".format(e.strerror, e.filename))
+        self.matrix.fill(np.nan)
+
+    def write_block(self, rows, columns, block):
+        rows = [self.index[r] for r in rows]
+        columns = [self.index[c] for c in columns]
+        self.matrix[np.ix_(rows, columns)] = block
+        self.sums[0, rows] += block.sum(axis=1)
+        self.sums[1, columns] += block.sum(axis=0)
+        self.counts[0, rows] += len(columns)
+        self.counts[1, columns] += len(rows)
+
+    def close(self):
+        self.matrix.flush()
+        del self.matrix
+        self.sums[self.counts < len(self.comparables)] = np.nan
+        save_matrix_index(self.filename, self.comparables, self.sums)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            del self.matrix
+
+
+def write_comparisons_xmcda(pairs, filename, use_partials=False,
+                            mcda_concept=None):
+    """Streaming counterpart of 'write_xmcda(comparisons_to_xmcda(...))' -
+    'pairs' may be any iterable (e.g. a generator) of (initial, terminal,
+    value) tuples, see 'ComparisonsWriter'.
+    """
+    with ComparisonsWriter(filename, use_partials=use_partials,
+                           mcda_concept=mcda_concept) as writer:
+        writer.write_pairs(pairs)
+
+
 def outranking_to_xmcda(outranking, mcda_concept=None):
 
     def _extract(dict_in, list_of_tuples_out, outer_key=None):
@@ -972,6 +1681,8 @@ def get_error_message(err):
 def create_messages_file(error_messages, log_messages, out_dir):
     if not out_dir:
         return
+    # the files accepted without validation are always reported
+    log_messages = list(log_messages or []) + px.getValidationMessages()
     xmcda = etree.Element('methodMessages')
     if error_messages:
         for err_msg in error_messages:
@@ -984,3 +1695,269 @@ def create_messages_file(error_messages, log_messages, out_dir):
             log_msg_node_text = etree.SubElement(log_msg_node, 'text')
             log_msg_node_text.text = etree.CDATA(log_msg.strip())
     write_xmcda(xmcda, os.path.join(out_dir, 'messages.xml'))
+
+
+###############################################################################
+# Caching the results.                                                        #
+###############################################################################
+
+# options which don't change the outputs of a module, so they're not a part
+# of the key of its results in the cache
+CACHE_NEUTRAL_OPTIONS = ('-i', '-o', '--cache', '--cache-size', '--max-memory',
+                         '--workers', '--help', '--version')
+
+
+def _get_file_hash(file_name):
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(partial(f.read, 2 ** 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _get_canonical_hash(file_name):
+    """Hash of the contents of an XML file, as parsed - it doesn't depend on
+    the formatting of the file, i.e. on the whitespace around the values,
+    comments, the order of attributes or the prefixes of namespaces. The
+    file is parsed element after element, so it's never kept in memory.
+    """
+    h = hashlib.sha1()
+    for event, element in etree.iterparse(file_name, events=('start', 'end'),
+                                          remove_comments=True,
+                                          remove_pis=True):
+        if event == 'start':
+            attributes = u' '.join(u'{}="{}"'.format(k, v) for k, v in
+                                  sorted(element.attrib.items()))
+            h.update(u'<{} {}>'.format(element.tag, attributes)
+                     .encode('utf-8'))
+        else:
+            # the text is complete only at the end of the element
+            h.update(u'{}</>'.format((element.text or '').strip())
+                     .encode('utf-8'))
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return h.hexdigest()
+
+
+def get_inputs_hash(input_dir, filenames):
+    """Hash of the input files of a module, i.e. of the 'filenames' found in
+    'input_dir' (and of the files named the same, but with other extensions,
+    e.g. 'aggregated_preferences.npy'). XML files are hashed as parsed (see
+    '_get_canonical_hash'), the other ones as they are.
+    """
+    names = set(os.path.splitext(f)[0] for f, is_optional in filenames)
+    h = hashlib.sha1()
+    for f in sorted(os.listdir(input_dir)):
+        file_name = os.path.join(input_dir, f)
+        if (os.path.splitext(f)[0] not in names or
+                not os.path.isfile(file_name)):
+            continue
+        if f.endswith('.xml'):
+            file_hash = _get_canonical_hash(file_name)
+        else:
+            file_hash = _get_file_hash(file_name)
+        h.update('{} {}\n'.format(f, file_hash))
+    return h.hexdigest()
+
+
+def _get_files_state(directory):
+    state = {}
+    for f in os.listdir(directory):
+        file_name = os.path.join(directory, f)
+        if os.path.isfile(file_name):
+            stat = os.stat(file_name)
+            state[f] = (stat.st_mtime, stat.st_size)
+    return state
+
+
+class ResultCache(object):
+    """On-disk cache of the results of a module, i.e. of its output files
+    (except 'messages.xml'), for one run - see 'get_result_cache'.
+    Every entry of the cache is a directory named after its key. When all of
+    them take more than 'max_size' bytes, the least recently used ones are
+    removed. The numbers of hits and misses (of all the runs) are kept in the
+    cache as well, and reported in 'messages.xml'.
+    Besides the results, the cache keeps the partial results which may be
+    shared by runs with different inputs (see 'get_array').
+    """
+
+    def __init__(self, directory, max_size, key, output_dir, code_key=''):
+        self.directory = directory
+        self.max_size = max_size
+        self.key = key
+        self.output_dir = output_dir
+        self.entry = os.path.join(directory, key)
+        # the part of the key related to the code of the module
+        self.code_key = code_key
+        # to tell which files are written by the module
+        self.output_state = _get_files_state(output_dir)
+        # partial results of this run taken from the cache / computed
+        self.arrays = {'hits': 0, 'misses': 0}
+
+    @contextmanager
+    def _locked(self):
+        # entries and stats are shared by all the processes using the cache
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _count(self, counter):
+        stats_file = os.path.join(self.directory, '.stats')
+        try:
+            with open(stats_file) as f:
+                stats = json.load(f)
+        except (IOError, ValueError):
+            stats = {'hits': 0, 'misses': 0}
+        stats[counter] += 1
+        with open(stats_file, 'w') as f:
+            json.dump(stats, f)
+        return stats
+
+    def _write_messages(self, stats, message, log_messages=()):
+        messages = ['Everything OK.']
+        messages.extend(log_messages)
+        messages.append('{} (hits: {}, misses: {}).'.format(
+            message, stats['hits'], stats['misses']))
+        if self.arrays['hits'] or self.arrays['misses']:
+            messages.append('Partial results taken from the cache: {}, '
+                            'computed: {}.'.format(self.arrays['hits'],
+                                                   self.arrays['misses']))
+        create_messages_file(None, messages, self.output_dir)
+
+    def _evict(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f))
+                       for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        total_size = sum(size for mtime, size, entry in entries)
+        for mtime, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry)
+            total_size -= size
+
+    def _make_temp_entry(self):
+        # entries are written to a temporary directory and renamed then, but
+        # 'mkdtemp' creates it with mode 0700 - the cache may be shared, so
+        # the entries should have the permissions implied by the umask
+        temp_dir = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_dir, 0o777 & ~umask)
+        return temp_dir
+
+    def get_array(self, key, compute):
+        """Returns the array stored in the cache under 'key' (along with the
+        code of the module), or - when there's no such array - the one
+        returned by 'compute()', which is stored then. The 'key' has to
+        describe everything the array depends on.
+        """
+        key = hashlib.sha1(self.code_key + key).hexdigest()
+        entry = os.path.join(self.directory, key)
+        with self._locked():
+            if os.path.isdir(entry):
+                os.utime(entry, None)
+                array = np.load(os.path.join(entry, 'array.npy'))
+                self.arrays['hits'] += 1
+                return array
+        array = compute()
+        self.arrays['misses'] += 1
+        temp_dir = self._make_temp_entry()
+        np.save(os.path.join(temp_dir, 'array.npy'), array)
+        with self._locked():
+            if os.path.isdir(entry):
+                shutil.rmtree(temp_dir)
+            else:
+                os.rename(temp_dir, entry)
+            self._evict()
+        return array
+
+    def restore(self):
+        """Copies the results to the output directory, if they're in the cache
+        already. Returns True when they are.
+        """
+        with self._locked():
+            if not os.path.isdir(self.entry):
+                self.stats = self._count('misses')
+                return False
+            # most recently used
+            os.utime(self.entry, None)
+            for f in os.listdir(self.entry):
+                shutil.copy(os.path.join(self.entry, f), self.output_dir)
+            stats = self._count('hits')
+        self._write_messages(stats, 'Results taken from the cache')
+        return True
+
+    def store(self, log_messages=()):
+        """Stores the results (i.e. the files written to the output directory
+        since the cache has been created) in the cache. 'messages.xml' is
+        written again, with 'log_messages' of the module (if any) and the
+        statistics of the cache.
+        """
+        output_state = _get_files_state(self.output_dir)
+        temp_dir = self._make_temp_entry()
+        for f, state in output_state.items():
+            if f != 'messages.xml' and self.output_state.get(f) != state:
+                shutil.copy(os.path.join(self.output_dir, f), temp_dir)
+        with self._locked():
+            if os.path.isdir(self.entry):
+                shutil.rmtree(temp_dir)
+            else:
+                os.rename(temp_dir, self.entry)
+            self._evict()
+            stored = os.path.isdir(self.entry)
+        if stored:
+            self._write_messages(self.stats, 'Results stored in the cache',
+                                 log_messages)
+        else:
+            self._write_messages(self.stats, 'Results too big for the cache',
+                                 log_messages)
+
+
+def get_result_cache(args, module_file, input_dir, output_dir, filenames):
+    """Returns the 'ResultCache' of this run of the module (whose main script
+    is 'module_file'), if the '--cache' option is given - None otherwise, or
+    when the inputs can't be read (that's reported by the module itself).
+    The key of the results consists of the code of the module, its options
+    which change the outputs and the inputs (see 'get_inputs_hash').
+    """
+    directory = args.get('--cache')
+    if directory is None:
+        return None
+    value = args.get('--cache-size')
+    try:
+        max_size = float(value)
+    except (TypeError, ValueError):
+        max_size = -1
+    if max_size < 0:
+        raise InputDataError("Invalid value of the '--cache-size' option: "
+                             "'{}'.".format(value))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # it might have been created by another process in the meantime
+            if not os.path.isdir(directory):
+                raise
+    h = hashlib.sha1()
+    module_dir = os.path.dirname(os.path.abspath(module_file))
+    for f in sorted(glob.glob(os.path.join(module_dir, '*.py'))):
+        h.update('{} {}\n'.format(os.path.basename(f), _get_file_hash(f)))
+    code_key = h.hexdigest()
+    options = sorted((k, v) for k, v in args.items()
+                     if k not in CACHE_NEUTRAL_OPTIONS)
+    h.update(json.dumps(options))
+    try:
+        h.update(get_inputs_hash(input_dir, filenames))
+    except (etree.LxmlError, IOError):
+        return None
+    return ResultCache(directory, int(max_size * 2 ** 20), h.hexdigest(),
+                       output_dir, code_key)
@@ -4,7 +4,7 @@
 PrometheeSRF - computes weights of criteria using the revised Simos procedure
 
 Usage:
-    PrometheeSRF.py -i DIR -o DIR
+    PrometheeSRF.py -i DIR -o DIR [--cache=DIR] [--cache-size=MB]
 
 Options:
     -i DIR     Specify input directory. It should contain the following files:
@@ -14,6 +14,12 @@ Options:
     -o DIR     Specify output directory. Files generated as output:
                    weights.xml
                    messages.xml
+    --cache=DIR  Directory of the cache of results - when the same inputs
+               (up to their formatting) have already been processed with the
+               same options, the outputs are copied from there instead of
+               being computed again.
+    --cache-size=MB  Size limit of the cache - the least recently used
+               results are removed from it when it's exceeded [default: 1024].
     --version  Show version.
     -h --help  Show this screen.
 """
@@ -26,7 +32,8 @@ import os
 from unicodedata import decimal
 from docopt import docopt
 from common import comparisons_to_xmcda, create_messages_file, get_dirs, \
-    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict, weights_to_xmcda
+    get_error_message, get_input_data, get_linear, omega, write_xmcda, Vividict, weights_to_xmcda, \
+    get_result_cache
 from networkx.classes.function import non_edges
 from math import floor, ceil
 
@@ -104,12 +111,19 @@ def main():
         args = docopt(__doc__, version=__version__)
         output_dir = None
         input_dir, output_dir = get_dirs(args)
+        result_cache = get_result_cache(args, __file__, input_dir, output_dir,
+                                        filenames)
+        if result_cache is not None and result_cache.restore():
+            return 0
 
         data = get_input_data(input_dir, filenames, params)
 
         weights = get_weights(data.criteria_ranking, data.method)
 
         finalize(weights, output_dir)
+        if result_cache is not None:
+            result_cache.store()
+
         return 0
 
     except Exception, err: